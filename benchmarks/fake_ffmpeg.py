@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+A stand-in for ffmpeg isolating the API overhead in benchmarks. Select it with
+FFMPEG_COMMAND='benchmarks/fake_ffmpeg.py -i "RTSP_STREAM" FILENAME'.
+
+It writes filler bytes into the output file (the last argument) at FAKE_FFMPEG_BITRATE_KBPS,
+reports -progress output if requested and exits once it gets 'q' or EOF on stdin.
+"""
+import os
+import sys
+import threading
+import time
+
+BITRATE_KBPS = float(os.getenv("FAKE_FFMPEG_BITRATE_KBPS", 2000))
+STARTUP_DELAY_SEC = float(os.getenv("FAKE_FFMPEG_STARTUP_DELAY_SEC", 0))
+TICK_SEC = 0.1
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    report_progress = "-progress" in args
+    output = args[-1]
+    stopped = threading.Event()
+
+    def watch_stdin() -> None:
+        while True:
+            char = sys.stdin.read(1)
+
+            if not char or char == "q":
+                stopped.set()
+                return
+
+    threading.Thread(target=watch_stdin, daemon=True).start()
+    time.sleep(STARTUP_DELAY_SEC)
+    started_at = time.monotonic()
+    chunk = b"\0" * int(BITRATE_KBPS * 1000 / 8 * TICK_SEC)
+    total_size, tick = 0, 0
+
+    with open(output, "wb") as f:
+        while not stopped.wait(TICK_SEC):
+            f.write(chunk)
+            total_size += len(chunk)
+            tick += 1
+
+            if report_progress and tick % 5 == 0:
+                elapsed = time.monotonic() - started_at
+                print(
+                    f"frame={int(elapsed * 25)}\nfps=25.0\nbitrate={BITRATE_KBPS:.1f}kbits/s\n"
+                    f"total_size={total_size}\nout_time_us={int(elapsed * 1e6)}\n"
+                    f"dup_frames=0\ndrop_frames=0\nspeed=1.0x\nprogress=continue",
+                    flush=True,
+                )
+
+    if report_progress:
+        print("progress=end", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Offline benchmark of the cameraman API.
+
+Spawns the app (see server.py) with N stand-in cameras and drives it with M concurrent start/stop cycles
+while polling /records and /cameras. Reports p50/p95/p99 latencies per endpoint, peak RSS of the server
+and the number of processes it spawned as JSON, so that the results can be compared between versions.
+
+Usage:
+    python benchmarks/run.py --cameras 8 --concurrency 16 --cycles 5 --output bench_output.json
+    python benchmarks/run.py --ffmpeg real  # use a real ffmpeg reading a generated sample file
+"""
+import argparse
+import json
+import os
+import platform
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+HEADERS = {"rfid-card-id": "1111111111"}
+FAKE_FFMPEG_COMMAND = f'{os.path.join(BENCHMARKS_DIR, "fake_ffmpeg.py")} -i "RTSP_STREAM" FILENAME'
+REAL_FFMPEG_COMMAND = "ffmpeg -loglevel warning -re -stream_loop -1 -i {sample} -c copy -map 0 FILENAME"
+
+
+class FakeCameras:
+    """TCP listeners standing in for the cameras, so that health probes of the app succeed"""
+
+    def __init__(self, count: int) -> None:
+        self.sockets = [socket.create_server(("127.0.0.1", 0)) for _ in range(count)]
+        self._selector = selectors.DefaultSelector()
+        self._stopped = threading.Event()
+
+        for sock in self.sockets:
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ)
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def ports(self) -> tp.List[int]:
+        return [sock.getsockname()[1] for sock in self.sockets]
+
+    def _serve(self) -> None:
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=0.1):
+                try:
+                    connection, _ = key.fileobj.accept()  # type: ignore
+                    connection.close()
+                except BlockingIOError:
+                    pass
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+        for sock in self.sockets:
+            sock.close()
+
+
+@dataclass
+class ProcessSampler:
+    """samples resource usage of the server process and its descendants in the background"""
+
+    pid: int
+    interval: float = 0.05
+    peak_rss_bytes: int = 0
+    peak_children: int = 0
+    spawned: tp.Set[int] = field(default_factory=set)
+    _stopped: threading.Event = field(default_factory=threading.Event)
+
+    def __post_init__(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _read_status(pid: int, key: str) -> int:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _descendants(self) -> tp.Set[int]:
+        parents: tp.Dict[int, int] = {}
+
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+
+        found, frontier = set(), {self.pid}
+
+        while frontier:
+            frontier = {pid for pid, ppid in parents.items() if ppid in frontier} - found
+            found |= frontier
+
+        return found
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.peak_rss_bytes = max(self.peak_rss_bytes, self._read_status(self.pid, "VmHWM:"))
+            except OSError:
+                return
+
+            children = self._descendants()
+            self.spawned |= children
+            self.peak_children = max(self.peak_children, len(children))
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+class Latencies:
+    """thread safe collection of request latencies grouped by endpoint"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: tp.Dict[str, tp.List[float]] = {}
+        self.errors: tp.Dict[str, int] = {}
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs: tp.Any) -> tp.Optional[tp.Dict[str, tp.Any]]:
+        started_at = time.perf_counter()
+
+        try:
+            response = requests.request(method, url, headers=HEADERS, timeout=120, **kwargs)
+            body: tp.Dict[str, tp.Any] = response.json()
+            failed = not response.ok or body.get("status", 200) >= 400
+        except (requests.RequestException, ValueError):
+            body, failed = {}, True
+
+        elapsed = time.perf_counter() - started_at
+
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if failed:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+        return None if failed else body
+
+    def summary(self) -> tp.Dict[str, tp.Dict[str, float]]:
+        return {
+            endpoint: {
+                "count": len(samples),
+                "errors": self.errors.get(endpoint, 0),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+            for endpoint, samples in sorted(self.samples.items())
+        }
+
+
+def percentile(samples: tp.List[float], pct: float) -> float:
+    """nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(int(-(-pct * len(ordered) // 100)) - 1, 0)
+    return ordered[rank]
+
+
+def make_sample(directory: str, duration: int = 10) -> str:
+    """generate a short h264 sample for the real ffmpeg mode"""
+    sample = os.path.join(directory, "sample.mp4")
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc=size=640x480:rate=25:duration={duration}"]
+        + ["-c:v", "libx264", "-g", "25", "-pix_fmt", "yuv420p", "-y", sample],
+        check=True,
+    )
+    return sample
+
+
+def wait_until_ready(url: str, server: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            requests.get(f"{url}/cameras", headers=HEADERS, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    raise TimeoutError("Server did not start in time")
+
+
+def run_benchmark(args: argparse.Namespace) -> tp.Dict[str, tp.Any]:
+    workdir = tempfile.mkdtemp(prefix="cameraman-bench-")
+    cameras = FakeCameras(args.cameras)
+    ffmpeg_command = REAL_FFMPEG_COMMAND.format(sample=make_sample(workdir)) if args.ffmpeg == "real" else None
+    env = {
+        **os.environ,
+        "CAMERAS_CONFIG": json.dumps(
+            [f"{i + 1}-127.0.0.1:{port}-rtsp://127.0.0.1:{port}" for i, port in enumerate(cameras.ports)]
+        ),
+        "MONGODB_URI": os.getenv("MONGODB_URI", "mongodb://127.0.0.1/benchmark"),
+        "FFMPEG_COMMAND": ffmpeg_command or FAKE_FFMPEG_COMMAND,
+    }
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, "server.py"), "--port", str(args.port)],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    latencies = Latencies()
+
+    try:
+        wait_until_ready(url, server)
+        sampler = ProcessSampler(server.pid)
+        load_finished = threading.Event()
+
+        def cycle(worker: int) -> None:
+            camera_number = worker % args.cameras + 1
+
+            for _ in range(args.cycles):
+                body = latencies.request("/camera/{n}/start", "POST", f"{url}/camera/{camera_number}/start")
+
+                if body is None:
+                    continue
+
+                time.sleep(args.hold)
+                params = {"background": "true"} if args.background_stop else {}
+                latencies.request("/record/{id}/stop", "POST", f"{url}/record/{body['record_id']}/stop", params=params)
+
+        def poll(endpoint: str) -> None:
+            while not load_finished.wait(args.poll_interval):
+                latencies.request(endpoint, "GET", f"{url}{endpoint}")
+
+        started_at = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency + 2) as executor:
+            pollers = [executor.submit(poll, endpoint) for endpoint in ("/records", "/cameras")]
+            list(executor.map(cycle, range(args.concurrency)))
+            load_finished.set()
+
+            for poller in pollers:
+                poller.result()
+
+        wall_time = time.monotonic() - started_at
+        sampler.stop()
+
+    finally:
+        server.send_signal(signal.SIGINT)
+
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+        cameras.close()
+
+    return {
+        "parameters": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "workdir": workdir},
+        "wall_time_sec": wall_time,
+        "endpoints": latencies.summary(),
+        "peak_rss_bytes": sampler.peak_rss_bytes,
+        "processes_spawned": len(sampler.spawned),
+        "peak_concurrent_processes": sampler.peak_children,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, default=8, help="number of stand-in cameras (N)")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent start/stop cycles (M)")
+    parser.add_argument("--cycles", type=int, default=3, help="start/stop cycles per concurrent worker")
+    parser.add_argument("--hold", type=float, default=3.5, help="seconds to record before stopping")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="interval of /records and /cameras polling")
+    parser.add_argument("--background-stop", action="store_true", help="stop records with ?background=true")
+    parser.add_argument("--ffmpeg", choices=("fake", "real"), default="fake", help="ffmpeg implementation to use")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--output", help="write the JSON report into a file instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="show server errors")
+    args = parser.parse_args()
+
+    report = json.dumps(run_benchmark(args), indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Runs the app for benchmarks with an in-memory stand-in for the MongoDB employee collection,
+so that no database is needed. Expects the same environment variables as the app itself.
+"""
+import argparse
+import os
+import sys
+import typing as tp
+
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from app import app  # noqa: E402
+from auth.database import MongoDbWrapper  # noqa: E402
+from auth.dependencies import TESTING_VALUE  # noqa: E402
+
+
+class InMemoryCollection:
+    """a stand-in for the Motor collection used by MongoDbWrapper"""
+
+    def __init__(self, documents: tp.List[tp.Dict[str, str]]) -> None:
+        self.documents = documents
+
+    async def find_one(self, query: tp.Dict[str, str], projection: tp.Dict[str, int]) -> tp.Optional[tp.Dict[str, str]]:
+        key, value = next(iter(query.items()))
+        return next((dict(doc) for doc in self.documents if doc.get(key) == value), None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    MongoDbWrapper()._employee_collection = InMemoryCollection(
+        [{"rfid_card_id": TESTING_VALUE, "name": "Benchmark", "position": "Operator"}]
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
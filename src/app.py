@@ -1,29 +1,70 @@
 import asyncio
 import typing as tp
+from dataclasses import asdict
+from datetime import datetime
+from uuid import uuid4
 
 import uvicorn
-from fastapi import Depends, FastAPI, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
 from auth.database import MongoDbWrapper
-from auth.dependencies import authenticate
-from feecc_cameraman.camera import CAMERAS, Camera, RECORDS, Recording
-from feecc_cameraman.dependencies import get_camera_by_number, get_record_by_id
+from auth.dependencies import EMPLOYEE_CACHE, authenticate
+from feecc_cameraman.batch import (
+    ItemResult,
+    discard_recording,
+    get_group_records,
+    start_batch,
+    start_camera_recording,
+    stop_batch,
+)
+from feecc_cameraman.camera import CAMERAS, Camera, Recording
+from feecc_cameraman.dependencies import get_camera_by_number, get_job_by_id, get_record_by_id
+from feecc_cameraman.events import EVENTS, publish_progress
+from feecc_cameraman.health import HEALTH, get_health, monitor_cameras_health, probe_cameras
+from feecc_cameraman import metrics
+from feecc_cameraman.ingest import INGESTS
+from feecc_cameraman.jobs import FinalizationJob, JobState, start_finalization
 from feecc_cameraman.models import (
+    BatchItemModel,
+    BatchResponse,
+    BatchStartRequest,
+    BatchStopRequest,
     CameraList,
+    CapacityResponse,
     CameraModel,
+    CamerasConfig,
+    CamerasReloadResponse,
+    FinalizationJobModel,
+    FinalizationJobResponse,
     GenericResponse,
+    ProgressModel,
     RecordData,
     RecordList,
+    RecordResponse,
     StartRecordResponse,
     StopRecordResponse,
+    StorageStats,
 )
+from feecc_cameraman.output import RECOVER_ORPHANED_FILES, recover_orphaned_files
+from feecc_cameraman.pipeline import POSTPROCESSOR
+from feecc_cameraman.preroll import RINGS, stop_segment_rings
+from feecc_cameraman.reload import reload_cameras, sync_segment_rings, watch_cameras_config
+from feecc_cameraman.resources import RESOURCES, CapacityError
+from feecc_cameraman.snapshot import FEEDS, get_feed, snapshot_response, stop_snapshot_feeds
+from feecc_cameraman.state import CLUSTER, ClusterRoutingMiddleware
+from feecc_cameraman.storage import STORAGE, InsufficientStorageError
+from feecc_cameraman.store import RECORDS
 from feecc_cameraman.utils import end_stuck_records
+from feecc_cameraman.tracing import TracingMiddleware
+from feecc_cameraman.transcode import TRANSCODER
+from feecc_cameraman.video import serve_video
 from logging_config import CONSOLE_LOGGING_CONFIG, FILE_LOGGING_CONFIG
 
 # apply logging configuration
-logger.configure(handlers=[CONSOLE_LOGGING_CONFIG, FILE_LOGGING_CONFIG])
+logger.configure(handlers=[CONSOLE_LOGGING_CONFIG, FILE_LOGGING_CONFIG], extra={"trace_id": "-"})
 
 # set up an ASGI app
 app = FastAPI(
@@ -41,47 +82,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# proxy camera and record scoped requests to their owner workers
+app.add_middleware(ClusterRoutingMiddleware)
+
+# measure request latency, including the proxied requests
+app.add_middleware(metrics.MetricsMiddleware)
+
+# tag logs of every request with a trace id and log its timed phases
+app.add_middleware(TracingMiddleware)
+
+
+def get_record_data(record: Recording) -> RecordData:
+    """collect the record details including its live ffmpeg metrics"""
+    progress = record.progress
+
+    return RecordData(
+        filename=record.filename,
+        record_id=record.record_id,
+        start_time=record.start_time,
+        end_time=record.end_time,
+        camera_number=record.camera_number,
+        state=record.state,
+        error=record.error,
+        metadata=record.metadata,
+        progress=None
+        if progress is None
+        else ProgressModel(**asdict(progress), seconds_since_last_frame=progress.seconds_since_last_frame),
+    )
+
+
+def get_busy_cameras() -> tp.Set[int]:
+    """cameras which have ongoing recordings, always-on segment rings or running snapshot feeds on this worker"""
+    recording = {record.camera_number for record in RECORDS.values() if record.camera_number is not None}
+    return recording | set(RINGS) | {number for number, feed in FEEDS.items() if feed.is_running}
+
 
 @app.post(
     "/camera/{camera_number}/start",
     dependencies=[Depends(authenticate)],
-    response_model=tp.Union[StartRecordResponse, GenericResponse],  # type: ignore
+    response_model=tp.Union[StartRecordResponse, CapacityResponse, GenericResponse],  # type: ignore
 )
 async def start_recording(
+    response: Response,
     camera: Camera = Depends(get_camera_by_number),
+    max_duration: tp.Optional[int] = Query(None, gt=0),
+    group_id: tp.Optional[str] = None,
 ) -> tp.Union[StartRecordResponse, GenericResponse]:
-    """start recording a video using specified camera"""
-    record = Recording(camera.rtsp_stream_link)
+    """
+    start recording a video using specified camera. it is stopped automatically after max_duration seconds.
+    refused with 507 if the disk may not fit a recording of the maximum duration, and with 503 or 429
+    and a Retry-After header if the host is at capacity
+    """
+    record = Recording(camera.rtsp_stream_link, camera_number=camera.number)
 
-    try:
-        if not camera.is_up():
-            raise BrokenPipeError(f"{camera} is unreachable")
+    if group_id is not None:
+        record.metadata["group_id"] = group_id
 
-        await record.start()
-        RECORDS[record.record_id] = record
+    try:
+        await start_camera_recording(record, camera, max_duration)
 
         message = f"Started recording video for recording {record.record_id}"
         logger.info(message)
         return StartRecordResponse(status=status.HTTP_200_OK, details=message, record_id=record.record_id)
 
+    except InsufficientStorageError as e:
+        message = f"Refused to start recording {record.record_id}: {e}"
+        logger.warning(message)
+        response.status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+        return GenericResponse(status=status.HTTP_507_INSUFFICIENT_STORAGE, details=message)
+
+    except CapacityError as e:
+        message = f"Refused to start recording {record.record_id}: {e}"
+        logger.warning(message)
+        response.status_code = e.status_code
+        response.headers["Retry-After"] = str(e.retry_after)
+        return CapacityResponse(status=e.status_code, details=message, retry_after=e.retry_after)
+
     except Exception as e:
         message = f"Failed to start recording video for recording {record.record_id}: {e}"
         logger.error(message)
         return GenericResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR, details=message)
 
 
+def get_batch_response(response: Response, results: tp.List[ItemResult], group_id: tp.Optional[str]) -> BatchResponse:
+    """
+    200 if every item succeeded, 207 if some did and 500 if none, or 503 or 429 if all of them were refused
+    as hosts are at capacity. Retry-After is set to the longest delay of the refused items
+    """
+    succeeded = sum(result.status < 300 for result in results)
+    retry_after = [result.retry_after for result in results if result.retry_after is not None]
+    code = (
+        status.HTTP_200_OK if succeeded == len(results) else 207 if succeeded else status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+    if results and len(retry_after) == len(results):
+        code = max(result.status for result in results)
+
+    if retry_after:
+        response.headers["Retry-After"] = str(max(retry_after))
+
+    response.status_code = code
+    message = f"{succeeded} of {len(results)} items succeeded"
+    logger.info(f"Batch request{f' of group {group_id}' if group_id else ''}: {message}")
+
+    return BatchResponse(
+        status=code,
+        details=message,
+        group_id=group_id,
+        results=[BatchItemModel(**asdict(result)) for result in results],
+    )
+
+
+@app.post("/cameras/start", dependencies=[Depends(authenticate)], response_model=BatchResponse)
+async def start_recordings(request: Request, response: Response, batch: BatchStartRequest) -> BatchResponse:
+    """
+    start recording on several cameras at once. the recordings are tagged with a group id to be stopped together.
+    with atomic set, the started recordings are discarded if some camera fails to start
+    """
+    group_id = batch.group_id or uuid4().hex
+    results = await start_batch(batch.cameras, group_id, request.headers, batch.max_duration, batch.atomic)
+    return get_batch_response(response, results, group_id)
+
+
+@app.post("/records/stop", dependencies=[Depends(authenticate)], response_model=BatchResponse)
+async def stop_recordings(request: Request, response: Response, batch: BatchStopRequest) -> BatchResponse:
+    """stop several recordings at once, listed by their ids and / or a group id"""
+    record_ids = [*batch.record_ids, *(get_group_records(batch.group_id) if batch.group_id is not None else [])]
+    results = await stop_batch(record_ids, request.headers, batch.background)
+    return get_batch_response(response, results, batch.group_id)
+
+
 @app.post(
     "/record/{record_id}/stop",
     dependencies=[Depends(authenticate)],
-    response_model=tp.Union[StopRecordResponse, GenericResponse],  # type: ignore
+    response_model=tp.Union[StopRecordResponse, FinalizationJobResponse, GenericResponse],  # type: ignore
 )
-async def end_recording(record: Recording = Depends(get_record_by_id)) -> tp.Union[StopRecordResponse, GenericResponse]:
-    """finish recording a video"""
+async def end_recording(
+    response: Response,
+    record: Recording = Depends(get_record_by_id),
+    background: bool = False,
+    callback_url: tp.Optional[str] = None,
+) -> tp.Union[StopRecordResponse, FinalizationJobResponse, GenericResponse]:
+    """finish recording a video. pass background=true to get a finalization job id right away instead of waiting"""
     try:
         if not record.is_ongoing:
             raise ValueError("Recording is not currently ongoing thus cannot be stopped")
 
-        await record.stop()
+        job = start_finalization(record, callback_url)
+
+        if background:
+            message = f"Stopping recording video for recording {record.record_id} in background, job {job.job_id}"
+            logger.info(message)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return FinalizationJobResponse(
+                status=status.HTTP_202_ACCEPTED, details=message, job=FinalizationJobModel(**job.as_dict())
+            )
+
+        await job.wait()
+
+        if job.state is JobState.FAILED:
+            raise RuntimeError(job.error)
+
         message = f"Stopped recording video for recording {record.record_id}"
         logger.info(message)
         return StopRecordResponse(status=status.HTTP_200_OK, details=message, filename=record.filename)
@@ -92,52 +253,298 @@ async def end_recording(record: Recording = Depends(get_record_by_id)) -> tp.Uni
         return GenericResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR, details=message)
 
 
+@app.post(
+    "/record/{record_id}/discard",
+    dependencies=[Depends(authenticate)],
+    response_model=GenericResponse,
+)
+async def discard_record(response: Response, record: Recording = Depends(get_record_by_id)) -> GenericResponse:
+    """stop an ongoing recording and delete its video"""
+    if not record.is_ongoing or record.record_id not in RECORDS:
+        response.status_code = status.HTTP_409_CONFLICT
+        return GenericResponse(status=status.HTTP_409_CONFLICT, details="Recording is not currently ongoing")
+
+    await discard_recording(record)
+    return GenericResponse(status=status.HTTP_200_OK, details=f"Discarded recording {record.record_id}")
+
+
 @app.get("/cameras", response_model=CameraList)
-def get_cameras() -> CameraList:
-    """return a list of all connected cameras"""
-    cameras_data = [
-        CameraModel(number=camera.number, host=camera.socket_address, is_up=camera.is_up())
-        for camera in CAMERAS.values()
-    ]
+async def get_cameras(refresh: bool = False) -> CameraList:
+    """return a list of all connected cameras. pass refresh=true to probe them live instead of using cached state"""
+    if refresh:
+        await probe_cameras(CAMERAS.values())
+
+    cameras_data = []
+
+    for camera in CAMERAS.values():
+        health = get_health(camera)
+        cameras_data.append(
+            CameraModel(
+                number=camera.number,
+                host=camera.socket_address,
+                is_up=health.is_up,
+                last_seen_up=health.last_seen_up,
+                latency=health.latency,
+                consecutive_failures=health.consecutive_failures,
+            )
+        )
+
     message = f"Collected {len(cameras_data)} cameras"
     logger.info(message)
 
     return CameraList(status=status.HTTP_200_OK, details=message, cameras=cameras_data)
 
 
+@app.get("/camera/{camera_number}/snapshot", response_class=Response)
+async def get_snapshot(request: Request, camera: Camera = Depends(get_camera_by_number)) -> Response:
+    """
+    return the latest keyframe of the camera as a JPEG. the first request starts a keyframe decoder
+    which keeps the image up to date while snapshots are requested
+    """
+    snapshot = await get_feed(camera.number, camera.rtsp_stream_link).get()
+
+    if snapshot is None:
+        message = f"No frame was received from {camera} in time"
+        logger.error(message)
+        return Response(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content=message)
+
+    return snapshot_response(snapshot, request)
+
+
+@app.post(
+    "/cameras/reload",
+    dependencies=[Depends(authenticate)],
+    response_model=tp.Union[CamerasReloadResponse, GenericResponse],  # type: ignore
+)
+async def reload_cameras_config(
+    config: tp.Optional[CamerasConfig] = None,
+) -> tp.Union[CamerasReloadResponse, GenericResponse]:
+    """
+    reload cameras from CAMERAS_CONFIG_FILE or CAMERAS_CONFIG, or apply the provided camera list.
+    the list is saved into CAMERAS_CONFIG_FILE if it is set. ongoing recordings are not affected
+    """
+    try:
+        diff = await reload_cameras(config.cameras if config is not None else None)
+    except Exception as e:
+        message = f"Failed to reload camera config: {e}"
+        logger.error(message)
+        return GenericResponse(status=status.HTTP_400_BAD_REQUEST, details=message)
+
+    message = f"Camera config reloaded. {len(CAMERAS)} cameras configured"
+    return CamerasReloadResponse(status=status.HTTP_200_OK, details=message, **asdict(diff))
+
+
+@app.post("/auth/cache/invalidate", dependencies=[Depends(authenticate)], response_model=GenericResponse)
+def invalidate_employee_cache(card_id: tp.Optional[str] = None) -> GenericResponse:
+    """drop a revoked or changed card from the employee cache of this worker, or clear the cache if no card is given"""
+    EMPLOYEE_CACHE.invalidate(card_id)
+    message = f"Card {card_id} dropped from the employee cache" if card_id else "Employee cache cleared"
+    return GenericResponse(status=status.HTTP_200_OK, details=message)
+
+
+@app.get("/storage", response_model=StorageStats)
+async def get_storage() -> StorageStats:
+    """return disk usage of the video files of this worker"""
+    camera_bytes = {
+        "unknown" if number is None else str(number): size for number, size in STORAGE.camera_bytes.items() if size
+    }
+    message = f"{len(STORAGE.files)} video files take {STORAGE.total_bytes} bytes"
+
+    return StorageStats(
+        status=status.HTTP_200_OK,
+        details=message,
+        total_bytes=STORAGE.total_bytes,
+        camera_bytes=camera_bytes,
+        files=len(STORAGE.files),
+        disk_free_bytes=await STORAGE.get_disk_free(),
+        quota_bytes=STORAGE.quota_bytes or None,
+    )
+
+
+async def collect_metrics() -> None:
+    """update the metrics reflecting the current state rather than events"""
+    for event, count in EMPLOYEE_CACHE.stats.items():
+        if event != "size":
+            metrics.AUTH_CACHE_EVENTS.set_total(count, event=event)
+
+    metrics.CAMERA_UP.clear()
+
+    for number, health in HEALTH.items():
+        metrics.CAMERA_UP.set(int(health.is_up), camera=number)
+
+    ongoing = [record for record in RECORDS.values() if record.is_ongoing]
+    processes = {
+        "recording": sum(
+            record.process_ffmpeg is not None and record.process_ffmpeg.returncode is None for record in ongoing
+        ),
+        "ingest": sum(ingest.process_count for ingest in INGESTS.values()),
+        "segment_ring": sum(ring.is_running for ring in RINGS.values()),
+        "snapshot": sum(feed.is_running for feed in FEEDS.values()),
+    }
+
+    for kind, count in processes.items():
+        metrics.FFMPEG_PROCESSES.set(count, kind=kind)
+
+    metrics.ONGOING_BYTES.clear()
+    ongoing_bytes: tp.Dict[tp.Optional[int], int] = {}
+
+    for record in ongoing:
+        progress = record.progress
+        ongoing_bytes[record.camera_number] = ongoing_bytes.get(record.camera_number, 0) + (
+            progress.total_size if progress is not None else 0
+        )
+
+    for camera_number, size in ongoing_bytes.items():
+        metrics.ONGOING_BYTES.set(size, camera=camera_number)
+
+    metrics.STORAGE_BYTES.clear()
+
+    for camera_number, size in STORAGE.camera_bytes.items():
+        metrics.STORAGE_BYTES.set(size, camera="unknown" if camera_number is None else camera_number)
+
+    metrics.DISK_FREE_BYTES.set(await STORAGE.get_disk_free())
+    metrics.EVENT_SUBSCRIBERS.set(EVENTS.subscriber_count)
+    metrics.TRANSCODING_QUEUE.set(TRANSCODER.queue_depth)
+
+    for kind, usage in (("recording", RESOURCES.capture_usage), ("background", RESOURCES.background_usage)):
+        metrics.HOST_RESOURCE_USAGE.set(usage.cpu, resource="cpu", kind=kind)
+        metrics.HOST_RESOURCE_USAGE.set(usage.processes, resource="processes", kind=kind)
+        metrics.HOST_RESOURCE_USAGE.set(usage.write_kbps, resource="write_kbps", kind=kind)
+
+
+@app.get("/metrics", response_class=Response)
+async def get_metrics() -> Response:
+    """return service metrics in the Prometheus text format"""
+    await collect_metrics()
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/events", response_class=StreamingResponse)
+async def get_events(
+    last_event_id: tp.Optional[str] = Header(None),
+    since: tp.Optional[str] = None,
+    types: tp.Optional[str] = None,
+) -> StreamingResponse:
+    """
+    stream recording and camera state changes of this worker as server-sent events. events are numbered, so a client
+    reconnecting with the Last-Event-ID header, or the since parameter, gets the ones it has missed, or a resync event
+    if it has to reload the full state. types is a comma separated list of event types to receive, all by default
+    """
+    event_types = {type_.strip() for type_ in types.split(",")} if types else None
+    return StreamingResponse(
+        EVENTS.stream(last_event_id if last_event_id is not None else since, event_types),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
 @app.get("/records", response_model=RecordList)
-def get_records() -> RecordList:
-    """return a list of all tracked records"""
+async def get_records(
+    camera: tp.Optional[int] = None,
+    since: tp.Optional[datetime] = None,
+    until: tp.Optional[datetime] = None,
+    state: tp.Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: tp.Optional[str] = None,
+) -> RecordList:
+    """
+    return tracked records, newest first. ended records are paginated: pass next_cursor
+    from the previous response as cursor to get the next page. records can be filtered by
+    camera number, start time range and state (ongoing, ended or failed)
+    """
     ongoing_records = []
     ended_records = []
 
-    for record in RECORDS.values():
-        record_data = RecordData(
-            filename=record.filename,
-            record_id=record.record_id,
-            start_time=record.start_time,
-            end_time=record.end_time,
-        )
+    # records which are still in memory are only listed on the first page
+    for record in [*RECORDS.values(), *await CLUSTER.get_remote_records()] if cursor is None else []:
+        if (
+            (camera is not None and record.camera_number != camera)
+            or (since is not None and (record.start_time is None or record.start_time < since))
+            or (until is not None and (record.start_time is None or record.start_time >= until))
+            or (state is not None and record.state != state)
+        ):
+            continue
 
         if record.is_ongoing:
-            ongoing_records.append(record_data)
+            ongoing_records.append(get_record_data(record))
         else:
-            ended_records.append(record_data)
+            ended_records.append(get_record_data(record))
+
+    next_cursor = None
+
+    if state != "ongoing":
+        try:
+            archived, next_cursor = await RECORDS.query(camera, since, until, state, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+        ended_records.extend(get_record_data(record) for record in archived)
 
     message = f"Collected {len(ongoing_records)} ongoing and {len(ended_records)} ended records"
     logger.info(message)
 
     return RecordList(
-        status=status.HTTP_200_OK, details=message, ongoing_records=ongoing_records, ended_records=ended_records
+        status=status.HTTP_200_OK,
+        details=message,
+        ongoing_records=ongoing_records,
+        ended_records=ended_records,
+        next_cursor=next_cursor,
+    )
+
+
+@app.get("/record/{record_id}", response_model=RecordResponse)
+def get_record(record: Recording = Depends(get_record_by_id)) -> RecordResponse:
+    """return details of a single record including live ffmpeg metrics"""
+    return RecordResponse(
+        status=status.HTTP_200_OK, details=f"Record {record.record_id}", record=get_record_data(record)
+    )
+
+
+@app.api_route("/record/{record_id}/video", methods=["GET", "HEAD"], response_class=Response)
+async def get_record_video(
+    request: Request, live: bool = False, record: Recording = Depends(get_record_by_id)
+) -> Response:
+    """
+    download the video of a recording. supports range and conditional requests.
+    set live to follow an ongoing recording as it is being written, which needs the fmp4 or mpegts output mode
+    """
+    if not record.is_ongoing:
+        return await serve_video(str(record.filename), request, is_growing=lambda: False, live=live)
+
+    # a capture restart switches to a new part file, which ends the live tail of the previous one
+    path = record.current_capture_filename
+    return await serve_video(
+        path, request, is_growing=lambda: record.is_ongoing and record.current_capture_filename == path, live=live
+    )
+
+
+@app.get("/job/{job_id}", response_model=FinalizationJobResponse)
+def get_job(job: FinalizationJob = Depends(get_job_by_id)) -> FinalizationJobResponse:
+    """return the state of a recording finalization job"""
+    message = f"Finalization job {job.job_id} is {job.state.value}"
+    return FinalizationJobResponse(
+        status=status.HTTP_200_OK, details=message, job=FinalizationJobModel(**job.as_dict())
     )
 
 
 @app.on_event("startup")
 @logger.catch(reraise=True)
-def startup_event() -> None:
+async def startup_event() -> None:
     """tasks to do at server startup"""
     MongoDbWrapper()
     asyncio.create_task(end_stuck_records())
+    asyncio.create_task(monitor_cameras_health())
+    POSTPROCESSOR.start()
+    TRANSCODER.start()
+    asyncio.create_task(STORAGE.run())
+    asyncio.create_task(publish_progress())
+
+    if RECOVER_ORPHANED_FILES:
+        asyncio.create_task(recover_orphaned_files(is_in_use=lambda record_id: record_id in RECORDS))
+
+    await CLUSTER.start(app, get_busy_cameras)
+    await sync_segment_rings()
+    asyncio.create_task(watch_cameras_config())
 
 
 @app.on_event("shutdown")
@@ -146,9 +553,15 @@ async def shutdown_event() -> None:
     """tasks to do at server shutdown"""
     for rec in RECORDS.values():
         if rec.is_ongoing:
-            await rec.stop()
+            await start_finalization(rec).wait()
             logger.warning(f"Recording {rec.record_id} was stopped due to server shutdown.")
 
+    await TRANSCODER.stop()
+    await POSTPROCESSOR.stop()
+    await stop_segment_rings()
+    await stop_snapshot_feeds()
+    await CLUSTER.stop()
+
 
 if __name__ == "__main__":
     uvicorn.run("app:app", port=8081)
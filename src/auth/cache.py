@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import typing as tp
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from loguru import logger
+
+from .models import Employee
+
+EMPLOYEE_CACHE_SIZE: int = int(os.getenv("EMPLOYEE_CACHE_SIZE", 1024))
+EMPLOYEE_CACHE_TTL_SEC: float = float(os.getenv("EMPLOYEE_CACHE_TTL_SEC", 300))
+EMPLOYEE_CACHE_NEGATIVE_TTL_SEC: float = float(os.getenv("EMPLOYEE_CACHE_NEGATIVE_TTL_SEC", 10))
+
+EmployeeLoader = tp.Callable[[str], tp.Awaitable[Employee]]
+
+
+@dataclass
+class _CacheEntry:
+    employee: tp.Optional[Employee]  # None stands for an unknown card
+    expires_at: float
+
+
+class EmployeeCache:
+    """
+    An in-process TTL/LRU cache of employees keyed by their RFID card id.
+    Unknown cards are cached for a shorter period, concurrent lookups of the same card share one database query.
+    Expired entries are kept until evicted so that they can be served if the database is unavailable.
+    """
+
+    def __init__(
+        self,
+        loader: EmployeeLoader,
+        max_size: int = EMPLOYEE_CACHE_SIZE,
+        ttl: float = EMPLOYEE_CACHE_TTL_SEC,
+        negative_ttl: float = EMPLOYEE_CACHE_NEGATIVE_TTL_SEC,
+        clock: tp.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._clock = clock
+        self._entries: tp.OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._pending: tp.Dict[str, asyncio.Task[Employee]] = {}
+        self._generation: int = 0  # bumped on invalidation, so that lookups in flight are not cached
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.stale_hits: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> tp.Dict[str, int]:
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+        }
+
+    async def get(self, card_id: str) -> Employee:
+        """get an employee by card id. raises ValueError if there is no such employee"""
+        entry = self._entries.get(card_id)
+
+        if entry is not None and entry.expires_at > self._clock():
+            self._entries.move_to_end(card_id)
+            self.hits += 1
+            return self._unwrap(entry, card_id)
+
+        self.misses += 1
+
+        if card_id not in self._pending:
+            self._pending[card_id] = asyncio.create_task(self._load(card_id))
+
+        return await asyncio.shield(self._pending[card_id])
+
+    def invalidate(self, card_id: tp.Optional[str] = None) -> None:
+        """drop a single card from the cache or clear it completely if no card id is provided"""
+        self._generation += 1
+
+        if card_id is None:
+            self._entries.clear()
+            logger.info("Employee cache cleared")
+        elif self._entries.pop(card_id, None) is not None:
+            logger.info(f"Employee cache entry for card {card_id} invalidated")
+
+    async def _load(self, card_id: str) -> Employee:
+        generation = self._generation
+
+        try:
+            employee = await self._loader(card_id)
+        except ValueError:
+            if generation == self._generation:
+                self._store(card_id, None, self._negative_ttl)
+
+            raise
+        except Exception as e:
+            stale = self._entries.get(card_id)
+
+            if stale is None or stale.employee is None:
+                raise
+
+            logger.warning(f"Failed to refresh employee with card id {card_id}, serving a stale cache entry: {e}")
+            self.stale_hits += 1
+            return stale.employee
+        finally:
+            self._pending.pop(card_id, None)
+
+        if generation == self._generation:
+            self._store(card_id, employee, self._ttl)
+
+        return employee
+
+    def _store(self, card_id: str, employee: tp.Optional[Employee], ttl: float) -> None:
+        self._entries[card_id] = _CacheEntry(employee=employee, expires_at=self._clock() + ttl)
+        self._entries.move_to_end(card_id)
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _unwrap(entry: _CacheEntry, card_id: str) -> Employee:
+        if entry.employee is None:
+            raise ValueError(f"Employee with card id {card_id} not found")
+
+        return entry.employee
@@ -34,6 +34,10 @@ class MongoDbWrapper(metaclass=SingletonMeta):
 
         logger.info("Connected to MongoDB")
 
+    def get_collection(self, name: str) -> AsyncIOMotorCollection:
+        """get a collection of the database by its name"""
+        return self._database[name]
+
     @staticmethod
     async def _get_element_by_key(collection_: AsyncIOMotorCollection, key: str, value: str) -> tp.Dict[str, tp.Any]:
         result: tp.Dict[str, tp.Any] = await collection_.find_one({key: value}, {"_id": 0})
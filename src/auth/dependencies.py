@@ -1,27 +1,44 @@
 import os
+import time
 
 from fastapi import HTTPException, Header, status
 from loguru import logger
 
+from feecc_cameraman.metrics import AUTH_SECONDS
+from feecc_cameraman.tracing import span
+
+from .cache import EmployeeCache
 from .database import MongoDbWrapper
 from .models import Employee
 
 TESTING_VALUE: str = "1111111111"
 
 
+async def _load_employee(card_id: str) -> Employee:
+    return await MongoDbWrapper().get_concrete_employee(card_id)
+
+
+EMPLOYEE_CACHE = EmployeeCache(loader=_load_employee)
+
+
 async def authenticate(rfid_card_id: str = Header(TESTING_VALUE)) -> Employee:
+    started_at = time.monotonic()
+
     try:
         if rfid_card_id == TESTING_VALUE and os.getenv("PRODUCTION_ENVIRONMENT", False):
             raise ValueError("Development credentials are not allowed in production environment")
 
-        employee = await MongoDbWrapper().get_concrete_employee(rfid_card_id)
+        with span("auth"):
+            employee = await EMPLOYEE_CACHE.get(rfid_card_id)
         logger.info(f"Authentication passed. {employee.name=}, {employee.rfid_card_id=}.")
+        AUTH_SECONDS.observe(time.monotonic() - started_at, result="passed")
 
         return employee
 
     except Exception as e:
         message = f"Authentication failed: {e}"
         logger.error(message)
+        AUTH_SECONDS.observe(time.monotonic() - started_at, result="failed")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=message,
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import typing as tp
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import status
+from loguru import logger
+
+from .camera import CAMERAS, Camera, Recording
+from .events import publish_record_event
+from .health import is_camera_up
+from .jobs import JobState, start_finalization
+from .resources import RESOURCES, CapacityError
+from .scheduler import DEADLINES
+from .state import CLUSTER, Worker
+from .storage import STORAGE, InsufficientStorageError
+from .store import RECORDS
+from .tracing import span
+
+RECORDING_GROUPS_HISTORY: int = int(os.getenv("RECORDING_GROUPS_HISTORY", 1000))
+
+
+@dataclass
+class ItemResult:
+    """outcome of a single camera or record of a batch request"""
+
+    status: int  # an HTTP status code the item would get as a single request
+    details: str
+    camera_number: tp.Optional[int] = None
+    record_id: tp.Optional[str] = None
+    filename: tp.Optional[str] = None
+    job_id: tp.Optional[str] = None
+    retry_after: tp.Optional[int] = None  # seconds, for items refused as the host is at capacity
+
+
+# record ids of batch started groups, including the ones running on other workers
+GROUPS: tp.OrderedDict[str, tp.List[str]] = OrderedDict()
+
+
+async def start_camera_recording(record: Recording, camera: Camera, max_duration: tp.Optional[int] = None) -> None:
+    """
+    check there is room for the recording on the disk and the host and the camera is up, then start and register
+    the recording. raises CapacityError if the host is at capacity
+    """
+    with span("admission"):
+        await STORAGE.admit(camera.number, DEADLINES.get_max_duration(record, max_duration))
+        RESOURCES.reserve_capture(record.record_id, camera.number)
+
+    try:
+        async with RESOURCES.start_slot():
+            with span("probe"):
+                is_up = await is_camera_up(camera)
+
+            if not is_up:
+                raise BrokenPipeError(f"{camera} is unreachable")
+
+            await record.start()
+    except BaseException:
+        RESOURCES.release_capture(record.record_id)
+        raise
+
+    RECORDS[record.record_id] = record
+    DEADLINES.schedule(record, max_duration)
+    await CLUSTER.register_record(record)
+    publish_record_event("record_started", record)
+
+
+async def discard_recording(record: Recording) -> None:
+    """stop an ongoing recording dropping its video, as if it has never been started"""
+    DEADLINES.cancel(record.record_id)
+    await record.discard()
+    RESOURCES.release_capture(record.record_id)
+
+    if record.record_id in RECORDS:
+        del RECORDS[record.record_id]
+
+    await CLUSTER.forget_record(record.record_id)
+    publish_record_event("record_discarded", record)
+
+
+def _get_details(body: tp.Dict[str, tp.Any]) -> str:
+    """details of a worker response, either a GenericResponse or an HTTPException one"""
+    return str(body.get("details") or body.get("detail"))
+
+
+async def _get_camera_owner(camera_number: int) -> tp.Optional[Worker]:
+    return await CLUSTER.acquire_camera(camera_number) if CLUSTER.is_distributed else None
+
+
+async def _get_record_owner(record_id: str) -> tp.Optional[Worker]:
+    return await CLUSTER.get_record_owner(record_id) if CLUSTER.is_distributed else None
+
+
+async def _start_item(
+    camera_number: int, max_duration: tp.Optional[int], group_id: str, headers: tp.Mapping[str, str]
+) -> ItemResult:
+    camera = CAMERAS.get(camera_number)
+
+    if camera is None:
+        return ItemResult(status.HTTP_404_NOT_FOUND, f"No such camera: {camera_number}", camera_number)
+
+    owner = await _get_camera_owner(camera_number)
+
+    if owner is not None:
+        params: tp.Dict[str, tp.Any] = {"group_id": group_id}
+
+        if max_duration is not None:
+            params["max_duration"] = max_duration
+
+        code, body = await CLUSTER.call(owner, f"/camera/{camera_number}/start", headers, params)
+        return ItemResult(
+            body.get("status", code),
+            _get_details(body),
+            camera_number,
+            body.get("record_id"),
+            retry_after=body.get("retry_after"),
+        )
+
+    record = Recording(camera.rtsp_stream_link, camera_number=camera.number, metadata={"group_id": group_id})
+
+    try:
+        await start_camera_recording(record, camera, max_duration)
+    except InsufficientStorageError as e:
+        return ItemResult(status.HTTP_507_INSUFFICIENT_STORAGE, str(e), camera_number)
+    except CapacityError as e:
+        return ItemResult(e.status_code, str(e), camera_number, retry_after=e.retry_after)
+    except Exception as e:
+        message = f"Failed to start recording video for recording {record.record_id}: {e}"
+        logger.error(message)
+        return ItemResult(status.HTTP_500_INTERNAL_SERVER_ERROR, message, camera_number)
+
+    return ItemResult(status.HTTP_200_OK, "Started recording", camera_number, record.record_id)
+
+
+async def _discard_item(result: ItemResult, headers: tp.Mapping[str, str]) -> None:
+    assert result.record_id is not None
+    owner = await _get_record_owner(result.record_id)
+
+    try:
+        if owner is not None:
+            code, body = await CLUSTER.call(owner, f"/record/{result.record_id}/discard", headers)
+
+            if code != status.HTTP_200_OK:
+                raise RuntimeError(_get_details(body))
+        elif result.record_id in RECORDS:
+            await discard_recording(RECORDS[result.record_id])
+    except Exception as e:
+        logger.error(f"Failed to roll back recording {result.record_id}: {e}")
+        result.details = f"Recording could not be rolled back: {e}"
+        return
+
+    result.status = status.HTTP_424_FAILED_DEPENDENCY
+    result.details = "Recording was rolled back as other cameras of the batch failed to start"
+
+
+async def start_batch(
+    camera_numbers: tp.List[int],
+    group_id: str,
+    headers: tp.Mapping[str, str],
+    max_duration: tp.Optional[int] = None,
+    atomic: bool = False,
+) -> tp.List[ItemResult]:
+    """
+    Start recordings on several cameras concurrently, tagging them with the group id. If atomic is set
+    and some camera fails, the recordings already started are discarded. headers authenticate the requests
+    made to other workers
+    """
+    results = await asyncio.gather(
+        *(_start_item(number, max_duration, group_id, headers) for number in dict.fromkeys(camera_numbers))
+    )
+    started = [result for result in results if result.status == status.HTTP_200_OK]
+
+    if atomic and len(started) < len(results):
+        await asyncio.gather(*(_discard_item(result, headers) for result in started))
+        logger.warning(f"Batch start of group {group_id} failed, {len(started)} recordings rolled back")
+    elif started:
+        GROUPS[group_id] = [*GROUPS.get(group_id, []), *(tp.cast(str, result.record_id) for result in started)]
+        GROUPS.move_to_end(group_id)
+
+        while len(GROUPS) > RECORDING_GROUPS_HISTORY:
+            GROUPS.popitem(last=False)
+
+    return list(results)
+
+
+def get_group_records(group_id: str) -> tp.List[str]:
+    """ids of the group recordings started by this worker and ongoing ones of this worker tagged with the group id"""
+    tagged = (record.record_id for record in RECORDS.values() if record.metadata.get("group_id") == group_id)
+    return list(dict.fromkeys([*GROUPS.get(group_id, []), *tagged]))
+
+
+async def _stop_item(record_id: str, background: bool, headers: tp.Mapping[str, str]) -> ItemResult:
+    owner = await _get_record_owner(record_id)
+
+    if owner is not None:
+        code, body = await CLUSTER.call(owner, f"/record/{record_id}/stop", headers, {"background": background})
+        job_id = (body.get("job") or {}).get("job_id")
+        return ItemResult(body.get("status", code), _get_details(body), None, record_id, body.get("filename"), job_id)
+
+    if record_id not in RECORDS or not RECORDS[record_id].is_ongoing:
+        return ItemResult(status.HTTP_404_NOT_FOUND, f"No such ongoing recording: {record_id}", record_id=record_id)
+
+    record = RECORDS[record_id]
+    job = start_finalization(record)
+    result = ItemResult(status.HTTP_202_ACCEPTED, "Stopping in background", record.camera_number, record_id)
+    result.job_id = job.job_id
+
+    if not background:
+        await job.wait()
+
+        if job.state is JobState.FAILED:
+            result.status, result.details = status.HTTP_500_INTERNAL_SERVER_ERROR, f"Failed to stop: {job.error}"
+        else:
+            result.status, result.details, result.filename = status.HTTP_200_OK, "Stopped recording", record.filename
+
+    return result
+
+
+async def stop_batch(
+    record_ids: tp.List[str], headers: tp.Mapping[str, str], background: bool = False
+) -> tp.List[ItemResult]:
+    """stop several recordings concurrently"""
+    return list(
+        await asyncio.gather(*(_stop_item(record_id, background, headers) for record_id in dict.fromkeys(record_ids)))
+    )
@@ -3,7 +3,7 @@ from __future__ import annotations
 import asyncio
 import json
 import os
-import socket
+import time
 import typing as tp
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -11,10 +11,61 @@ from uuid import uuid4
 
 from loguru import logger
 
-MINIMAL_RECORD_DURATION_SEC: int = 3
-FFMPEG_COMMAND: str = os.getenv(
-    "FFMPEG_COMMAND", 'ffmpeg -loglevel warning -rtsp_transport tcp -i "RTSP_STREAM" -r 25 -c copy -map 0 FILENAME'
+from .ingest import SHARED_INGEST, Ingest, attach_to_ingest, detach_from_ingest
+from .metrics import (
+    CAMERA_PROBE_FAILURES,
+    CAMERA_PROBE_SECONDS,
+    CAPTURE_RESTARTS,
+    FIRST_FRAME_SECONDS,
+    RECORDING_STOP_SECONDS,
+)
+from .output import (
+    FFMPEG_ARGV,
+    OUTPUT_ARGS,
+    OUTPUT_MODE,
+    VIDEO_DIR,
+    _remove,
+    finalize_capture,
+    get_capture_filename,
+    get_part_filename,
+    join_parts,
 )
+from .preroll import RINGS, SegmentRing
+from .progress import PROGRESS_ARGS, FfmpegMonitor, Progress
+from .streaminfo import PROBE_OPTIONS, STREAM_INFO
+from .tracing import span
+
+MINIMAL_RECORD_DURATION_SEC: int = 3
+CAPTURE_SUPERVISION: bool = os.getenv("CAPTURE_SUPERVISION", "true").lower() in ("1", "true", "yes")
+CAPTURE_STALL_TIMEOUT_SEC: float = float(os.getenv("CAPTURE_STALL_TIMEOUT_SEC", 15))
+CAPTURE_RESTART_BACKOFF_SEC: float = float(os.getenv("CAPTURE_RESTART_BACKOFF_SEC", 1))
+CAPTURE_RESTART_BACKOFF_MAX_SEC: float = float(os.getenv("CAPTURE_RESTART_BACKOFF_MAX_SEC", 30))
+CAPTURE_CHECK_INTERVAL_SEC: float = 1
+FFMPEG_QUIT_TIMEOUT_SEC: float = 10
+FFMPEG_TERMINATE_TIMEOUT_SEC: float = 5
+
+
+def build_ffmpeg_argv(rtsp_stream_link: str, capture_filename: str, input_args: tp.Sequence[str] = ()) -> tp.List[str]:
+    """substitute the stream and the output file into FFMPEG_COMMAND. input_args are put before the stream input"""
+    program, *arguments = FFMPEG_ARGV
+
+    if any(option in arguments for option in PROBE_OPTIONS):
+        input_args = ()  # probing is configured by the command itself
+
+    argv = [program, *PROGRESS_ARGS]
+
+    for argument in arguments:
+        if argument == "FILENAME":
+            argv.extend([*OUTPUT_ARGS[OUTPUT_MODE], capture_filename])
+        elif "RTSP_STREAM" in argument:
+            if argv[-1] == "-i":
+                argv[-1:-1] = input_args
+
+            argv.append(argument.replace("RTSP_STREAM", rtsp_stream_link))
+        else:
+            argv.append(argument)
+
+    return argv
 
 
 @dataclass(frozen=True)
@@ -25,28 +76,79 @@ class Camera:
     socket_address: str
     rtsp_stream_link: str
 
-    def __post_init__(self) -> None:
-        self.is_up()
-
     def __str__(self) -> str:
         return f"Camera no.{self.number} host at {self.socket_address}"
 
-    def is_up(self) -> bool:
-        """check if camera is reachable on the specified port and ip"""
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(0.25)
+    async def probe(self, timeout: float = 0.25) -> tp.Optional[float]:
+        """check if camera is reachable without blocking the event loop. returns connect latency in seconds if it is"""
+        started_at = time.monotonic()
 
         try:
             ip, port = self.socket_address.split(":", 1)
-            s.connect((ip, int(port)))
-            is_up = True
-            logger.debug(f"{self} is up")
-        except socket.error:
-            is_up = False
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, int(port)), timeout)
+        except ValueError:
+            logger.error(f"{self} has an invalid socket address, expected 'ip:port'")
+            CAMERA_PROBE_FAILURES.inc(camera=self.number)
+            return None
+        except (OSError, asyncio.TimeoutError):
             logger.warning(f"{self} is unreachable")
+            CAMERA_PROBE_FAILURES.inc(camera=self.number)
+            return None
 
-        s.close()
-        return is_up
+        latency = time.monotonic() - started_at
+        CAMERA_PROBE_SECONDS.observe(latency, camera=self.number)
+        writer.close()
+        logger.debug(f"{self} is up ({latency * 1000:.1f} ms)")
+        return latency
+
+
+@dataclass
+class CapturePart:
+    """a file written by a single ffmpeg process of a recording, which is restarted whenever capture breaks"""
+
+    filename: str
+    started_at: float  # unix time the ffmpeg process was spawned at
+    first_frame_at: tp.Optional[float] = None  # unix time, None if no video was captured
+    ended_at: tp.Optional[float] = None  # unix time of the last frame
+    duration: float = 0.0  # seconds of captured video
+    interruption: tp.Optional[str] = None  # why capture broke, None if the part was stopped along with the recording
+
+
+def get_gaps(parts: tp.Sequence[CapturePart], end_time: tp.Optional[float] = None) -> tp.List[tp.Dict[str, tp.Any]]:
+    """
+    outages between the parts with video. position is the offset of the gap in the joined video in seconds,
+    started_at and ended_at are unix times, the latter is None while capture is still being restored
+    """
+    gaps: tp.List[tp.Dict[str, tp.Any]] = []
+    position = 0.0
+    interrupted: tp.Optional[CapturePart] = None
+
+    def add_gap(part: CapturePart, ended_at: tp.Optional[float]) -> None:
+        started_at = part.ended_at or part.started_at
+        gaps.append(
+            {
+                "position": round(position, 3),
+                "started_at": round(started_at, 3),
+                "ended_at": None if ended_at is None else round(ended_at, 3),
+                "duration": None if ended_at is None else round(ended_at - started_at, 3),
+                "reason": part.interruption,
+            }
+        )
+
+    for part in parts:
+        if part.first_frame_at is None:
+            continue  # a failed restart attempt
+
+        if interrupted is not None:
+            add_gap(interrupted, part.first_frame_at)
+
+        position += part.duration
+        interrupted = part if part.interruption is not None else None
+
+    if interrupted is not None:
+        add_gap(interrupted, end_time)
+
+    return gaps
 
 
 @dataclass
@@ -59,9 +161,19 @@ class Recording:
     record_id: str = field(default_factory=lambda: uuid4().hex)
     start_time: tp.Optional[datetime] = None
     end_time: tp.Optional[datetime] = None
+    camera_number: tp.Optional[int] = None
+    error: tp.Optional[str] = None
+    metadata: tp.Dict[str, tp.Any] = field(default_factory=dict)
+    _ring: tp.Optional[SegmentRing] = field(default=None, repr=False)
+    _ingest: tp.Optional[Ingest] = field(default=None, repr=False)
+    _monitor: tp.Optional[FfmpegMonitor] = field(default=None, repr=False)
+    _fast_probe: bool = field(default=False, repr=False)
+    _parts: tp.List[CapturePart] = field(default_factory=list, repr=False)
+    _supervisor: tp.Optional[asyncio.Task[None]] = field(default=None, repr=False)
 
     def __post_init__(self) -> None:
-        self.filename = self._get_video_filename()
+        if self.filename is None:
+            self.filename = self._get_video_filename()
 
     def __len__(self) -> int:
         """calculate recording duration in seconds"""
@@ -75,7 +187,7 @@ class Recording:
 
         return int(duration.total_seconds())
 
-    def _get_video_filename(self, dir_: str = "output/video") -> str:
+    def _get_video_filename(self, dir_: str = VIDEO_DIR) -> str:
         """determine a valid video name not to override an existing video"""
         if not os.path.isdir(dir_):
             os.makedirs(dir_)
@@ -85,28 +197,197 @@ class Recording:
     def is_ongoing(self) -> bool:
         return self.start_time is not None and self.end_time is None
 
+    @property
+    def state(self) -> str:
+        if self.is_ongoing:
+            return "ongoing"
+
+        if self.error is not None:
+            return "failed"
+
+        return "ended" if self.end_time is not None else "pending"
+
+    @property
+    def capture_filename(self) -> str:
+        """file ffmpeg writes into while recording. it differs from the filename if it is remuxed on stop"""
+        return get_capture_filename(str(self.filename))
+
+    @property
+    def current_capture_filename(self) -> str:
+        """file the current ffmpeg process writes into. capture restarts switch it to a new part file"""
+        return self._parts[-1].filename if self._parts else self.capture_filename
+
+    @property
+    def progress(self) -> tp.Optional[Progress]:
+        """live ffmpeg metrics of the recording if it has a dedicated ffmpeg output"""
+        return self._monitor.progress if self._monitor is not None else None
+
+    @property
+    def captured_seconds(self) -> tp.Optional[float]:
+        """duration of the video captured into the part files of a stopped recording, if it had its own ffmpeg"""
+        return sum(part.duration for part in self._parts) if self._parts else None
+
     @logger.catch(reraise=True)
     async def start(self) -> None:
-        """Execute ffmpeg command"""
+        """Execute ffmpeg command or mark the recording start in the camera segment ring if it is always on"""
+        with span("spawn"):
+            await self._start()
+
+    async def _start(self) -> None:
+        ring = RINGS.get(self.camera_number) if self.camera_number is not None else None
+
+        if ring is not None and ring.is_running and ring.rtsp_stream_link == self.rtsp_steam:
+            self._ring = ring
+            self.start_time = datetime.now()
+            ring.pin(self.record_id, self.start_time.timestamp())
+            logger.info(f"Started recording video '{self.filename}' using {ring}")
+            return
+
+        if SHARED_INGEST and self.camera_number is not None:
+            self._ingest = await attach_to_ingest(
+                self.camera_number, self.rtsp_steam, self.record_id, self.capture_filename
+            )
+            self._monitor = self._ingest.monitor(self.record_id)
+            self.start_time = datetime.now()
+            logger.info(f"Started recording video '{self.filename}' using {self._ingest}")
+            return
+
         # ffmpeg -loglevel warning -rtsp_transport tcp -i "rtsp://login:password@ip:port/Streaming/Channels/101" \
         # -c copy -map 0 vid.mp4
-        command = FFMPEG_COMMAND
-        command = command.replace("RTSP_STREAM", self.rtsp_steam, 1)
-        command = command.replace("FILENAME", str(self.filename), 1)
+        input_args = STREAM_INFO.input_args(self.rtsp_steam)
+        self._fast_probe = bool(input_args)
+        await self._spawn(input_args)
+        assert self.process_ffmpeg is not None
+        self.start_time = datetime.now()
+        logger.info(
+            f"Started recording video '{self.filename}' using ffmpeg with a {'fast' if self._fast_probe else 'full'} "
+            f"stream probe. {self.process_ffmpeg.pid=}"
+        )
 
-        self.process_ffmpeg = await asyncio.subprocess.create_subprocess_shell(
-            cmd=command,
+        if CAPTURE_SUPERVISION:
+            self._supervisor = asyncio.create_task(self._supervise())
+
+    async def _spawn(self, input_args: tp.Sequence[str] = ()) -> None:
+        """start an ffmpeg process capturing into a new part file"""
+        part = CapturePart(get_part_filename(self.capture_filename, len(self._parts)), started_at=time.time())
+        self.process_ffmpeg = await asyncio.subprocess.create_subprocess_exec(
+            *build_ffmpeg_argv(self.rtsp_steam, part.filename, input_args),
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             stdin=asyncio.subprocess.PIPE,
         )
-        self.start_time = datetime.now()
-        logger.info(f"Started recording video '{self.filename}' using ffmpeg. {self.process_ffmpeg.pid=}")
+        self._parts.append(part)
+        self._monitor = FfmpegMonitor(
+            self.process_ffmpeg,
+            name=f"record {self.record_id}",
+            on_first_frame=lambda latency: self._on_first_frame(part, latency),
+        )
+
+    def _on_first_frame(self, part: CapturePart, latency: float) -> None:
+        part.first_frame_at = part.started_at + latency
+        FIRST_FRAME_SECONDS.observe(latency, camera=self.camera_number, probe="fast" if self._fast_probe else "full")
+
+    @logger.catch(message="Capture supervisor crashed, the recording is no longer supervised", reraise=True)
+    async def _supervise(self) -> None:
+        """
+        watch the ffmpeg process of an ongoing recording and, if it exits or stops producing frames, restart
+        capture into a new part file with an exponential backoff. runs until the recording is stopped
+        """
+        backoff = CAPTURE_RESTART_BACKOFF_SEC
+
+        while True:
+            assert self.process_ffmpeg is not None and self._monitor is not None
+            reason, interruption = await self._watch(self.process_ffmpeg, self._parts[-1])
+            await self._end_part(interruption)
+            self.process_ffmpeg = None
+            part = self._parts[-1]
+
+            if part.duration >= CAPTURE_RESTART_BACKOFF_MAX_SEC:
+                backoff = CAPTURE_RESTART_BACKOFF_SEC  # capture was stable before breaking
+
+            if self._fast_probe:
+                STREAM_INFO.invalidate(self.rtsp_steam)
+                self._fast_probe = False
+
+            CAPTURE_RESTARTS.inc(camera=self.camera_number, reason=reason)
+            self.metadata["gaps"] = get_gaps(self._parts)
+            logger.warning(f"Capture of record {self.record_id} broke as {interruption}. Restarting in {backoff:.0f}s")
+            logger.debug(f"ffmpeg output: {self._monitor.tail}")
+
+            while self.process_ffmpeg is None:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, CAPTURE_RESTART_BACKOFF_MAX_SEC)
+                spawn = asyncio.ensure_future(self._spawn())
+
+                try:
+                    await asyncio.shield(spawn)
+                except asyncio.CancelledError:
+                    await spawn  # let the process be registered, so that stopping the recording stops it too
+                    raise
+                except OSError as e:
+                    logger.error(f"Failed to restart capture of record {self.record_id}: {e}")
+
+            logger.info(f"Restarted capture of record {self.record_id} into {self._parts[-1].filename}")
+
+    async def _watch(self, process: asyncio.subprocess.Process, part: CapturePart) -> tp.Tuple[str, str]:
+        """wait for the ffmpeg process to exit or stall. returns the reason capture broke and its description"""
+        while True:
+            try:
+                return_code = await asyncio.wait_for(process.wait(), CAPTURE_CHECK_INTERVAL_SEC)
+                return "exited", f"ffmpeg exited with code {return_code}"
+            except asyncio.TimeoutError:
+                pass
+
+            assert self._monitor is not None
+            idle = self._monitor.progress.seconds_since_last_frame
+
+            if idle is None:
+                idle = time.time() - part.started_at
+
+            if idle > CAPTURE_STALL_TIMEOUT_SEC:
+                await self._terminate(process)
+                return "stalled", f"ffmpeg stalled for {idle:.0f}s"
+
+    @staticmethod
+    async def _terminate(process: asyncio.subprocess.Process) -> None:
+        """stop ffmpeg letting it finalize the output file, or kill it if it does not react"""
+        process.terminate()
+
+        try:
+            await asyncio.wait_for(process.wait(), FFMPEG_TERMINATE_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    async def _end_part(self, interruption: tp.Optional[str] = None) -> None:
+        """collect the results of the current part once its ffmpeg process has exited"""
+        assert self._monitor is not None
+        await self._monitor.wait_closed()
+        part, progress = self._parts[-1], self._monitor.progress
+        part.duration = progress.out_time_sec
+        part.interruption = interruption
+        idle = progress.seconds_since_last_frame
+        part.ended_at = time.time() - idle if idle is not None else None
 
     @logger.catch(reraise=True)
-    async def stop(self) -> None:
-        """stop recording a video"""
-        if self.process_ffmpeg is None:
+    async def stop(self, on_finalizing: tp.Optional[tp.Callable[[], None]] = None) -> None:
+        """stop recording a video. on_finalizing is called once capture ends and the file is being finalized"""
+        with RECORDING_STOP_SECONDS.time(camera=self.camera_number), span("stop"):
+            await self._stop(on_finalizing or (lambda: None))
+
+    async def _stop(self, on_finalizing: tp.Callable[[], None]) -> None:
+
+        if self._ring is not None:
+            await self._stop_ring_recording(self._ring, on_finalizing)
+            return
+
+        if self._ingest is not None:
+            await self._stop_ingest_recording(self._ingest, on_finalizing)
+            return
+
+        await self._stop_supervisor()
+
+        if self.process_ffmpeg is None and not self._parts:
             logger.error(f"Failed to stop record {self.record_id}")
             logger.debug(f"Operation ongoing: {self.is_ongoing}, ffmpeg process: {bool(self.process_ffmpeg)}")
             return
@@ -118,37 +399,184 @@ class Recording:
             )
             await asyncio.sleep(MINIMAL_RECORD_DURATION_SEC - len(self))
 
+        on_finalizing()
+        return_code = await self._quit_ffmpeg() if self.process_ffmpeg is not None else None
+        self.end_time = datetime.now()
+
+        if len(self._parts) == 1:
+            await finalize_capture(str(self.filename))
+        else:
+            await self._join_parts()
+
+        if return_code == 0 and len(self._parts) == 1:
+            asyncio.create_task(STREAM_INFO.update(self.rtsp_steam, str(self.filename), self._fast_probe))
+
+        logger.info(f"Finished recording video for record {self.record_id}")
+
+    async def _stop_supervisor(self) -> None:
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+
+    async def _quit_ffmpeg(self) -> int:
+        """ask the running ffmpeg process to finish the current part and wait for it. returns its exit code"""
+        assert self.process_ffmpeg is not None and self.process_ffmpeg.stdin is not None
         logger.info(f"Trying to stop record {self.record_id} process {self.process_ffmpeg.pid=}")
 
-        stdout, stderr = await self.process_ffmpeg.communicate(input=b"q")
-        await self.process_ffmpeg.wait()
-        return_code = self.process_ffmpeg.returncode
+        try:
+            self.process_ffmpeg.stdin.write(b"q")
+            await self.process_ffmpeg.stdin.drain()
+            self.process_ffmpeg.stdin.close()
+        except ConnectionError:
+            logger.warning(f"ffmpeg process of record {self.record_id} has already exited")
+
+        try:
+            return_code = await asyncio.wait_for(self.process_ffmpeg.wait(), FFMPEG_QUIT_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            logger.warning(f"ffmpeg process of record {self.record_id} ignored the quit request, terminating it")
+            await self._terminate(self.process_ffmpeg)
+            return_code = tp.cast(int, self.process_ffmpeg.returncode)
+
+        self.process_ffmpeg = None
+        await self._end_part(None if return_code == 0 else f"ffmpeg exited with code {return_code}")
+        assert self._monitor is not None
 
         if return_code == 0:
             logger.debug("Got a zero return code from ffmpeg subprocess. Assuming success.")
         else:
             logger.error(f"Got a non zero return code from ffmpeg subprocess: {return_code}")
-            logger.debug(f"{stdout=} {stderr=}")
+            logger.debug(f"ffmpeg output: {self._monitor.tail}")
 
-        self.process_ffmpeg = None
+            if self._fast_probe:
+                STREAM_INFO.invalidate(self.rtsp_steam)
+
+        return return_code
+
+    async def _join_parts(self) -> None:
+        """join the parts of a recording whose capture was restarted and record the gaps between them"""
+        assert self.end_time is not None
+        gaps = get_gaps(self._parts, self.end_time.timestamp())
+        self.metadata["gaps"] = gaps
+        filenames = [part.filename for part in self._parts if part.first_frame_at is not None]
+        filenames = [filename for filename in filenames if await asyncio.to_thread(os.path.exists, filename)]
+
+        if not filenames:
+            raise RuntimeError(f"No video was captured in {len(self._parts)} attempts")
+
+        started_at = time.monotonic()
+        await join_parts(filenames, str(self.filename))
+
+        for part in self._parts:
+            if part.filename != str(self.filename):
+                await asyncio.to_thread(_remove, part.filename)
+
+        logger.info(
+            f"Joined {len(filenames)} parts of record {self.record_id} with {len(gaps)} gaps "
+            f"in {time.monotonic() - started_at:.2f}s"
+        )
+
+    async def discard(self) -> None:
+        """stop recording without finalizing, deleting the captured video"""
+        await self._stop_supervisor()
+
+        if self._ring is not None:
+            self._ring.unpin(self.record_id)
+            self._ring = None
+        elif self._ingest is not None:
+            await detach_from_ingest(self._ingest, self.record_id)
+            self._ingest = None
+        elif self.process_ffmpeg is not None:
+            if self.process_ffmpeg.returncode is None:
+                self.process_ffmpeg.kill()
+
+            await self.process_ffmpeg.wait()
+            self.process_ffmpeg = None
+
+            if self._monitor is not None:
+                await self._monitor.wait_closed()
+
+        self.end_time = datetime.now()
+
+        for filename in {self.capture_filename, str(self.filename), *(part.filename for part in self._parts)}:
+            try:
+                await asyncio.to_thread(os.remove, filename)
+            except FileNotFoundError:
+                pass
+
+        logger.info(f"Discarded record {self.record_id}")
+
+    async def _stop_ingest_recording(self, ingest: Ingest, on_finalizing: tp.Callable[[], None]) -> None:
+        """detach the recording from the shared camera ingest, letting its output ffmpeg finalize the file"""
+        if len(self) < MINIMAL_RECORD_DURATION_SEC:
+            await asyncio.sleep(MINIMAL_RECORD_DURATION_SEC - len(self))
+
+        on_finalizing()
+
+        return_code = await detach_from_ingest(ingest, self.record_id)
+        self._ingest = None
+        self.end_time = datetime.now()
+
+        if return_code != 0:
+            raise RuntimeError(f"Output ffmpeg of record {self.record_id} exited with code {return_code}")
+
+        await finalize_capture(str(self.filename))
+
+        logger.info(f"Finished recording video for record {self.record_id}")
+
+    async def _stop_ring_recording(self, ring: SegmentRing, on_finalizing: tp.Callable[[], None]) -> None:
+        """stitch the recording from the segment ring, including the pre-roll"""
+        assert self.start_time is not None
         self.end_time = datetime.now()
+        on_finalizing()
+
+        try:
+            await ring.export(self.start_time.timestamp(), self.end_time.timestamp(), str(self.filename))
+        finally:
+            ring.unpin(self.record_id)
+            self._ring = None
 
         logger.info(f"Finished recording video for record {self.record_id}")
 
 
-RECORDS: tp.Dict[str, Recording] = {}
-CAMERAS: tp.Dict[int, Camera] = {}
+CAMERAS_CONFIG_FILE: str = os.getenv("CAMERAS_CONFIG_FILE", "")
+
+
+def parse_cameras_config(config: tp.List[str]) -> tp.Dict[int, Camera]:
+    """build cameras from config entries formatted as 'number-ip:port-rtsp_link'. no I/O is done"""
+    cameras: tp.Dict[int, Camera] = {}
+
+    for entry in config:
+        try:
+            number, socket_address, rtsp = entry.split("-", 2)
+            host, port = socket_address.split(":", 1)
+            int(number)
+
+            if not host or not 0 < int(port) < 65536:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Invalid camera config entry '{entry}', expected 'number-ip:port-rtsp_link'")
+
+        cameras[int(number)] = Camera(
+            number=int(number),
+            socket_address=socket_address,
+            rtsp_stream_link=rtsp,
+        )
+
+    return cameras
+
+
+def read_cameras_config() -> tp.List[str]:
+    """read camera config entries from CAMERAS_CONFIG_FILE if it is set, or from CAMERAS_CONFIG"""
+    if CAMERAS_CONFIG_FILE:
+        with open(CAMERAS_CONFIG_FILE) as f:
+            config: tp.List[str] = json.load(f)
+            return config
 
-cameras_config: tp.Optional[str] = os.getenv("CAMERAS_CONFIG")
-assert cameras_config, "CAMERAS_CONFIG environment variable has not been provided"
-config: tp.List[str] = json.loads(cameras_config)
+    cameras_config: tp.Optional[str] = os.getenv("CAMERAS_CONFIG")
+    assert cameras_config, "Neither CAMERAS_CONFIG nor CAMERAS_CONFIG_FILE environment variable has been provided"
+    return list(json.loads(cameras_config))
 
-for entry in config:
-    number, socket_address, rtsp = entry.split("-", 2)
-    CAMERAS[int(number)] = Camera(
-        number=int(number),
-        socket_address=socket_address,
-        rtsp_stream_link=rtsp,
-    )
 
+CAMERAS: tp.Dict[int, Camera] = parse_cameras_config(read_cameras_config())
 logger.info(f"Initialized {len(CAMERAS)} cameras")
@@ -1,19 +1,35 @@
 from fastapi import HTTPException, status
 
-from .camera import Camera, Recording, CAMERAS, RECORDS
+from .camera import Camera, Recording, CAMERAS
+from .jobs import FinalizationJob, JOBS
+from .store import RECORDS
+from .tracing import span
 
 
 def get_camera_by_number(camera_number: int) -> Camera:
     """get a camera by its number"""
-    if camera_number in CAMERAS:
-        return CAMERAS[camera_number]
+    with span("camera_lookup"):
+        camera = CAMERAS.get(camera_number)
+
+    if camera is not None:
+        return camera
 
     raise HTTPException(status.HTTP_404_NOT_FOUND, f"No such camera: {camera_number}")
 
 
-def get_record_by_id(record_id: str) -> Recording:
+async def get_record_by_id(record_id: str) -> Recording:
     """get a record by its uuid"""
-    if record_id in RECORDS:
-        return RECORDS[record_id]
+    record = await RECORDS.get(record_id)
+
+    if record is not None:
+        return record
 
     raise HTTPException(status.HTTP_404_NOT_FOUND, f"No such recording: {record_id}")
+
+
+def get_job_by_id(job_id: str) -> FinalizationJob:
+    """get a finalization job by its uuid"""
+    if job_id in JOBS:
+        return JOBS[job_id]
+
+    raise HTTPException(status.HTTP_404_NOT_FOUND, f"No such finalization job: {job_id}")
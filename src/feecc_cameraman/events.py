@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import typing as tp
+from collections import deque
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from .camera import Recording
+from .metrics import EVENT_SUBSCRIBERS_LAGGED
+from .state import CLUSTER
+from .store import RECORDS
+
+EVENTS_HISTORY: int = int(os.getenv("EVENTS_HISTORY", 1000))
+EVENT_SUBSCRIBER_QUEUE_SIZE: int = int(os.getenv("EVENT_SUBSCRIBER_QUEUE_SIZE", 256))
+PROGRESS_EVENT_INTERVAL_SEC: float = float(os.getenv("PROGRESS_EVENT_INTERVAL_SEC", 2))
+EVENTS_KEEPALIVE_SEC: float = 15
+
+
+@dataclass(frozen=True)
+class Event:
+    type: str
+    data: tp.Dict[str, tp.Any]
+    seq: tp.Optional[int] = None  # None for volatile events, which are neither numbered nor replayed
+    created_at: float = field(default_factory=time.time)
+
+    def encode(self, worker_id: str) -> str:
+        """format the event as a server-sent event. its id is the resume token of the worker event stream"""
+        id_line = f"id: {worker_id}:{self.seq}\n" if self.seq is not None else ""
+        data = json.dumps({**self.data, "seq": self.seq, "worker_id": worker_id, "time": self.created_at}, default=str)
+        return f"{id_line}event: {self.type}\ndata: {data}\n\n"
+
+
+@dataclass(eq=False)
+class Subscriber:
+    queue: asyncio.Queue[Event] = field(default_factory=lambda: asyncio.Queue(EVENT_SUBSCRIBER_QUEUE_SIZE))
+    lagged: bool = False  # the queue overflowed, so the subscriber was detached and has to catch up from the history
+
+
+class EventBus:
+    """
+    Fans out recording and camera state changes to the subscribers of the event stream.
+    Publishing never waits: every subscriber has a bounded queue and is detached once it overflows,
+    to catch up from the history of the latest events. Events are numbered with a sequence monotonic across
+    restarts (it starts at the current unix time in milliseconds), so that a reconnecting client can resume from
+    the last event it has seen or learn it has to reload the full state. Every worker has its own bus, so event ids
+    carry the worker id and resuming on another worker makes the client reload the full state.
+    """
+
+    def __init__(self, worker_id: str = CLUSTER.worker.worker_id, history: int = EVENTS_HISTORY) -> None:
+        self.worker_id = worker_id
+        self.seq = int(time.time() * 1000)
+        self._history: tp.Deque[Event] = deque(maxlen=history)
+        self._subscribers: tp.Set[Subscriber] = set()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, type_: str, volatile: bool = False, **data: tp.Any) -> None:
+        """emit an event. volatile ones, e.g. progress ticks, are only delivered to the current subscribers"""
+        if volatile and not self._subscribers:
+            return
+
+        if volatile:
+            event = Event(type_, data)
+        else:
+            self.seq += 1
+            event = Event(type_, data, self.seq)
+            self._history.append(event)
+
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.lagged = True
+                self._subscribers.discard(subscriber)
+                EVENT_SUBSCRIBERS_LAGGED.inc()
+                logger.warning("An event stream subscriber is lagging behind. It is detached to catch up.")
+
+    def subscribe(self, last_seq: int) -> tp.Tuple[tp.Optional[tp.List[Event]], Subscriber]:
+        """
+        start receiving events. returns the events after last_seq, or None if some of them are not
+        in the history anymore, along with the subscriber getting the newer ones
+        """
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        oldest = self._history[0].seq if self._history else self.seq + 1
+        assert oldest is not None
+
+        if last_seq + 1 < oldest or last_seq > self.seq:
+            return None, subscriber
+
+        return [event for event in self._history if event.seq is not None and event.seq > last_seq], subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def parse_event_id(self, event_id: str) -> tp.Optional[int]:
+        """sequence number of an event id issued by this bus. None if it is malformed or comes from another worker"""
+        worker_id, _, seq = event_id.rpartition(":")
+        return int(seq) if worker_id == self.worker_id and seq.isdigit() else None
+
+    async def stream(
+        self, last_event_id: tp.Optional[str] = None, types: tp.Optional[tp.Set[str]] = None
+    ) -> tp.AsyncIterator[str]:
+        """server-sent events after the given one, or the ones from now on, followed by the live ones"""
+        last_seq = self.seq if last_event_id is None else self.parse_event_id(last_event_id)
+
+        if last_seq is None:
+            last_seq = self.seq
+            reason = f"event {last_event_id} was not issued by worker {self.worker_id}"
+            yield Event("resync", {"reason": reason}).encode(self.worker_id)
+
+        while True:
+            replay, subscriber = self.subscribe(last_seq)
+
+            try:
+                if replay is None:
+                    reason = f"events after {last_seq} are no longer available"
+                    last_seq, replay = self.seq, []
+                    yield Event("resync", {"reason": reason}).encode(self.worker_id)
+
+                for event in replay:
+                    assert event.seq is not None
+                    last_seq = event.seq
+
+                    if types is None or event.type in types:
+                        yield event.encode(self.worker_id)
+
+                while not (subscriber.lagged and subscriber.queue.empty()):
+                    try:
+                        event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_KEEPALIVE_SEC)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+
+                    if event.seq is not None:
+                        last_seq = event.seq
+
+                    if types is None or event.type in types:
+                        yield event.encode(self.worker_id)
+            finally:
+                self.unsubscribe(subscriber)
+
+
+EVENTS = EventBus()
+
+
+def publish_record_event(type_: str, record: Recording, **data: tp.Any) -> None:
+    EVENTS.publish(
+        type_,
+        record_id=record.record_id,
+        camera_number=record.camera_number,
+        state=record.state,
+        filename=record.filename,
+        group_id=record.metadata.get("group_id"),
+        **data,
+    )
+
+
+async def publish_progress(interval: float = PROGRESS_EVENT_INTERVAL_SEC) -> None:
+    """emit progress ticks of the ongoing recordings while anybody listens"""
+    while True:
+        await asyncio.sleep(interval)
+
+        if not EVENTS.has_subscribers:
+            continue
+
+        for record in list(RECORDS.values()):
+            progress = record.progress
+
+            if record.is_ongoing and progress is not None:
+                EVENTS.publish(
+                    "record_progress",
+                    volatile=True,
+                    record_id=record.record_id,
+                    camera_number=record.camera_number,
+                    frame=progress.frame,
+                    fps=progress.fps,
+                    bitrate_kbps=progress.bitrate_kbps,
+                    total_size=progress.total_size,
+                    out_time_sec=progress.out_time_sec,
+                    seconds_since_last_frame=progress.seconds_since_last_frame,
+                )
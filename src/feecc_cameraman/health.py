@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import typing as tp
+from dataclasses import dataclass
+from datetime import datetime
+
+from loguru import logger
+
+from .camera import CAMERAS, Camera
+from .events import EVENTS
+
+PROBE_TIMEOUT_SEC: float = float(os.getenv("CAMERA_PROBE_TIMEOUT_SEC", 0.25))
+PROBE_INTERVAL_SEC: float = float(os.getenv("CAMERA_PROBE_INTERVAL_SEC", 5))
+MAX_PROBE_BACKOFF_SEC: float = float(os.getenv("CAMERA_PROBE_MAX_BACKOFF_SEC", 60))
+
+
+@dataclass
+class CameraHealth:
+    """last known reachability state of a camera"""
+
+    is_up: bool = False
+    last_seen_up: tp.Optional[datetime] = None
+    last_probed: tp.Optional[datetime] = None
+    latency: tp.Optional[float] = None
+    consecutive_failures: int = 0
+    next_probe_at: float = 0.0
+
+    @property
+    def backoff(self) -> float:
+        """delay before the next scheduled probe. grows exponentially while the camera stays down"""
+        if not self.consecutive_failures:
+            return PROBE_INTERVAL_SEC
+
+        return float(min(PROBE_INTERVAL_SEC * 2 ** (self.consecutive_failures - 1), MAX_PROBE_BACKOFF_SEC))
+
+    def register_probe(self, latency: tp.Optional[float]) -> None:
+        """update the state with a probe result"""
+        self.last_probed = datetime.now()
+        self.latency = latency
+        self.is_up = latency is not None
+
+        if self.is_up:
+            self.last_seen_up = self.last_probed
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+
+        self.next_probe_at = time.monotonic() + self.backoff
+
+
+HEALTH: tp.Dict[int, CameraHealth] = {}
+
+
+def get_health(camera: Camera) -> CameraHealth:
+    """get the health table entry of a camera"""
+    return HEALTH.setdefault(camera.number, CameraHealth())
+
+
+async def probe_camera(camera: Camera) -> CameraHealth:
+    """probe a camera right away and record the result"""
+    latency = await camera.probe(PROBE_TIMEOUT_SEC)
+    health = get_health(camera)
+    was_up = health.is_up if health.last_probed is not None else None
+    health.register_probe(latency)
+
+    if health.is_up != was_up:
+        EVENTS.publish("camera_up" if health.is_up else "camera_down", camera_number=camera.number, latency=latency)
+
+    return health
+
+
+async def probe_cameras(cameras: tp.Iterable[Camera]) -> None:
+    """probe several cameras concurrently. a failing probe does not affect the others"""
+    cameras = list(cameras)
+    results = await asyncio.gather(*(probe_camera(camera) for camera in cameras), return_exceptions=True)
+
+    for camera, result in zip(cameras, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to probe {camera}: {result!r}")
+            get_health(camera).register_probe(None)
+
+
+async def is_camera_up(camera: Camera) -> bool:
+    """check camera availability using the health table. cameras that are not known to be up are probed live"""
+    health = get_health(camera)
+
+    if health.is_up:
+        return True
+
+    return (await probe_camera(camera)).is_up
+
+
+async def monitor_cameras_health(interval: float = PROBE_INTERVAL_SEC) -> None:
+    """Probe all the cameras in the background and keep the health table up to date.
+    Unreachable cameras are probed less often, with an exponential backoff."""
+    logger.info(f"A daemon was started to monitor cameras health. Update interval is {interval}s.")
+
+    while True:
+        now = time.monotonic()
+        due = [camera for camera in CAMERAS.values() if get_health(camera).next_probe_at <= now]
+
+        if due:
+            await probe_cameras(due)
+
+        await asyncio.sleep(interval)
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import tempfile
+import typing as tp
+
+from loguru import logger
+
+from .camera import Recording
+from .metrics import IDLE_TRIMMED_SECONDS
+from .output import FFMPEG_PROGRAM, TRIM_SUFFIX, _remove
+from .storage import STORAGE
+from .store import RECORDS
+from .streaminfo import describe_file
+
+IDLE_TRIMMING_CAMERAS: tp.List[int] = json.loads(os.getenv("IDLE_TRIMMING_CAMERAS", "[]"))
+IDLE_NOISE_TOLERANCE: float = float(os.getenv("IDLE_NOISE_TOLERANCE", 0.01))  # mean frame difference ratio
+IDLE_MIN_DURATION_SEC: float = float(os.getenv("IDLE_MIN_DURATION_SEC", 60))
+IDLE_PADDING_SEC: float = float(os.getenv("IDLE_PADDING_SEC", 2))  # activity context kept around every cut
+IDLE_ANALYSIS_FPS: float = float(os.getenv("IDLE_ANALYSIS_FPS", 2))
+IDLE_ANALYSIS_WIDTH: int = int(os.getenv("IDLE_ANALYSIS_WIDTH", 160))
+SEGMENT_TOLERANCE_SEC: float = 1.0  # stream copy cuts at packets, so every kept interval may be off a little
+
+_FREEZE = re.compile(r"lavfi\.freezedetect\.freeze_(start|end)=([\d.]+)")
+_PTS_TIME = re.compile(r"\bpts_time:([\d.]+)")
+
+Interval = tp.Tuple[float, float]
+
+
+class IdleTrimmingError(Exception):
+    pass
+
+
+def is_enabled(record: Recording) -> bool:
+    return record.camera_number in IDLE_TRIMMING_CAMERAS
+
+
+def parse_idle_runs(ffmpeg_output: str, duration: float) -> tp.List[Interval]:
+    """parse runs of frozen video reported by the freezedetect filter. a run with no end lasts until the end"""
+    runs: tp.List[Interval] = []
+    start: tp.Optional[float] = None
+
+    for edge, time_ in _FREEZE.findall(ffmpeg_output):
+        if edge == "start":
+            start = float(time_)
+        elif start is not None:
+            runs.append((start, float(time_)))
+            start = None
+
+    if start is not None and start < duration:
+        runs.append((start, duration))
+
+    return runs
+
+
+def parse_keyframes(ffmpeg_output: str) -> tp.List[float]:
+    """parse keyframe timestamps printed by the showinfo filter"""
+    return sorted(float(time_) for time_ in _PTS_TIME.findall(ffmpeg_output))
+
+
+def kept_intervals(
+    idle_runs: tp.Sequence[Interval],
+    duration: float,
+    keyframes: tp.Sequence[float],
+    padding: float = IDLE_PADDING_SEC,
+    min_duration: float = IDLE_MIN_DURATION_SEC,
+) -> tp.List[Interval]:
+    """
+    intervals of the video left after cutting out the idle runs longer than min_duration, shrunk by padding
+    around activity. every interval starts at a keyframe, so that it can be cut out with a stream copy
+    """
+    kept: tp.List[Interval] = []
+    position = 0.0
+
+    for start, end in sorted(idle_runs):
+        if end - start < min_duration:
+            continue
+
+        cut_start = start + padding
+        cut_end = end - padding if end < duration else duration
+
+        if cut_end - cut_start <= 0:
+            continue
+
+        if cut_start > position:
+            kept.append((position, cut_start))
+
+        position = max(position, cut_end)
+
+    if position < duration:
+        kept.append((position, duration))
+
+    aligned: tp.List[Interval] = []
+
+    for start, end in kept:
+        start = max((keyframe for keyframe in keyframes if keyframe <= start), default=0.0)
+
+        if aligned and start <= aligned[-1][1]:
+            aligned[-1] = (aligned[-1][0], max(aligned[-1][1], end))
+        else:
+            aligned.append((start, end))
+
+    return aligned
+
+
+def trimmed_position(position: float, kept: tp.Sequence[Interval]) -> float:
+    """where a position in the original video ends up once only the kept intervals remain, a cut one lands at the cut"""
+    trimmed = 0.0
+
+    for start, end in kept:
+        if position < start:
+            break
+
+        trimmed += min(position, end) - start
+
+    return trimmed
+
+
+def concat_list(filename: str, intervals: tp.Sequence[Interval]) -> str:
+    """ffconcat script cutting the intervals out of a file"""
+    path = os.path.abspath(filename).replace("'", "'\\''")
+    lines = ["ffconcat version 1.0"]
+
+    for start, end in intervals:
+        lines += [f"file '{path}'", f"inpoint {start:.3f}", f"outpoint {end:.3f}"]
+
+    return "\n".join(lines) + "\n"
+
+
+async def _run_ffmpeg(*args: str, preexec_fn: tp.Optional[tp.Callable[[], None]] = None) -> tp.Tuple[str, str]:
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_PROGRAM, "-nostdin", "-hide_banner", *args,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, preexec_fn=preexec_fn,
+    )  # fmt: skip
+
+    try:
+        stdout, stderr = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    if process.returncode != 0:
+        raise IdleTrimmingError(f"ffmpeg exited with code {process.returncode}: {stderr.decode(errors='replace')}")
+
+    return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+
+async def find_idle_runs(
+    filename: str, duration: float, threads: int, preexec_fn: tp.Optional[tp.Callable[[], None]] = None
+) -> tp.List[Interval]:
+    """decode the video at a low resolution and frame rate and find the runs with no activity in it"""
+    filters = (
+        f"fps={IDLE_ANALYSIS_FPS},scale={IDLE_ANALYSIS_WIDTH}:-2,"
+        f"freezedetect=n={IDLE_NOISE_TOLERANCE}:d={IDLE_MIN_DURATION_SEC},metadata=print:file=-"
+    )
+    stdout, _ = await _run_ffmpeg(
+        "-loglevel", "error", "-threads", str(threads), "-skip_loop_filter", "all", "-i", filename,
+        "-an", "-vf", filters, "-f", "null", "-",
+        preexec_fn=preexec_fn,
+    )  # fmt: skip
+    return parse_idle_runs(stdout, duration)
+
+
+async def find_keyframes(
+    filename: str, threads: int, preexec_fn: tp.Optional[tp.Callable[[], None]] = None
+) -> tp.List[float]:
+    _, stderr = await _run_ffmpeg(
+        "-skip_frame", "nokey", "-threads", str(threads), "-i", filename, "-an", "-vf", "showinfo", "-f", "null", "-",
+        preexec_fn=preexec_fn,
+    )  # fmt: skip
+    return parse_keyframes(stderr)
+
+
+async def _set_state(record: Recording, state: str, **details: tp.Any) -> None:
+    record.metadata["idle_trimming"] = {"state": state, **details}
+    await RECORDS.update(record)
+
+
+async def trim_idle(record: Recording, threads: int, preexec_fn: tp.Optional[tp.Callable[[], None]] = None) -> None:
+    """
+    cut the idle runs out of a finished recording with a stream copy and replace it atomically.
+    the kept intervals, in seconds of the original video, are saved in the 'idle_trimming' entry of the metadata
+    """
+    source = str(record.filename)
+
+    if not is_enabled(record) or record.error is not None or not os.path.exists(source):
+        return
+
+    destination = os.path.splitext(source)[0] + TRIM_SUFFIX
+    script = ""
+
+    try:
+        await _set_state(record, "running")
+        streams, duration = await describe_file(source)
+
+        if duration is None or not any(stream.kind == "Video" for stream in streams):
+            await _set_state(record, "skipped", reason="no video or unknown duration")
+            return
+
+        idle_runs = await find_idle_runs(source, duration, threads, preexec_fn)
+        keyframes = await find_keyframes(source, threads, preexec_fn) if idle_runs else []
+        kept = kept_intervals(idle_runs, duration, keyframes)
+        kept_duration = sum(end - start for start, end in kept)
+
+        if not kept or kept == [(0.0, duration)]:
+            await _set_state(record, "skipped", reason="no idle runs")
+            return
+
+        with tempfile.NamedTemporaryFile("w", suffix=".ffconcat", delete=False) as f:
+            script = f.name
+            f.write(concat_list(source, kept))
+
+        await _run_ffmpeg(
+            "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", script,
+            "-map", "0", "-c", "copy", "-movflags", "+faststart", "-y", destination,
+            preexec_fn=preexec_fn,
+        )  # fmt: skip
+        _, output_duration = await describe_file(destination)
+
+        if output_duration is None or abs(output_duration - kept_duration) > SEGMENT_TOLERANCE_SEC * len(kept):
+            raise IdleTrimmingError(f"Output duration {output_duration}s differs from the kept {kept_duration:.1f}s")
+
+        original_size = await asyncio.to_thread(os.path.getsize, source)
+        size = await asyncio.to_thread(os.path.getsize, destination)
+        await asyncio.to_thread(os.replace, destination, source)
+    except Exception as e:
+        logger.error(f"Idle trimming of record {record.record_id} failed: {e}")
+        await _set_state(record, "failed", error=str(e))
+        return
+    finally:
+        await asyncio.to_thread(_remove, destination)
+
+        if script:
+            await asyncio.to_thread(_remove, script)
+
+    STORAGE.resize(source, size)
+    IDLE_TRIMMED_SECONDS.inc(duration - output_duration)
+    record.metadata["size"] = size
+    record.metadata["duration"] = output_duration
+
+    if record.metadata.get("gaps"):
+        record.metadata["gaps"] = [
+            {**gap, "position": round(trimmed_position(gap["position"], kept), 3)} for gap in record.metadata["gaps"]
+        ]
+
+    await _set_state(
+        record,
+        "done",
+        kept=[[round(start, 3), round(end, 3)] for start, end in kept],
+        removed_sec=round(duration - output_duration, 3),
+        original_duration=duration,
+        original_size=original_size,
+        size=size,
+    )
+    logger.info(
+        f"Trimmed {duration - output_duration:.1f}s of idle video out of record {record.record_id}: "
+        f"{original_size} -> {size} bytes"
+    )
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import typing as tp
+from dataclasses import dataclass
+
+from loguru import logger
+
+from .metrics import FIRST_FRAME_SECONDS
+from .output import FFMPEG_PROGRAM, OUTPUT_ARGS, OUTPUT_MODE
+from .progress import PROGRESS_ARGS, FfmpegMonitor
+
+SHARED_INGEST: bool = os.getenv("SHARED_INGEST", "false").lower() in ("1", "true", "yes")
+INGEST_CHUNK_SIZE: int = 64 * 1024
+INGEST_OUTPUT_QUEUE_SIZE: int = int(os.getenv("INGEST_OUTPUT_QUEUE_SIZE", 256))
+INGEST_OUTPUT_CLOSE_TIMEOUT_SEC: float = 10
+
+
+@dataclass
+class _Output:
+    """a recording attached to the ingest: an ffmpeg process muxing the shared stream into a file"""
+
+    record_id: str
+    process: asyncio.subprocess.Process
+    monitor: FfmpegMonitor
+    queue: asyncio.Queue[bytes]
+    writer: tp.Optional[asyncio.Task[None]] = None
+    dropped_chunks: int = 0
+
+
+class Ingest:
+    """
+    A single upstream ffmpeg process pulling the camera RTSP stream and relaying it as MPEG-TS to
+    any number of recording outputs. Outputs are attached and detached without restarting the upstream,
+    which is torn down once the last output is detached.
+    """
+
+    def __init__(self, camera_number: int, rtsp_stream_link: str) -> None:
+        self.camera_number = camera_number
+        self.rtsp_stream_link = rtsp_stream_link
+        self._outputs: tp.Dict[str, _Output] = {}
+        self._process: tp.Optional[asyncio.subprocess.Process] = None
+        self._pump: tp.Optional[asyncio.Task[None]] = None
+        self._lock = asyncio.Lock()
+
+    def __str__(self) -> str:
+        return f"Ingest of camera no.{self.camera_number}"
+
+    def __len__(self) -> int:
+        return len(self._outputs)
+
+    @property
+    def process_count(self) -> int:
+        """running ffmpeg processes: the upstream and the outputs"""
+        upstream = self._process is not None and self._process.returncode is None
+        return int(upstream) + len(self._outputs)
+
+    def _upstream_args(self) -> tp.List[str]:
+        return [
+            "-loglevel", "warning", "-rtsp_transport", "tcp", "-i", self.rtsp_stream_link,
+            "-c", "copy", "-map", "0", "-f", "mpegts", "pipe:1",
+        ]  # fmt: skip
+
+    @staticmethod
+    def _output_args(filename: str) -> tp.List[str]:
+        bitstream_filters = [] if OUTPUT_MODE == "mpegts" else ["-bsf:a", "aac_adtstoasc"]
+        return [
+            *PROGRESS_ARGS, "-loglevel", "warning", "-f", "mpegts", "-i", "pipe:0",
+            "-c", "copy", "-map", "0", *bitstream_filters, *OUTPUT_ARGS[OUTPUT_MODE], "-y", filename,
+        ]  # fmt: skip
+
+    async def attach(self, record_id: str, filename: str) -> None:
+        """start writing the shared stream into a file, starting the upstream if it is not running yet"""
+        async with self._lock:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_PROGRAM,
+                *self._output_args(filename),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            output = _Output(
+                record_id=record_id,
+                process=process,
+                monitor=FfmpegMonitor(
+                    process,
+                    name=f"record {record_id}",
+                    on_first_frame=lambda latency: FIRST_FRAME_SECONDS.observe(
+                        latency, camera=self.camera_number, probe="full"
+                    ),
+                ),
+                queue=asyncio.Queue(INGEST_OUTPUT_QUEUE_SIZE),
+            )
+            output.writer = asyncio.create_task(self._feed(output))
+            self._outputs[record_id] = output
+
+            if self._pump is None:
+                self._pump = asyncio.create_task(self._run_upstream())
+
+        logger.info(f"Record {record_id} attached to {self}. {len(self)} outputs total.")
+
+    def monitor(self, record_id: str) -> FfmpegMonitor:
+        """get the output ffmpeg monitor of an attached recording"""
+        return self._outputs[record_id].monitor
+
+    async def detach(self, record_id: str) -> int:
+        """finalize the output file of a recording and return ffmpeg exit code. stops the upstream if no outputs left"""
+        async with self._lock:
+            output = self._outputs.pop(record_id)
+
+            if not self._outputs:
+                await self._stop_upstream()
+
+        await self._close_output(output)
+        return_code = await output.process.wait()
+        await output.monitor.wait_closed()
+
+        if return_code != 0:
+            logger.error(f"Output ffmpeg of record {record_id} exited with code {return_code}")
+            logger.debug(f"ffmpeg output: {output.monitor.tail}")
+
+        if output.dropped_chunks:
+            logger.warning(f"Record {record_id} output was lagging behind, {output.dropped_chunks} chunks dropped")
+
+        logger.info(f"Record {record_id} detached from {self}. {len(self)} outputs left.")
+        return return_code
+
+    async def _run_upstream(self) -> None:
+        """pull the stream and fan it out to the outputs. the upstream is restarted if it exits prematurely"""
+        while True:
+            self._process = await asyncio.create_subprocess_exec(
+                FFMPEG_PROGRAM, *self._upstream_args(), stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+            )
+            logger.debug(f"{self} spawned upstream ffmpeg. {self._process.pid=}")
+            assert self._process.stdout is not None
+
+            while chunk := await self._process.stdout.read(INGEST_CHUNK_SIZE):
+                for output in self._outputs.values():
+                    if output.writer is not None and output.writer.done():
+                        continue  # the output ffmpeg is gone, nobody drains its queue
+
+                    try:
+                        output.queue.put_nowait(chunk)
+                    except asyncio.QueueFull:
+                        output.dropped_chunks += 1
+
+            return_code = await self._process.wait()
+            logger.error(f"{self} upstream ffmpeg exited with code {return_code}. Restarting.")
+            await asyncio.sleep(1)
+
+    async def _stop_upstream(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.wait({self._pump})
+            self._pump = None
+
+        if self._process is not None and self._process.returncode is None:
+            self._process.terminate()
+            await self._process.wait()
+
+        self._process = None
+        logger.debug(f"{self} upstream stopped")
+
+    @staticmethod
+    async def _close_output(output: _Output) -> None:
+        """
+        let the output ffmpeg write the queued chunks and finish the file. an output ffmpeg which is gone
+        or does not take the stream in time is not waited for
+        """
+        assert output.writer is not None
+
+        if output.writer.done() or output.process.returncode is not None:
+            output.writer.cancel()
+        else:
+            while output.queue.full():  # make room for the end of stream mark without blocking
+                output.queue.get_nowait()
+                output.dropped_chunks += 1
+
+            output.queue.put_nowait(b"")
+
+        _, pending = await asyncio.wait({output.writer}, timeout=INGEST_OUTPUT_CLOSE_TIMEOUT_SEC)
+
+        if pending:
+            logger.error(f"Output ffmpeg of record {output.record_id} is stuck. Terminating.")
+            output.writer.cancel()
+
+            if output.process.returncode is None:
+                output.process.terminate()
+
+    @staticmethod
+    async def _feed(output: _Output) -> None:
+        """write queued chunks into the output ffmpeg. an empty chunk marks the end of the stream"""
+        assert output.process.stdin is not None
+
+        try:
+            while chunk := await output.queue.get():
+                output.process.stdin.write(chunk)
+                await output.process.stdin.drain()
+        except ConnectionError:
+            logger.error(f"Output ffmpeg of record {output.record_id} is gone")
+        finally:
+            output.process.stdin.close()
+
+
+INGESTS: tp.Dict[int, Ingest] = {}
+
+
+async def attach_to_ingest(camera_number: int, rtsp_stream_link: str, record_id: str, filename: str) -> Ingest:
+    """attach a recording to the shared camera ingest, creating it if necessary or if the camera stream has changed"""
+    ingest = INGESTS.get(camera_number)
+
+    if ingest is None or ingest.rtsp_stream_link != rtsp_stream_link:
+        if ingest is not None:
+            logger.info(f"{ingest} stream has changed. {len(ingest)} recordings stay on it until they are stopped.")
+
+        ingest = INGESTS[camera_number] = Ingest(camera_number, rtsp_stream_link)
+
+    await ingest.attach(record_id, filename)
+    return ingest
+
+
+async def detach_from_ingest(ingest: Ingest, record_id: str) -> int:
+    """detach a recording from the camera ingest and drop the ingest once nobody uses it"""
+    return_code = await ingest.detach(record_id)
+
+    if not len(ingest) and INGESTS.get(ingest.camera_number) is ingest:
+        del INGESTS[ingest.camera_number]
+
+    return return_code
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import os
+import typing as tp
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import requests
+from loguru import logger
+
+from .camera import Recording
+from .events import publish_record_event
+from .metrics import BYTES_WRITTEN
+from .pipeline import POSTPROCESSOR
+from .resources import RESOURCES
+from .scheduler import DEADLINES
+from .state import CLUSTER
+from .storage import STORAGE
+from .store import RECORDS
+from .transcode import TRANSCODER
+
+FINALIZATION_JOBS_HISTORY: int = int(os.getenv("FINALIZATION_JOBS_HISTORY", 1000))
+CALLBACK_TIMEOUT_SEC: float = 10
+
+
+class JobState(str, enum.Enum):
+    STOPPING = "stopping"
+    FINALIZING = "finalizing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class FinalizationJob:
+    """a background task stopping a recording and finalizing its video file"""
+
+    record: Recording
+    callback_url: tp.Optional[str] = None
+    job_id: str = field(default_factory=lambda: CLUSTER.new_job_id())
+    state: JobState = JobState.STOPPING
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: tp.Optional[datetime] = None
+    size: tp.Optional[int] = None  # bytes
+    duration: tp.Optional[float] = None  # seconds
+    error: tp.Optional[str] = None
+    _task: tp.Optional[asyncio.Task[None]] = field(default=None, repr=False)
+    _submission: tp.Optional[asyncio.Task[None]] = field(default=None, repr=False)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in (JobState.DONE, JobState.FAILED)
+
+    def as_dict(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "job_id": self.job_id,
+            "record_id": self.record.record_id,
+            "state": self.state,
+            "filename": self.record.filename,
+            "size": self.size,
+            "duration": self.duration,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    async def wait(self) -> None:
+        """wait for the job to finish"""
+        assert self._task is not None
+        await asyncio.shield(self._task)
+
+    def _set_finalizing(self) -> None:
+        self.state = JobState.FINALIZING
+        publish_record_event("record_stopped", self.record, job_id=self.job_id)
+        logger.debug(f"Finalization job {self.job_id}: record {self.record.record_id} is being finalized")
+
+    async def _run(self) -> None:
+        DEADLINES.cancel(self.record.record_id)
+
+        try:
+            await self.record.stop(on_finalizing=self._set_finalizing)
+            self.size = await asyncio.to_thread(os.path.getsize, str(self.record.filename))
+            progress = self.record.progress
+            self.duration = self.record.captured_seconds or (
+                progress.out_time_sec if progress and progress.out_time_sec else float(len(self.record))
+            )
+            self.record.metadata.update(size=self.size, duration=self.duration)
+            self.state = JobState.DONE
+        except Exception as e:
+            self.error = str(e)
+            self.state = JobState.FAILED
+            self.record.error = self.error
+            self.record.end_time = self.record.end_time or datetime.now()
+            logger.error(f"Finalization job {self.job_id} for record {self.record.record_id} failed: {e}")
+
+        RESOURCES.release_capture(self.record.record_id)
+        self.finished_at = datetime.now()
+
+        try:
+            await self._complete()
+        except Exception as e:
+            logger.error(f"Finalization job {self.job_id} failed to complete record {self.record.record_id}: {e}")
+        finally:
+            if self.callback_url is not None:
+                await self._notify()
+
+    async def _complete(self) -> None:
+        """archive the record, announce the result and hand the video over for processing"""
+        await RECORDS.archive(self.record)
+        await CLUSTER.forget_record(self.record.record_id)
+        logger.info(f"Finalization job {self.job_id} finished with state '{self.state.value}'")
+
+        if self.state == JobState.DONE:
+            assert self.size is not None
+            publish_record_event(
+                "record_finalized", self.record, job_id=self.job_id, size=self.size, duration=self.duration
+            )
+            STORAGE.add(self.record, self.size)
+            BYTES_WRITTEN.inc(self.size, camera=self.record.camera_number)
+            # the processing queues are bounded, their backpressure must not hold back stopping the recording
+            self._submission = asyncio.create_task(self._submit())
+        else:
+            publish_record_event("record_failed", self.record, job_id=self.job_id, error=self.error)
+
+    async def _submit(self) -> None:
+        """queue the finished recording for transcoding or post-processing"""
+        try:
+            if TRANSCODER.wants(self.record):
+                await TRANSCODER.submit(self.record)
+            else:
+                await POSTPROCESSOR.submit(self.record)
+        except Exception as e:
+            logger.error(f"Failed to queue record {self.record.record_id} for processing: {e}")
+
+    async def _notify(self) -> None:
+        """report job results to the completion callback URL"""
+        payload = {**self.as_dict(), "created_at": str(self.created_at), "finished_at": str(self.finished_at)}
+
+        try:
+            response = await asyncio.to_thread(
+                requests.post, str(self.callback_url), json=payload, timeout=CALLBACK_TIMEOUT_SEC
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.error(f"Failed to deliver finalization job {self.job_id} callback to {self.callback_url}: {e}")
+
+
+JOBS: tp.OrderedDict[str, FinalizationJob] = OrderedDict()
+
+
+def start_finalization(record: Recording, callback_url: tp.Optional[str] = None) -> FinalizationJob:
+    """stop a recording in the background. returns an existing job if the recording is already being stopped"""
+    for job in reversed(JOBS.values()):
+        if job.record is record and not job.is_finished:
+            return job
+
+    job = FinalizationJob(record=record, callback_url=callback_url)
+    job._task = asyncio.create_task(job._run())
+    JOBS[job.job_id] = job
+    _forget_finished_jobs()
+    return job
+
+
+def _forget_finished_jobs() -> None:
+    """keep only a bounded history of finished jobs"""
+    excess = len(JOBS) - FINALIZATION_JOBS_HISTORY
+
+    for job_id in [job_id for job_id, job in JOBS.items() if job.is_finished][: max(excess, 0)]:
+        del JOBS[job_id]
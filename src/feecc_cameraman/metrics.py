@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import abc
+import bisect
+import math
+import time
+import typing as tp
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS: tp.Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS: tp.Tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120)
+
+LabelValues = tp.Tuple[str, ...]
+
+
+def _format_labels(names: tp.Sequence[str], values: tp.Sequence[str]) -> str:
+    if not names:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    """a named family of time series, one per combination of label values"""
+
+    type_: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tp.Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def _key(self, labels: tp.Dict[str, tp.Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> tp.Iterator[tp.Tuple[str, tp.Sequence[str], tp.Sequence[str], float]]:
+        """(suffix, label names, label values, value) of every sample"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_}"]
+
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tp.Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: tp.Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels: tp.Any) -> None:
+        """mirror a monotonic count maintained elsewhere"""
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> tp.Iterator[tp.Tuple[str, tp.Sequence[str], tp.Sequence[str], float]]:
+        for key, value in list(self._values.items()):
+            yield "", self.labels, key, value
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tp.Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: tp.Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: tp.Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        """drop all the series, e.g. before setting the current ones of removed cameras"""
+        self._values.clear()
+
+    def samples(self) -> tp.Iterator[tp.Tuple[str, tp.Sequence[str], tp.Sequence[str], float]]:
+        for key, value in list(self._values.items()):
+            yield "", self.labels, key, value
+
+
+class Histogram(Metric):
+    """observations are counted into cumulative buckets when rendered, so observing is a bisect and two additions"""
+
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tp.Sequence[str] = (),
+        buckets: tp.Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: tp.Dict[LabelValues, tp.List[int]] = {}
+        self._sums: tp.Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def time(self, **labels: tp.Any) -> "_Timer":
+        """a context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def samples(self) -> tp.Iterator[tp.Tuple[str, tp.Sequence[str], tp.Sequence[str], float]]:
+        names = (*self.labels, "le")
+
+        for key, counts in list(self._counts.items()):
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield "_bucket", names, (*key, _format_value(bound)), cumulative
+
+            yield "_sum", self.labels, key, self._sums[key]
+            yield "_count", self.labels, key, cumulative
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: tp.Dict[str, tp.Any]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.started_at = 0.0
+
+    def __enter__(self) -> None:
+        self.started_at = time.monotonic()
+
+    def __exit__(self, *_: tp.Any) -> None:
+        self.histogram.observe(time.monotonic() - self.started_at, **self.labels)
+
+
+REGISTRY: tp.List[Metric] = []
+
+
+def render() -> str:
+    """all the metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "cameraman_http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+FIRST_FRAME_SECONDS = Histogram(
+    "cameraman_ffmpeg_first_frame_seconds",
+    "Time from spawning a recording ffmpeg process to its first output frame by the stream probe it was started with",
+    ["camera", "probe"],
+    SLOW_BUCKETS,
+)
+RECORDING_STOP_SECONDS = Histogram(
+    "cameraman_recording_stop_duration_seconds",
+    "Time to stop a recording and finalize its file",
+    ["camera"],
+    SLOW_BUCKETS,
+)
+AUTH_SECONDS = Histogram("cameraman_auth_duration_seconds", "Employee authentication latency", ["result"])
+AUTH_CACHE_EVENTS = Counter(
+    "cameraman_auth_cache_events_total", "Employee cache hits, misses, stale hits and evictions", ["event"]
+)
+CAMERA_PROBE_SECONDS = Histogram("cameraman_camera_probe_duration_seconds", "Camera socket connect latency", ["camera"])
+CAMERA_PROBE_FAILURES = Counter("cameraman_camera_probe_failures_total", "Failed camera probes", ["camera"])
+CAMERA_UP = Gauge("cameraman_camera_up", "Whether the camera was reachable on the last probe", ["camera"])
+FFMPEG_PROCESSES = Gauge("cameraman_ffmpeg_processes", "Running ffmpeg processes by their purpose", ["kind"])
+BYTES_WRITTEN = Counter("cameraman_recorded_bytes_total", "Bytes of finalized recordings", ["camera"])
+ONGOING_BYTES = Gauge("cameraman_ongoing_recording_bytes", "Bytes written so far by ongoing recordings", ["camera"])
+STUCK_RECORDS_REAPED = Counter(
+    "cameraman_stuck_records_reaped_total", "Recordings stopped on their deadline", ["camera"]
+)
+STORAGE_BYTES = Gauge("cameraman_storage_bytes", "Bytes taken by video files", ["camera"])
+DISK_FREE_BYTES = Gauge("cameraman_disk_free_bytes", "Free space on the video disk")
+TRANSCODING_QUEUE = Gauge("cameraman_transcoding_queue", "Recordings waiting to be transcoded")
+TRANSCODING_SECONDS = Histogram(
+    "cameraman_transcoding_duration_seconds", "Time to transcode a recording", ["profile"], SLOW_BUCKETS
+)
+TRANSCODED_MEDIA_SECONDS = Counter(
+    "cameraman_transcoded_media_seconds_total", "Duration of the transcoded recordings", ["profile"]
+)
+TRANSCODING_SAVED_BYTES = Counter(
+    "cameraman_transcoding_saved_bytes_total", "Disk space saved by transcoding recordings", ["profile"]
+)
+TRANSCODING_RESULTS = Counter(
+    "cameraman_transcoding_results_total", "Transcoded, failed and skipped recordings", ["result"]
+)
+IDLE_TRIMMED_SECONDS = Counter(
+    "cameraman_idle_trimmed_seconds_total", "Duration of the idle video cut out of the recordings"
+)
+CAPTURE_RESTARTS = Counter(
+    "cameraman_capture_restarts_total",
+    "Recording ffmpeg processes restarted as they exited or stalled",
+    ["camera", "reason"],
+)
+HOST_RESOURCE_USAGE = Gauge(
+    "cameraman_host_resource_usage", "Host resources claimed by recordings and background jobs", ["resource", "kind"]
+)
+ADMISSIONS_REFUSED = Counter(
+    "cameraman_admissions_refused_total", "Recordings refused as the host is at capacity", ["reason"]
+)
+EVENT_SUBSCRIBERS = Gauge("cameraman_event_subscribers", "Connected event stream clients")
+EVENT_SUBSCRIBERS_LAGGED = Counter(
+    "cameraman_event_subscribers_lagged_total", "Event stream clients detached to catch up as their buffer overflowed"
+)
+
+
+class MetricsMiddleware:
+    """observe latency of every HTTP request labelled with its route template rather than the raw path"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.monotonic()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = self._get_route(scope)
+            HTTP_REQUEST_SECONDS.observe(
+                time.monotonic() - started_at, method=scope["method"], route=route, status=status_code
+            )
+
+    def _get_route(self, scope: Scope) -> str:
+        app: tp.Any = scope.get("app")
+
+        for route in getattr(getattr(app, "router", None), "routes", []):
+            match, _ = route.matches(scope)
+
+            if match == Match.FULL:
+                return str(route.path)
+
+        return "unmatched"
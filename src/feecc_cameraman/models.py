@@ -1,7 +1,7 @@
 import typing as tp
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class GenericResponse(BaseModel):
@@ -9,6 +9,10 @@ class GenericResponse(BaseModel):
     details: str
 
 
+class CapacityResponse(GenericResponse):
+    retry_after: int  # seconds, also sent in the Retry-After header
+
+
 class StartRecordResponse(GenericResponse):
     record_id: str
 
@@ -17,23 +21,109 @@ class StopRecordResponse(GenericResponse):
     filename: str
 
 
+class ProgressModel(BaseModel):
+    frame: int
+    fps: tp.Optional[float]
+    bitrate_kbps: tp.Optional[float]
+    total_size: int  # bytes written so far
+    speed: tp.Optional[float]
+    dup_frames: int
+    drop_frames: int
+    seconds_since_last_frame: tp.Optional[float]
+
+
+class FinalizationJobModel(BaseModel):
+    job_id: str
+    record_id: str
+    state: str  # stopping, finalizing, done or failed
+    filename: tp.Optional[str]
+    size: tp.Optional[int]  # bytes
+    duration: tp.Optional[float]  # seconds
+    error: tp.Optional[str]
+    created_at: datetime
+    finished_at: tp.Optional[datetime]
+
+
+class FinalizationJobResponse(GenericResponse):
+    job: FinalizationJobModel
+
+
 class RecordData(BaseModel):
     filename: tp.Optional[str]
     record_id: str
     start_time: tp.Optional[datetime]
     end_time: tp.Optional[datetime]
+    camera_number: tp.Optional[int] = None
+    state: tp.Optional[str] = None  # ongoing, ended or failed
+    error: tp.Optional[str] = None
+    metadata: tp.Dict[str, tp.Any] = {}
+    progress: tp.Optional[ProgressModel] = None
+
+
+class RecordResponse(GenericResponse):
+    record: RecordData
 
 
 class RecordList(GenericResponse):
     ongoing_records: tp.List[RecordData]
     ended_records: tp.List[RecordData]
+    next_cursor: tp.Optional[str] = None  # pass it as a cursor to get the next page of ended records
 
 
 class CameraModel(BaseModel):
     number: int
     host: str
     is_up: bool
+    last_seen_up: tp.Optional[datetime] = None
+    latency: tp.Optional[float] = None  # socket connect latency in seconds
+    consecutive_failures: int = 0
 
 
 class CameraList(GenericResponse):
     cameras: tp.List[CameraModel]
+
+
+class CamerasConfig(BaseModel):
+    cameras: tp.List[str]  # entries formatted as 'number-ip:port-rtsp_link', same as in CAMERAS_CONFIG
+
+
+class CamerasReloadResponse(GenericResponse):
+    added: tp.List[int]
+    removed: tp.List[int]
+    changed: tp.List[int]
+
+
+class StorageStats(GenericResponse):
+    total_bytes: int  # bytes taken by indexed video files
+    camera_bytes: tp.Dict[str, int]  # bytes by camera number, 'unknown' for files of unknown cameras
+    files: int
+    disk_free_bytes: int
+    quota_bytes: tp.Optional[int] = None
+
+
+class BatchStartRequest(BaseModel):
+    cameras: tp.List[int]
+    max_duration: tp.Optional[int] = Field(None, gt=0)  # seconds
+    atomic: bool = False  # discard the started recordings if some camera fails to start
+    group_id: tp.Optional[str] = None  # generated if not set
+
+
+class BatchStopRequest(BaseModel):
+    record_ids: tp.List[str] = []
+    group_id: tp.Optional[str] = None  # stop the recordings of the group as well
+    background: bool = False
+
+
+class BatchItemModel(BaseModel):
+    status: int
+    details: str
+    camera_number: tp.Optional[int] = None
+    record_id: tp.Optional[str] = None
+    filename: tp.Optional[str] = None
+    job_id: tp.Optional[str] = None
+    retry_after: tp.Optional[int] = None
+
+
+class BatchResponse(GenericResponse):
+    group_id: tp.Optional[str] = None
+    results: tp.List[BatchItemModel]
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import os
+import shlex
+import struct
+import tempfile
+import time
+import typing as tp
+
+from loguru import logger
+
+VIDEO_DIR: str = "output/video"
+FFMPEG_COMMAND: str = os.getenv(
+    "FFMPEG_COMMAND", 'ffmpeg -loglevel warning -rtsp_transport tcp -i "RTSP_STREAM" -r 25 -c copy -map 0 FILENAME'
+)
+FFMPEG_ARGV: tp.List[str] = shlex.split(FFMPEG_COMMAND)
+FFMPEG_PROGRAM: str = FFMPEG_ARGV[0]  # run by every ffmpeg process, so wrappers and fakes apply to all of them
+OUTPUT_MODE: str = os.getenv("OUTPUT_MODE", "mp4").lower()
+RECOVER_ORPHANED_FILES: bool = os.getenv("RECOVER_ORPHANED_FILES", "true").lower() in ("1", "true", "yes")
+ORPHANED_FILE_MIN_AGE_SEC: float = float(os.getenv("ORPHANED_FILE_MIN_AGE_SEC", 30))
+
+# muxer options inserted before the output file name of the capturing ffmpeg in every mode
+OUTPUT_ARGS: tp.Dict[str, tp.List[str]] = {
+    "mp4": [],
+    "fmp4": ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"],
+    "mpegts": ["-f", "mpegts"],
+}
+assert OUTPUT_MODE in OUTPUT_ARGS, f"Unknown OUTPUT_MODE {OUTPUT_MODE}, expected one of {', '.join(OUTPUT_ARGS)}"
+
+CAPTURE_SUFFIX: str = ".ts"
+REMUX_SUFFIX: str = ".remux.mp4"
+TRANSCODE_SUFFIX: str = ".transcode.mp4"
+TRIM_SUFFIX: str = ".trim.mp4"
+JOIN_SUFFIX: str = ".join.mp4"
+BROKEN_SUFFIX: str = ".broken"
+
+
+def get_capture_filename(filename: str) -> str:
+    """file ffmpeg writes into while recording. in mpegts mode it is remuxed into the final file on stop"""
+    if OUTPUT_MODE == "mpegts":
+        return os.path.splitext(filename)[0] + CAPTURE_SUFFIX
+
+    return filename
+
+
+def scan_mp4(path: str) -> tp.Tuple[bool, bool]:
+    """walk top level boxes of an MP4 file. returns whether it has a moov box and whether the last box is truncated"""
+    size = os.path.getsize(path)
+    has_moov, offset = False, 0
+
+    with open(path, "rb") as f:
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size, box_type = struct.unpack(">I4s", header[:8])
+
+            if box_size == 1 and len(header) == 16:
+                box_size = struct.unpack(">Q", header[8:])[0]
+            elif box_size == 0:
+                box_size = size - offset
+
+            if box_size < 8:
+                return has_moov, True
+
+            has_moov = has_moov or box_type == b"moov"
+            offset += box_size
+
+    return has_moov, offset != size
+
+
+async def remux(source: str, destination: str) -> None:
+    """copy streams of the source file into a playable MP4 file. the destination is replaced atomically"""
+    temporary = os.path.splitext(destination)[0] + REMUX_SUFFIX
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_PROGRAM, "-loglevel", "error", "-i", source,
+        "-c", "copy", "-map", "0", "-bsf:a", "aac_adtstoasc", "-y", temporary,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )  # fmt: skip
+    _, stderr = await process.communicate()
+
+    if process.returncode != 0:
+        await asyncio.to_thread(_remove, temporary)
+        raise RuntimeError(f"Failed to remux {source}: {stderr.decode(errors='replace').strip()}")
+
+    await asyncio.to_thread(os.replace, temporary, destination)
+
+
+async def finalize_capture(filename: str) -> None:
+    """turn the capture file of a stopped recording into its final file if they differ"""
+    capture = get_capture_filename(filename)
+
+    if capture == filename or not os.path.exists(capture):
+        return
+
+    started_at = time.monotonic()
+    await remux(capture, filename)
+    await asyncio.to_thread(_remove, capture)
+    logger.debug(f"Remuxed {capture} into {filename} in {time.monotonic() - started_at:.2f}s")
+
+
+def get_part_filename(capture_filename: str, index: int) -> str:
+    """file ffmpeg writes into after capture of a recording was restarted index times"""
+    if index == 0:
+        return capture_filename
+
+    base, extension = os.path.splitext(capture_filename)
+    return f"{base}.part{index}{extension}"
+
+
+async def join_parts(parts: tp.Sequence[str], destination: str) -> None:
+    """concatenate capture parts into a playable MP4 file without re-encoding. the destination is replaced atomically"""
+    temporary = os.path.splitext(destination)[0] + JOIN_SUFFIX
+
+    with tempfile.NamedTemporaryFile("w", suffix=".ffconcat", delete=False) as f:
+        script = f.name
+        f.write("ffconcat version 1.0\n")
+
+        for part in parts:
+            path = os.path.abspath(part).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_PROGRAM, "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", script,
+            "-c", "copy", "-map", "0", "-bsf:a", "aac_adtstoasc", "-y", temporary,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )  # fmt: skip
+        _, stderr = await process.communicate()
+    finally:
+        await asyncio.to_thread(_remove, script)
+
+    if process.returncode != 0:
+        await asyncio.to_thread(_remove, temporary)
+        raise RuntimeError(
+            f"Failed to join {len(parts)} parts of {destination}: {stderr.decode(errors='replace').strip()}"
+        )
+
+    await asyncio.to_thread(os.replace, temporary, destination)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _find_orphans(directory: str, is_in_use: tp.Callable[[str], bool]) -> tp.Dict[str, str]:
+    """classify files left in the video directory by a previous run. returns file paths mapped to actions"""
+    orphans: tp.Dict[str, str] = {}
+    now = time.time()
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name, path = entry.name, entry.path
+
+            if not entry.is_file() or name.endswith(BROKEN_SUFFIX) or name.startswith("."):
+                continue
+
+            record_id = name.split(".", 1)[0]
+
+            if is_in_use(record_id) or now - entry.stat().st_mtime < ORPHANED_FILE_MIN_AGE_SEC:
+                continue
+
+            if name.endswith((REMUX_SUFFIX, TRANSCODE_SUFFIX, TRIM_SUFFIX, JOIN_SUFFIX)):
+                orphans[path] = "remove"
+            elif name.endswith(CAPTURE_SUFFIX):
+                orphans[path] = "remux"
+            elif name.endswith(".mp4"):
+                try:
+                    has_moov, truncated = scan_mp4(path)
+                except (OSError, struct.error):
+                    has_moov, truncated = False, True
+
+                if not has_moov:
+                    orphans[path] = "unrecoverable"
+                elif truncated:
+                    orphans[path] = "repair"
+
+    return orphans
+
+
+async def recover_orphaned_files(is_in_use: tp.Callable[[str], bool], directory: str = VIDEO_DIR) -> tp.Dict[str, str]:
+    """
+    Find video files left unfinished by a crash or a kill of a previous run and turn them into playable ones:
+    MPEG-TS captures are remuxed into MP4, fragmented MP4 files with a truncated tail are remuxed in place and
+    plain MP4 files without a moov box, which cannot be recovered, are renamed with a '.broken' suffix.
+    Only one worker of the host runs the pass. Returns processed file paths mapped to the outcomes.
+    """
+    if not os.path.isdir(directory):
+        return {}
+
+    lock = open(os.path.join(directory, ".recovery.lock"), "w")
+
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return {}
+
+    outcomes: tp.Dict[str, str] = {}
+
+    try:
+        orphans = await asyncio.to_thread(_find_orphans, directory, is_in_use)
+
+        for path, action in orphans.items():
+            try:
+                if action == "remove":
+                    await asyncio.to_thread(_remove, path)
+                elif action == "remux":
+                    await remux(path, os.path.splitext(path)[0] + ".mp4")
+                    await asyncio.to_thread(_remove, path)
+                elif action == "repair":
+                    await remux(path, path)
+                elif action == "unrecoverable":
+                    await asyncio.to_thread(os.replace, path, path + BROKEN_SUFFIX)
+                    logger.error(f"Video file {path} has no moov box and cannot be recovered")
+
+                outcomes[path] = action
+            except Exception as e:
+                outcomes[path] = "failed"
+                logger.error(f"Failed to recover orphaned video file {path}: {e}")
+
+    finally:
+        lock.close()
+
+    if outcomes:
+        logger.info(f"Processed {len(outcomes)} orphaned video files: {outcomes}")
+
+    return outcomes
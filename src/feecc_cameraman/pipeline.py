@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+import typing as tp
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+
+from .camera import Recording
+from .output import FFMPEG_PROGRAM
+from .resources import RESOURCES
+from .storage import STORAGE
+from .store import RECORDS
+
+POSTPROCESSING_STAGES: tp.List[str] = [
+    stage.strip() for stage in os.getenv("POSTPROCESSING_STAGES", "checksum").split(",") if stage.strip()
+]
+POSTPROCESSING_WORKERS: int = int(os.getenv("POSTPROCESSING_WORKERS", 2))
+POSTPROCESSING_QUEUE_SIZE: int = int(os.getenv("POSTPROCESSING_QUEUE_SIZE", 100))
+CHECKSUM_ALGORITHM: str = os.getenv("CHECKSUM_ALGORITHM", "sha256")
+THUMBNAILS_DIR: str = os.getenv("THUMBNAILS_DIR", "output/thumbnails")
+THUMBNAIL_WIDTH: int = int(os.getenv("THUMBNAIL_WIDTH", 320))
+UPLOAD_SINK: str = os.getenv("UPLOAD_SINK", "")
+UPLOAD_TIMEOUT_SEC: float = float(os.getenv("UPLOAD_TIMEOUT_SEC", 60))
+READ_CHUNK_SIZE: int = 1024 * 1024
+UPLOAD_QUEUE_CHUNKS: int = 8
+
+
+class Stage(ABC):
+    """a post-processing step of a finished recording"""
+
+    name: tp.ClassVar[str]
+
+    def __init__(self, record: Recording) -> None:
+        self.record = record
+
+
+class StreamingStage(Stage):
+    """a stage consuming the video file chunk by chunk in the single read pass shared by all streaming stages"""
+
+    @abstractmethod
+    def feed(self, chunk: bytes) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish(self) -> tp.Dict[str, tp.Any]:
+        """called after the last chunk, returns the results of the stage"""
+        raise NotImplementedError
+
+    def abort(self) -> None:
+        """called instead of finish if the read pass or the stage has failed"""
+
+
+class FileStage(Stage):
+    """a stage processing the video file on its own, e.g. with an external program"""
+
+    @abstractmethod
+    async def run(self) -> tp.Dict[str, tp.Any]:
+        raise NotImplementedError
+
+
+STAGES: tp.Dict[str, tp.Type[Stage]] = {}
+_StageType = tp.TypeVar("_StageType", bound=tp.Type[Stage])
+
+
+def register_stage(stage: _StageType) -> _StageType:
+    """make a stage selectable through POSTPROCESSING_STAGES"""
+    STAGES[stage.name] = stage
+    return stage
+
+
+@register_stage
+class ChecksumStage(StreamingStage):
+    name = "checksum"
+
+    def __init__(self, record: Recording) -> None:
+        super().__init__(record)
+        self._hash = hashlib.new(CHECKSUM_ALGORITHM)
+
+    def feed(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+
+    def finish(self) -> tp.Dict[str, tp.Any]:
+        return {"algorithm": self._hash.name, "digest": self._hash.hexdigest()}
+
+
+class _QueueReader:
+    """a file-like request body handing over chunks of the read pass to the uploading thread"""
+
+    def __init__(self, size: int) -> None:
+        self._size = size
+        self._chunks: queue.Queue[bytes] = queue.Queue(UPLOAD_QUEUE_CHUNKS)
+        self._buffer = b""
+        self._closed = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> tp.Iterator[bytes]:
+        while chunk := self.read():
+            yield chunk
+
+    def put(self, chunk: bytes, is_alive: tp.Callable[[], bool]) -> None:
+        while is_alive():
+            try:
+                self._chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size: int = -1) -> bytes:
+        if self._closed:
+            return b""
+
+        if not self._buffer:
+            self._buffer = self._chunks.get()
+            self._closed = not self._buffer
+
+        if size < 0:
+            size = len(self._buffer)
+
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+@register_stage
+class UploadStage(StreamingStage):
+    """
+    Copies the video file into UPLOAD_SINK: a local directory (file:///path) or an S3-compatible
+    bucket URL accepting unsigned PUT requests (http://host:port/bucket). HTTP uploads are streamed
+    with a known content length, so the file is never loaded into memory.
+    """
+
+    name = "upload"
+
+    def __init__(self, record: Recording) -> None:
+        super().__init__(record)
+        sink = urlparse(UPLOAD_SINK)
+        basename = os.path.basename(str(record.filename))
+        self._size = 0
+
+        if sink.scheme == "file":
+            os.makedirs(sink.path, exist_ok=True)
+            self._destination = os.path.join(sink.path, basename)
+            self._file: tp.Optional[tp.BinaryIO] = open(self._destination + ".part", "wb")
+        elif sink.scheme in ("http", "https"):
+            self._destination = f"{UPLOAD_SINK.rstrip('/')}/{basename}"
+            self._file = None
+            self._body = _QueueReader(os.path.getsize(str(record.filename)))
+            self._error: tp.Optional[Exception] = None
+            self._thread = threading.Thread(target=self._upload, daemon=True)
+            self._thread.start()
+        else:
+            raise ValueError(f"Unsupported upload sink '{UPLOAD_SINK}'")
+
+    def _upload(self) -> None:
+        try:
+            body = tp.cast(tp.IO[bytes], self._body)  # a file-like body requests streams by reading it
+            response = requests.put(self._destination, data=body, timeout=UPLOAD_TIMEOUT_SEC)
+            response.raise_for_status()
+        except Exception as e:
+            self._error = e
+
+    def feed(self, chunk: bytes) -> None:
+        self._size += len(chunk)
+
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+
+        self._body.put(chunk, is_alive=self._thread.is_alive)
+
+        if self._error is not None:
+            raise self._error
+
+    def finish(self) -> tp.Dict[str, tp.Any]:
+        if self._file is not None:
+            self._file.close()
+            os.replace(self._destination + ".part", self._destination)
+        else:
+            self._body.put(b"", is_alive=self._thread.is_alive)
+            self._thread.join()
+
+            if self._error is not None:
+                raise self._error
+
+        return {"url": self._destination, "size": self._size}
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._destination + ".part")
+        else:
+            self._body.put(b"", is_alive=self._thread.is_alive)
+
+
+@register_stage
+class ThumbnailStage(FileStage):
+    name = "thumbnail"
+
+    async def run(self) -> tp.Dict[str, tp.Any]:
+        os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+        thumbnail = os.path.join(THUMBNAILS_DIR, f"{self.record.record_id}.jpg")
+        position = min(1.0, float(self.record.metadata.get("duration") or 0) / 2)
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_PROGRAM, "-loglevel", "error", "-ss", str(position), "-i", str(self.record.filename),
+            "-frames:v", "1", "-vf", f"scale={THUMBNAIL_WIDTH}:-2", "-y", thumbnail,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )  # fmt: skip
+        _, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.decode(errors='replace')}")
+
+        return {"path": thumbnail}
+
+
+class PostProcessor:
+    """
+    Runs the configured stages for every finished recording in a bounded pool of workers.
+    Submitting waits while the queue is full. Pipeline state and stage results are kept
+    in the 'postprocessing' entry of the record metadata.
+    """
+
+    def __init__(
+        self,
+        stages: tp.List[str] = POSTPROCESSING_STAGES,
+        workers: int = POSTPROCESSING_WORKERS,
+        queue_size: int = POSTPROCESSING_QUEUE_SIZE,
+    ) -> None:
+        unknown = set(stages) - set(STAGES)
+
+        if unknown:
+            raise ValueError(f"Unknown post-processing stages: {', '.join(sorted(unknown))}")
+
+        if "upload" in stages and not UPLOAD_SINK:
+            raise ValueError("UPLOAD_SINK is required by the upload stage")
+
+        self.stages = [STAGES[name] for name in stages]
+        self._workers_count = workers
+        self._queue: tp.Optional[asyncio.Queue[Recording]] = None
+        self._queue_size = queue_size
+        self._workers: tp.List[asyncio.Task[None]] = []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="postprocessing")
+
+    def start(self) -> None:
+        if not self.stages:
+            return
+
+        self._queue = asyncio.Queue(self._queue_size)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self._workers_count)]
+        asyncio.create_task(self._resume())
+        logger.info(f"Started {self._workers_count} post-processing workers: {[s.name for s in self.stages]}")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _resume(self) -> None:
+        """requeue recordings whose processing was interrupted by a restart"""
+        for record in await RECORDS.query_by_metadata("$.postprocessing.state", ["queued", "running"]):
+            await self.submit(record)
+
+    async def submit(self, record: Recording) -> None:
+        """queue a finished recording for processing"""
+        if self._queue is None:
+            return
+
+        STORAGE.hold(record.record_id)
+        await self._set_state(record, "queued", stages={})
+        await self._queue.put(record)
+
+    async def _set_state(self, record: Recording, state: str, **details: tp.Any) -> None:
+        record.metadata["postprocessing"] = {**record.metadata.get("postprocessing", {}), "state": state, **details}
+        await RECORDS.update(record)
+
+    async def _work(self) -> None:
+        assert self._queue is not None
+
+        while True:
+            record = await self._queue.get()
+
+            file_stages = sum(issubclass(stage, FileStage) for stage in self.stages)
+
+            try:
+                async with RESOURCES.background_job(f"postprocessing:{record.record_id}", 1, processes=file_stages):
+                    await self.process(record)
+            except Exception as e:
+                logger.error(f"Post-processing of record {record.record_id} failed: {e}")
+            finally:
+                STORAGE.release(record.record_id)
+                self._queue.task_done()
+
+    async def process(self, record: Recording) -> None:
+        """run all the stages for a recording, streaming ones sharing a single read of the file"""
+        if record.error is not None or not os.path.exists(str(record.filename)):
+            await self._set_state(record, "skipped")
+            return
+
+        await self._set_state(record, "running")
+        started_at = time.monotonic()
+        results: tp.Dict[str, tp.Dict[str, tp.Any]] = {}
+        file_stages = [stage(record) for stage in self.stages if issubclass(stage, FileStage)]
+        streaming_stages: tp.List[tp.Type[StreamingStage]] = [
+            stage for stage in self.stages if issubclass(stage, StreamingStage)
+        ]
+        loop = asyncio.get_running_loop()
+
+        async def run_file_stage(stage: FileStage) -> None:
+            try:
+                results[stage.name] = await stage.run()
+            except Exception as e:
+                results[stage.name] = {"error": str(e)}
+
+        await asyncio.gather(
+            loop.run_in_executor(self._executor, self._read_pass, record, streaming_stages, results),
+            *(run_file_stage(stage) for stage in file_stages),
+        )
+
+        failed = any("error" in result for result in results.values())
+        await self._set_state(record, "failed" if failed else "done", stages=results)
+        logger.info(f"Post-processed record {record.record_id} in {time.monotonic() - started_at:.1f}s: {results}")
+
+    @staticmethod
+    def _read_pass(
+        record: Recording,
+        stage_types: tp.List[tp.Type[StreamingStage]],
+        results: tp.Dict[str, tp.Dict[str, tp.Any]],
+    ) -> None:
+        """read the file once, feeding every chunk to all streaming stages. a failing stage is dropped from the pass"""
+        stages: tp.List[StreamingStage] = []
+
+        for stage_type in stage_types:
+            try:
+                stages.append(stage_type(record))
+            except Exception as e:
+                results[stage_type.name] = {"error": str(e)}
+
+        def fail(stage: StreamingStage, error: Exception) -> None:
+            results[stage.name] = {"error": str(error)}
+            stages.remove(stage)
+
+            try:
+                stage.abort()
+            except Exception as e:
+                logger.debug(f"Failed to abort {stage.name} stage of record {record.record_id}: {e}")
+
+        try:
+            with open(str(record.filename), "rb") as f:
+                while stages and (chunk := f.read(READ_CHUNK_SIZE)):
+                    for stage in list(stages):
+                        try:
+                            stage.feed(chunk)
+                        except Exception as e:
+                            fail(stage, e)
+        except OSError as e:
+            for stage in list(stages):
+                fail(stage, e)
+
+        for stage in stages:
+            try:
+                results[stage.name] = stage.finish()
+            except Exception as e:
+                results[stage.name] = {"error": str(e)}
+
+
+POSTPROCESSOR = PostProcessor()
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import typing as tp
+from dataclasses import dataclass
+
+from loguru import logger
+
+from .output import FFMPEG_PROGRAM
+
+ALWAYS_ON_CAMERAS: tp.List[int] = json.loads(os.getenv("ALWAYS_ON_CAMERAS", "[]"))
+PREROLL_SEC: float = float(os.getenv("PREROLL_SEC", 5))
+SEGMENT_DURATION_SEC: int = int(os.getenv("SEGMENT_DURATION_SEC", 2))
+SEGMENT_RING_MAX_COUNT: int = int(os.getenv("SEGMENT_RING_MAX_COUNT", 300))
+SEGMENT_RING_MAX_BYTES: int = int(os.getenv("SEGMENT_RING_MAX_BYTES", 2 * 1024**3))
+SEGMENTS_DIR: str = "output/segments"
+RING_RESTART_BACKOFF_SEC: float = 1
+RING_RESTART_BACKOFF_MAX_SEC: float = 30
+RING_QUIT_TIMEOUT_SEC: float = 10
+RING_TERMINATE_TIMEOUT_SEC: float = 5
+
+
+@dataclass
+class Segment:
+    """a single closed or currently written segment file"""
+
+    number: int  # sequence number the file is named after
+    path: str
+    start: float  # unix timestamp of the segment creation
+    size: int
+
+
+class SegmentRing:
+    """
+    Keeps an always-on ffmpeg process writing a camera stream into a rolling ring of short stream copy segments.
+    Recordings only mark their start and end time and get stitched from the segments when they stop.
+    """
+
+    def __init__(self, camera_number: int, rtsp_stream_link: str, dir_: str = SEGMENTS_DIR) -> None:
+        self.camera_number = camera_number
+        self.rtsp_stream_link = rtsp_stream_link
+        self.dir = os.path.abspath(f"{dir_}/{camera_number}")
+        self.segments: tp.List[Segment] = []
+        self._pins: tp.Dict[str, float] = {}
+        self._process: tp.Optional[asyncio.subprocess.Process] = None
+        self._task: tp.Optional[asyncio.Task[None]] = None
+        self._overflowing: bool = False
+        self._next_number: int = 0  # sequence number the next ffmpeg process starts with
+        self._starts: tp.Dict[int, float] = {}  # segment number: unix timestamp of the segment creation
+
+    def __str__(self) -> str:
+        return f"Segment ring of camera no.{self.camera_number}"
+
+    @property
+    def is_running(self) -> bool:
+        alive = self._task is not None and not self._task.done()
+        return alive and self._process is not None and self._process.returncode is None
+
+    @property
+    def is_pinned(self) -> bool:
+        """whether some ongoing recordings use the ring"""
+        return bool(self._pins)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    def _ffmpeg_args(self) -> tp.List[str]:
+        return [
+            "-loglevel", "warning", "-rtsp_transport", "tcp", "-i", self.rtsp_stream_link,
+            "-c", "copy", "-map", "0",
+            "-f", "segment", "-segment_time", str(SEGMENT_DURATION_SEC), "-segment_format", "mpegts",
+            "-reset_timestamps", "1", "-segment_start_number", str(self._next_number), f"{self.dir}/%09d.ts",
+        ]  # fmt: skip
+
+    async def start(self) -> None:
+        """start maintaining the ring in the background"""
+        await asyncio.to_thread(shutil.rmtree, self.dir, True)
+        await asyncio.to_thread(os.makedirs, self.dir, exist_ok=True)
+        self._next_number = 0
+        self._starts = {}
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"{self} started in {self.dir}")
+
+    async def stop(self) -> None:
+        """stop the ring ffmpeg process and the housekeeping task"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self._process is not None and self._process.returncode is None:
+            await self._quit(self._process)
+
+        self._process = None
+        logger.info(f"{self} stopped")
+
+    async def _quit(self, process: asyncio.subprocess.Process) -> None:
+        """let ffmpeg close the last segment, or terminate it if it does not react"""
+        try:
+            await asyncio.wait_for(process.communicate(input=b"q"), RING_QUIT_TIMEOUT_SEC)
+            return
+        except asyncio.TimeoutError:
+            logger.warning(f"{self} ffmpeg did not quit in {RING_QUIT_TIMEOUT_SEC}s. Terminating it.")
+
+        process.terminate()
+
+        try:
+            await asyncio.wait_for(process.wait(), RING_TERMINATE_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    async def _run(self) -> None:
+        """spawn ffmpeg, restart it with a backoff if it dies and evict old segments"""
+        backoff = RING_RESTART_BACKOFF_SEC
+        spawned_at = 0.0
+
+        while True:
+            if self._process is None or self._process.returncode is not None:
+                if self._process is not None:
+                    if time.monotonic() - spawned_at > RING_RESTART_BACKOFF_MAX_SEC:
+                        backoff = RING_RESTART_BACKOFF_SEC  # the process ran long enough to start over
+
+                    logger.error(
+                        f"{self} ffmpeg process exited with code {self._process.returncode}. "
+                        f"Restarting in {backoff:.0f}s."
+                    )
+                    self._process = None
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, RING_RESTART_BACKOFF_MAX_SEC)
+
+                try:
+                    # a new process numbers its segments from 0, so it carries on after the last one left
+                    self.segments = await asyncio.to_thread(self._scan)
+                    self._next_number = max([self._next_number, *(segment.number + 1 for segment in self.segments)])
+                    self._starts[self._next_number] = time.time()
+                    self._process = await asyncio.create_subprocess_exec(
+                        FFMPEG_PROGRAM,
+                        *self._ffmpeg_args(),
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.DEVNULL,
+                    )
+                    spawned_at = time.monotonic()
+                    logger.debug(f"{self} spawned ffmpeg. {self._process.pid=}")
+                except Exception as e:
+                    logger.error(f"{self} failed to spawn ffmpeg: {e}. Retrying in {backoff:.0f}s.")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, RING_RESTART_BACKOFF_MAX_SEC)
+                    continue
+
+            try:
+                self.segments = await asyncio.to_thread(self._scan)
+                await asyncio.to_thread(_remove_files, self._evict())
+            except Exception as e:
+                logger.error(f"{self} failed to evict old segments: {e}")
+
+            await asyncio.sleep(SEGMENT_DURATION_SEC / 2)
+
+    def _scan(self) -> tp.List[Segment]:
+        """
+        list the segment files. ffmpeg closes a segment right before it starts the next one, so a segment
+        starts when its predecessor was last modified, and the first one of a process when it was spawned
+        """
+        entries = {}
+
+        for entry in os.scandir(self.dir):
+            name, ext = os.path.splitext(entry.name)
+
+            if ext == ".ts" and name.isdigit():
+                entries[int(name)] = entry
+
+        segments = []
+
+        for number, entry in sorted(entries.items()):
+            if number not in self._starts:
+                previous = entries.get(number - 1)
+                self._starts[number] = (previous or entry).stat().st_mtime
+
+            segments.append(Segment(number, entry.path, self._starts[number], entry.stat().st_size))
+
+        newest = max(entries, default=-1)
+
+        for number in [number for number in self._starts if number < newest and number not in entries]:
+            del self._starts[number]  # evicted
+
+        return segments
+
+    def _evict(self) -> tp.List[str]:
+        """drop the oldest segments exceeding ring bounds unless some ongoing recording still needs them"""
+        keep_since = min(self._pins.values(), default=time.time()) - PREROLL_SEC
+        total_bytes = self.total_bytes
+        evicted: tp.List[str] = []
+
+        # the last segment is being written, so it is never evicted
+        while len(self.segments) > 1 and (
+            len(self.segments) > SEGMENT_RING_MAX_COUNT or total_bytes > SEGMENT_RING_MAX_BYTES
+        ):
+            oldest, following = self.segments[0], self.segments[1]
+
+            if following.start > keep_since:
+                if not self._overflowing:
+                    logger.warning(f"{self} exceeds its bounds but the segments are used by ongoing recordings")
+                    self._overflowing = True
+
+                return evicted
+
+            evicted.append(oldest.path)
+            total_bytes -= oldest.size
+            self.segments.pop(0)
+
+        self._overflowing = False
+        return evicted
+
+    def pin(self, record_id: str, start: float) -> None:
+        """protect segments of an ongoing recording from eviction"""
+        self._pins[record_id] = start
+
+    def unpin(self, record_id: str) -> None:
+        self._pins.pop(record_id, None)
+
+    async def export(self, start: float, end: float, filename: str) -> None:
+        """stitch the segments covering the time span plus the pre-roll into a file without re-encoding"""
+        deadline = time.monotonic() + SEGMENT_DURATION_SEC * 3
+
+        # the segment holding the end of the recording is complete once the next one appears
+        while not any(segment.start > end for segment in self.segments) and time.monotonic() < deadline:
+            await asyncio.sleep(SEGMENT_DURATION_SEC / 4)
+            self.segments = await asyncio.to_thread(self._scan)
+
+        covering = [
+            segment
+            for segment, following in zip(self.segments, [*self.segments[1:], None])
+            if segment.start <= end and (following is None or following.start > start - PREROLL_SEC)
+        ]
+
+        if not covering:
+            raise ValueError(f"{self} holds no segments for the requested time span")
+
+        list_file = f"{filename}.txt"
+        await asyncio.to_thread(_write_concat_list, list_file, [segment.path for segment in covering])
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_PROGRAM, "-loglevel", "warning", "-f", "concat", "-safe", "0", "-i", list_file,
+                "-c", "copy", "-map", "0", "-bsf:a", "aac_adtstoasc", "-y", filename,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )  # fmt: skip
+            _, stderr = await process.communicate()
+        finally:
+            await asyncio.to_thread(os.remove, list_file)
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to stitch {len(covering)} segments into '{filename}': {stderr.decode()}")
+
+        logger.info(f"{self} exported {len(covering)} segments into '{filename}'")
+
+
+def _remove_files(paths: tp.List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_concat_list(path: str, files: tp.List[str]) -> None:
+    with open(path, "w") as f:
+        f.writelines(f"file '{file}'\n" for file in files)
+
+
+RINGS: tp.Dict[int, SegmentRing] = {}
+
+
+async def stop_segment_rings() -> None:
+    for ring in RINGS.values():
+        await ring.stop()
+
+    RINGS.clear()
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import typing as tp
+from collections import deque
+from dataclasses import dataclass
+
+from loguru import logger
+
+FFMPEG_LOG_BUFFER_LINES: int = int(os.getenv("FFMPEG_LOG_BUFFER_LINES", 200))
+PROGRESS_ARGS: tp.List[str] = ["-progress", "pipe:1", "-nostats"]
+
+
+@dataclass
+class Progress:
+    """live metrics of an ffmpeg process parsed from its -progress output"""
+
+    frame: int = 0
+    fps: tp.Optional[float] = None
+    bitrate_kbps: tp.Optional[float] = None
+    total_size: int = 0
+    out_time_sec: float = 0.0
+    speed: tp.Optional[float] = None
+    dup_frames: int = 0
+    drop_frames: int = 0
+    last_frame_at: tp.Optional[float] = None  # time.monotonic() of the last output progress
+
+    @property
+    def seconds_since_last_frame(self) -> tp.Optional[float]:
+        if self.last_frame_at is None:
+            return None
+
+        return time.monotonic() - self.last_frame_at
+
+    def update(self, key: str, value: str) -> None:
+        """apply a single key=value progress line"""
+        value = value.strip()
+
+        if value in ("N/A", ""):
+            return
+
+        if key == "frame" and int(value) > self.frame:
+            self.frame = int(value)
+            self.last_frame_at = time.monotonic()
+        elif key == "fps":
+            self.fps = float(value)
+        elif key == "bitrate":
+            self.bitrate_kbps = float(value.removesuffix("kbits/s"))
+        elif key == "total_size":
+            self.total_size = int(value)
+        elif key == "out_time_us" and int(value) / 1e6 > self.out_time_sec:
+            self.out_time_sec = int(value) / 1e6
+            self.last_frame_at = time.monotonic()
+        elif key == "speed":
+            self.speed = float(value.removesuffix("x"))
+        elif key == "dup_frames":
+            self.dup_frames = int(value)
+        elif key == "drop_frames":
+            self.drop_frames = int(value)
+
+
+class FfmpegMonitor:
+    """
+    Continuously drains stdout and stderr of an ffmpeg process so that it never stalls on a full pipe.
+    stdout is expected to carry -progress output, stderr lines are kept in a bounded ring buffer.
+    """
+
+    def __init__(
+        self,
+        process: asyncio.subprocess.Process,
+        name: str,
+        on_first_frame: tp.Optional[tp.Callable[[float], None]] = None,
+    ) -> None:
+        self.name = name
+        self.progress = Progress()
+        self._started_at = time.monotonic()
+        self._on_first_frame = on_first_frame
+        self.log: tp.Deque[str] = deque(maxlen=FFMPEG_LOG_BUFFER_LINES)
+        self._readers = [
+            asyncio.create_task(self._read(process.stdout, self._on_progress_line)),
+            asyncio.create_task(self._read(process.stderr, self._on_log_line)),
+        ]
+
+    async def wait_closed(self) -> None:
+        """wait for both streams to reach EOF"""
+        await asyncio.gather(*self._readers)
+
+    @property
+    def tail(self) -> str:
+        return "\n".join(self.log)
+
+    @staticmethod
+    async def _read(stream: tp.Optional[asyncio.StreamReader], callback: tp.Callable[[str], None]) -> None:
+        if stream is None:
+            return
+
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError as e:
+                # the reader drops a line exceeding its limit, so carry on draining past it
+                logger.debug(f"Skipped an overlong ffmpeg output line: {e}")
+                continue
+
+            if not line:
+                return
+
+            callback(line.decode(errors="replace").rstrip())
+
+    def _on_progress_line(self, line: str) -> None:
+        key, sep, value = line.partition("=")
+
+        if not sep:
+            return
+
+        had_frames = self.progress.last_frame_at is not None
+
+        try:
+            self.progress.update(key, value)
+        except ValueError:
+            logger.debug(f"Unexpected ffmpeg progress line for {self.name}: {line}")
+
+        if not had_frames and self.progress.last_frame_at is not None and self._on_first_frame is not None:
+            # -progress is reported periodically, so the latency is accurate up to its period
+            latency = self.progress.last_frame_at - self._started_at
+            logger.debug(f"ffmpeg of {self.name} output its first frame in {latency:.2f}s")
+            self._on_first_frame(latency)
+
+    def _on_log_line(self, line: str) -> None:
+        self.log.append(line)
+        logger.debug(f"ffmpeg of {self.name}: {line}")
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import typing as tp
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from .camera import CAMERAS, CAMERAS_CONFIG_FILE, parse_cameras_config, read_cameras_config
+from .health import HEALTH, probe_cameras
+from .preroll import ALWAYS_ON_CAMERAS, RINGS, SegmentRing
+from .state import CLUSTER
+
+CAMERAS_CONFIG_RELOAD_INTERVAL_SEC: float = float(os.getenv("CAMERAS_CONFIG_RELOAD_INTERVAL_SEC", 5))
+
+
+@dataclass
+class CamerasDiff:
+    """camera numbers affected by a config reload"""
+
+    added: tp.List[int] = field(default_factory=list)
+    removed: tp.List[int] = field(default_factory=list)
+    changed: tp.List[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+async def apply_cameras_config(config: tp.List[str]) -> CamerasDiff:
+    """
+    Replace the camera set with the one described by the config. Only added, removed and changed cameras
+    are touched: recordings keep running, including the ones on removed or changed cameras.
+    """
+    cameras = parse_cameras_config(config)
+    diff = CamerasDiff(
+        added=[number for number in cameras if number not in CAMERAS],
+        removed=[number for number in CAMERAS if number not in cameras],
+        changed=[number for number in cameras if number in CAMERAS and cameras[number] != CAMERAS[number]],
+    )
+
+    for number in diff.removed:
+        del CAMERAS[number]
+
+    for number in diff.removed + diff.changed + diff.added:
+        HEALTH.pop(number, None)
+
+    for number in diff.added + diff.changed:
+        CAMERAS[number] = cameras[number]
+
+    if diff:
+        logger.info(f"Camera config reloaded: {diff}")
+        await sync_segment_rings()
+        asyncio.create_task(probe_cameras([cameras[number] for number in diff.added + diff.changed]))
+
+    return diff
+
+
+async def reload_cameras(config: tp.Optional[tp.List[str]] = None) -> CamerasDiff:
+    """apply the given config, saving it into CAMERAS_CONFIG_FILE if it is set, or reread the config source"""
+    if config is None:
+        return await apply_cameras_config(await asyncio.to_thread(read_cameras_config))
+
+    parse_cameras_config(config)  # validate before saving
+
+    if CAMERAS_CONFIG_FILE:
+        await asyncio.to_thread(_write_config_file, config)
+
+    return await apply_cameras_config(config)
+
+
+def _write_config_file(config: tp.List[str]) -> None:
+    temporary = f"{CAMERAS_CONFIG_FILE}.tmp"
+
+    with open(temporary, "w") as f:
+        json.dump(config, f, indent=4)
+
+    os.replace(temporary, CAMERAS_CONFIG_FILE)
+
+
+async def sync_segment_rings() -> None:
+    """
+    Start segment rings for always-on cameras owned by this worker and stop the rings of removed or changed cameras.
+    A ring used by ongoing recordings is kept until they are over.
+    """
+    for number, ring in list(RINGS.items()):
+        camera = CAMERAS.get(number)
+
+        if camera is not None and number in ALWAYS_ON_CAMERAS and camera.rtsp_stream_link == ring.rtsp_stream_link:
+            continue
+
+        if ring.is_pinned:
+            continue
+
+        await ring.stop()
+        del RINGS[number]
+
+    for camera in list(CAMERAS.values()):
+        if camera.number in ALWAYS_ON_CAMERAS and camera.number not in RINGS:
+            if await CLUSTER.acquire_camera(camera.number) is None:
+                RINGS[camera.number] = SegmentRing(camera.number, camera.rtsp_stream_link)
+                await RINGS[camera.number].start()
+
+
+async def watch_cameras_config(interval: float = CAMERAS_CONFIG_RELOAD_INTERVAL_SEC) -> None:
+    """reload the cameras when CAMERAS_CONFIG_FILE changes and finish deferred segment ring changes"""
+    last_modified = os.path.getmtime(CAMERAS_CONFIG_FILE) if CAMERAS_CONFIG_FILE else None
+
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            if CAMERAS_CONFIG_FILE:
+                modified = await asyncio.to_thread(os.path.getmtime, CAMERAS_CONFIG_FILE)
+
+                if modified != last_modified:
+                    last_modified = modified
+                    await reload_cameras()
+
+            await sync_segment_rings()
+        except Exception as e:
+            logger.error(f"Failed to reload camera config: {e}")
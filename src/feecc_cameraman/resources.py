@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+import typing as tp
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from fastapi import status
+from loguru import logger
+
+from .metrics import ADMISSIONS_REFUSED
+from .storage import STORAGE
+
+HOST_CPU_BUDGET: float = float(os.getenv("HOST_CPU_BUDGET", os.cpu_count() or 1))  # cores
+MAX_FFMPEG_PROCESSES: int = int(os.getenv("MAX_FFMPEG_PROCESSES", 0))  # 0 for no limit
+WRITE_BANDWIDTH_BUDGET_KBPS: float = float(os.getenv("WRITE_BANDWIDTH_BUDGET_KBPS", 0))  # 0 for no limit
+CAPTURE_CPU_COST: float = float(os.getenv("CAPTURE_CPU_COST", 0.1))  # cores taken by a recording ffmpeg
+MAX_CONCURRENT_STARTS: int = int(os.getenv("MAX_CONCURRENT_STARTS", 4))
+START_QUEUE_SIZE: int = int(os.getenv("START_QUEUE_SIZE", 32))
+CAPACITY_RETRY_AFTER_SEC: int = int(os.getenv("CAPACITY_RETRY_AFTER_SEC", 30))
+START_TIME_SMOOTHING: float = 0.3
+
+
+@dataclass(frozen=True)
+class Claim:
+    """host resources taken by a running ffmpeg process or a background job"""
+
+    cpu: float = 0.0  # cores
+    processes: int = 0
+    write_kbps: float = 0.0
+
+    def __add__(self, other: Claim) -> Claim:
+        return Claim(self.cpu + other.cpu, self.processes + other.processes, self.write_kbps + other.write_kbps)
+
+
+class CapacityError(Exception):
+    """the host has no capacity for a new recording right now. retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ResourceScheduler:
+    """
+    Accounts the recordings running on the host and the background jobs, i.e. transcoding and post-processing,
+    against the CPU, ffmpeg process and disk write bandwidth budgets. Recordings always take priority:
+    they are admitted as long as the recordings alone fit the budgets, while background jobs wait until
+    everything fits and no recording is being started. Starts beyond the budgets are refused with 503,
+    and bursts of starts beyond MAX_CONCURRENT_STARTS are queued, or refused with 429 once the queue is full.
+    """
+
+    def __init__(
+        self,
+        cpu: float = HOST_CPU_BUDGET,
+        processes: int = MAX_FFMPEG_PROCESSES,
+        write_kbps: float = WRITE_BANDWIDTH_BUDGET_KBPS,
+        concurrent_starts: int = MAX_CONCURRENT_STARTS,
+        start_queue_size: int = START_QUEUE_SIZE,
+    ) -> None:
+        self.budget = Claim(cpu, processes, write_kbps)
+        self.captures: tp.Dict[str, Claim] = {}  # record id: claim
+        self.background: tp.Dict[str, Claim] = {}  # job key: claim
+        self._concurrent_starts = concurrent_starts
+        self._start_queue_size = start_queue_size
+        self._start_slots: tp.Optional[asyncio.Semaphore] = None
+        self._starting = 0  # starts holding a slot or waiting for it
+        self._start_seconds = 1.0  # smoothed time a start holds its slot
+        self._waiters: tp.List[asyncio.Future[None]] = []
+
+    @staticmethod
+    def _sum(claims: tp.Iterable[Claim]) -> Claim:
+        return sum(claims, Claim())
+
+    @property
+    def capture_usage(self) -> Claim:
+        return self._sum(self.captures.values())
+
+    @property
+    def background_usage(self) -> Claim:
+        return self._sum(self.background.values())
+
+    @property
+    def usage(self) -> Claim:
+        return self.capture_usage + self.background_usage
+
+    def _exceeded(self, usage: Claim) -> tp.List[str]:
+        """names of the budgets the usage does not fit into"""
+        exceeded = []
+
+        if usage.cpu > self.budget.cpu:
+            exceeded.append("cpu")
+
+        if self.budget.processes and usage.processes > self.budget.processes:
+            exceeded.append("processes")
+
+        if self.budget.write_kbps and usage.write_kbps > self.budget.write_kbps:
+            exceeded.append("write bandwidth")
+
+        return exceeded
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+        self._waiters = []
+
+    async def _changed(self) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        await waiter
+
+    def reserve_capture(self, record_id: str, camera_number: int) -> None:
+        """account a recording about to be started. raises CapacityError if the recordings would exceed the budgets"""
+        claim = Claim(CAPTURE_CPU_COST, 1, STORAGE.get_bitrate(camera_number))
+        exceeded = self._exceeded(self.capture_usage + claim)
+
+        if exceeded:
+            ADMISSIONS_REFUSED.inc(reason="capacity")
+            raise CapacityError(
+                f"Host {' and '.join(exceeded)} budget is taken by {len(self.captures)} recordings",
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                CAPACITY_RETRY_AFTER_SEC,
+            )
+
+        self.captures[record_id] = claim
+
+    def release_capture(self, record_id: str) -> None:
+        if self.captures.pop(record_id, None) is not None:
+            self._wake()
+
+    @asynccontextmanager
+    async def start_slot(self) -> tp.AsyncIterator[None]:
+        """wait for a turn to spawn a recording. raises CapacityError if too many starts are already waiting"""
+        if self._start_slots is None:
+            self._start_slots = asyncio.Semaphore(self._concurrent_starts)
+
+        waiting = self._starting - self._concurrent_starts
+
+        if waiting >= self._start_queue_size:
+            ADMISSIONS_REFUSED.inc(reason="start_queue")
+            retry_after = math.ceil((waiting + 1) / self._concurrent_starts * self._start_seconds)
+            raise CapacityError(
+                f"{waiting} recordings are waiting to be started",
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                max(1, retry_after),
+            )
+
+        self._starting += 1
+
+        try:
+            async with self._start_slots:
+                started_at = time.monotonic()
+
+                try:
+                    yield
+                finally:
+                    seconds = time.monotonic() - started_at
+                    self._start_seconds += START_TIME_SMOOTHING * (seconds - self._start_seconds)
+        finally:
+            self._starting -= 1
+            self._wake()
+
+    @asynccontextmanager
+    async def background_job(self, key: str, cpu: float, processes: int = 0) -> tp.AsyncIterator[None]:
+        """
+        hold resources for a background job, waiting until they fit the budgets along with the recordings
+        and no recording is being started. a job exceeding the budgets on its own runs when no other job does
+        """
+        claim = Claim(cpu, processes)
+        waited_since = time.monotonic()
+
+        while self._starting or (self._exceeded(self.usage + claim) and (self.background or not self._exceeded(claim))):
+            await self._changed()
+
+        if time.monotonic() - waited_since > 1:
+            logger.debug(f"Background job {key} waited {time.monotonic() - waited_since:.1f}s for host resources")
+
+        self.background[key] = claim
+
+        try:
+            yield
+        finally:
+            del self.background[key]
+            self._wake()
+
+
+RESOURCES = ResourceScheduler()
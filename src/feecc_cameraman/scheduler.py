@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import os
+import time
+import typing as tp
+from datetime import datetime
+
+from loguru import logger
+
+from .camera import Recording
+
+MAX_RECORD_DURATION_SEC: int = int(os.getenv("MAX_RECORD_DURATION_SEC", 60 * 60))
+CAMERA_MAX_RECORD_DURATIONS: tp.Dict[int, int] = {
+    int(number): int(duration)
+    for number, duration in json.loads(os.getenv("CAMERA_MAX_RECORD_DURATIONS", "{}")).items()
+}
+STUCK_RECORDS_STOP_CONCURRENCY: int = int(os.getenv("STUCK_RECORDS_STOP_CONCURRENCY", 4))
+
+
+class DeadlineScheduler:
+    """
+    Keeps deadlines of ongoing recordings in a heap and fires a callback for every record
+    as soon as its deadline passes. Callbacks run concurrently with a limited parallelism.
+    """
+
+    def __init__(self, concurrency: int = STUCK_RECORDS_STOP_CONCURRENCY) -> None:
+        self._heap: tp.List[tp.Tuple[float, str]] = []
+        self._deadlines: tp.Dict[str, tp.Tuple[float, Recording]] = {}
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def get_max_duration(self, record: Recording, max_duration: tp.Optional[int] = None) -> int:
+        """resolve maximum duration of a record: per request value, then per camera value, then the default one"""
+        if max_duration is not None:
+            return max_duration
+
+        if record.camera_number is not None:
+            return CAMERA_MAX_RECORD_DURATIONS.get(record.camera_number, MAX_RECORD_DURATION_SEC)
+
+        return MAX_RECORD_DURATION_SEC
+
+    def schedule(self, record: Recording, max_duration: tp.Optional[int] = None) -> None:
+        """register a deadline for an ongoing record"""
+        elapsed = (datetime.now() - record.start_time).total_seconds() if record.start_time else 0.0
+        deadline = time.monotonic() + self.get_max_duration(record, max_duration) - elapsed
+        self._deadlines[record.record_id] = (deadline, record)
+        heapq.heappush(self._heap, (deadline, record.record_id))
+        self._wakeup.set()
+
+    def get_deadline(self, record_id: str) -> tp.Optional[float]:
+        """time.monotonic() deadline of an ongoing record, if it is scheduled"""
+        entry = self._deadlines.get(record_id)
+        return entry[0] if entry is not None else None
+
+    def cancel(self, record_id: str) -> None:
+        """drop the deadline of a record. the heap entry is discarded lazily"""
+        if self._deadlines.pop(record_id, None) is None:
+            return
+
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, record_id) for record_id, (deadline, _) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_expired(self) -> tp.List[Recording]:
+        expired = []
+        now = time.monotonic()
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, record_id = heapq.heappop(self._heap)
+            entry = self._deadlines.get(record_id)
+
+            if entry is not None and entry[0] == deadline:
+                del self._deadlines[record_id]
+                expired.append(entry[1])
+
+        return expired
+
+    async def run(self, on_deadline: tp.Callable[[Recording], tp.Awaitable[None]]) -> None:
+        """wait for deadlines and fire the callback for expired records"""
+        while True:
+            self._wakeup.clear()
+
+            for record in self._pop_expired():
+                asyncio.create_task(self._fire(on_deadline, record))
+
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, on_deadline: tp.Callable[[Recording], tp.Awaitable[None]], record: Recording) -> None:
+        async with self._semaphore:
+            try:
+                await on_deadline(record)
+            except Exception as e:
+                logger.error(f"Failed to handle deadline of record {record.record_id}: {e}")
+
+
+DEADLINES = DeadlineScheduler()
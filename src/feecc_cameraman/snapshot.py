@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import time
+import typing as tp
+from dataclasses import dataclass
+
+from loguru import logger
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .output import FFMPEG_PROGRAM
+
+SNAPSHOT_WIDTH: int = int(os.getenv("SNAPSHOT_WIDTH", 640))
+SNAPSHOT_QUALITY: int = int(os.getenv("SNAPSHOT_QUALITY", 5))  # ffmpeg -q:v, 2 (best) to 31 (worst)
+SNAPSHOT_IDLE_TIMEOUT_SEC: float = float(os.getenv("SNAPSHOT_IDLE_TIMEOUT_SEC", 30))
+SNAPSHOT_WAIT_TIMEOUT_SEC: float = float(os.getenv("SNAPSHOT_WAIT_TIMEOUT_SEC", 10))
+SNAPSHOT_MAX_AGE_SEC: int = int(os.getenv("SNAPSHOT_MAX_AGE_SEC", 1))
+SNAPSHOT_MAX_FRAME_BYTES: int = 8 * 1024**2
+SNAPSHOT_RESTART_DELAY_SEC: float = 1
+SNAPSHOT_READ_CHUNK_SIZE: int = 64 * 1024
+_JPEG_END: bytes = b"\xff\xd9"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    jpeg: bytes
+    etag: str
+    captured_at: float  # unix timestamp
+
+
+class SnapshotFeed:
+    """
+    Keeps the most recent keyframe of a camera stream as a JPEG. Only keyframes are decoded, so the decoder
+    costs a fraction of a full one. It runs on demand and is shut down after SNAPSHOT_IDLE_TIMEOUT_SEC
+    without snapshot requests. Only a single frame is kept in memory.
+    """
+
+    def __init__(self, camera_number: int, rtsp_stream_link: str, width: int = SNAPSHOT_WIDTH) -> None:
+        self.camera_number = camera_number
+        self.rtsp_stream_link = rtsp_stream_link
+        self.width = width
+        self.snapshot: tp.Optional[Snapshot] = None
+        self._requested_at: float = 0.0
+        self._waiting: int = 0  # requests waiting for the first frame
+        self._frame_ready = asyncio.Event()
+        self._task: tp.Optional[asyncio.Task[None]] = None
+
+    def __str__(self) -> str:
+        return f"Snapshot feed of camera no.{self.camera_number}"
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def is_idle(self) -> bool:
+        return not self._waiting and time.monotonic() - self._requested_at > SNAPSHOT_IDLE_TIMEOUT_SEC
+
+    def _ffmpeg_args(self) -> tp.List[str]:
+        transport = ["-rtsp_transport", "tcp"] if self.rtsp_stream_link.startswith("rtsp") else []
+        return [
+            "-loglevel", "error", *transport, "-skip_frame", "nokey", "-i", self.rtsp_stream_link,
+            "-map", "0:v:0", "-an", "-vf", f"scale={self.width}:-2",
+            "-c:v", "mjpeg", "-q:v", str(SNAPSHOT_QUALITY), "-f", "image2pipe", "pipe:1",
+        ]  # fmt: skip
+
+    async def get(self, timeout: float = SNAPSHOT_WAIT_TIMEOUT_SEC) -> tp.Optional[Snapshot]:
+        """get the latest snapshot, starting the decoder if needed. None if no frame arrived in time"""
+        self._requested_at = time.monotonic()
+
+        if not self.is_running:
+            self._task = asyncio.create_task(self._run())
+
+        if self.snapshot is None:
+            self._waiting += 1
+
+            try:
+                await asyncio.wait_for(self._frame_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                # the idle clock starts once the request is served, however long the decoder took to start
+                self._waiting -= 1
+                self._requested_at = time.monotonic()
+
+        return self.snapshot
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        """run the decoder until the feed is idle, restarting it if it exits"""
+        logger.debug(f"{self} started")
+
+        try:
+            while not self.is_idle:
+                process = await asyncio.create_subprocess_exec(
+                    FFMPEG_PROGRAM,
+                    *self._ffmpeg_args(),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                )
+
+                try:
+                    await self._read_frames(process)
+                finally:
+                    await _terminate(process)
+
+                if not self.is_idle:
+                    logger.warning(f"{self} decoder exited with code {process.returncode}. Restarting.")
+                    await asyncio.sleep(SNAPSHOT_RESTART_DELAY_SEC)
+        finally:
+            # a stopped feed must not serve its last frame as a current one
+            self.snapshot = None
+            self._frame_ready.clear()
+
+        logger.debug(f"{self} stopped as nobody requests snapshots")
+
+    async def _read_frames(self, process: asyncio.subprocess.Process) -> None:
+        """split the decoder output into JPEG images and keep the last one"""
+        assert process.stdout is not None
+        buffer = bytearray()
+
+        while not self.is_idle:
+            try:
+                chunk = await asyncio.wait_for(
+                    process.stdout.read(SNAPSHOT_READ_CHUNK_SIZE), SNAPSHOT_RESTART_DELAY_SEC
+                )
+            except asyncio.TimeoutError:
+                continue
+
+            if not chunk:
+                return
+
+            buffer += chunk
+            frame = None
+
+            while (end := buffer.find(_JPEG_END)) != -1:
+                frame = bytes(buffer[: end + len(_JPEG_END)])
+                del buffer[: end + len(_JPEG_END)]
+
+            if frame is not None:
+                etag = f'"{hashlib.blake2b(frame, digest_size=8).hexdigest()}"'
+                self.snapshot = Snapshot(frame, etag, time.time())
+                self._frame_ready.set()
+
+            if len(buffer) > SNAPSHOT_MAX_FRAME_BYTES:
+                logger.warning(f"{self} got a frame over {SNAPSHOT_MAX_FRAME_BYTES} bytes. Dropping it.")
+                buffer.clear()
+
+
+async def _terminate(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is None:
+        process.kill()
+
+    await process.wait()
+
+
+FEEDS: tp.Dict[int, SnapshotFeed] = {}
+
+
+def get_feed(camera_number: int, rtsp_stream_link: str) -> SnapshotFeed:
+    """get the snapshot feed of a camera, replacing it if the camera stream has changed"""
+    feed = FEEDS.get(camera_number)
+
+    if feed is None or feed.rtsp_stream_link != rtsp_stream_link:
+        if feed is not None:
+            asyncio.create_task(feed.stop())
+
+        feed = FEEDS[camera_number] = SnapshotFeed(camera_number, rtsp_stream_link)
+
+    return feed
+
+
+async def stop_snapshot_feeds() -> None:
+    await asyncio.gather(*(feed.stop() for feed in FEEDS.values()))
+    FEEDS.clear()
+
+
+def snapshot_response(snapshot: Snapshot, request: Request) -> Response:
+    """respond with a snapshot JPEG honoring If-None-Match"""
+    headers = {"etag": snapshot.etag, "cache-control": f"max-age={SNAPSHOT_MAX_AGE_SEC}"}
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is not None and snapshot.etag in {
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    }:
+        return Response(status_code=304, headers=headers)
+
+    return Response(snapshot.jpeg, media_type="image/jpeg", headers=headers)
@@ -0,0 +1,638 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import typing as tp
+from dataclasses import dataclass
+from datetime import datetime
+from uuid import uuid4
+
+import requests
+import uvicorn
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from pymongo.errors import DuplicateKeyError
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from auth.database import MongoDbWrapper
+from .camera import Recording
+from .tracing import TRACE_HEADER, TRACE_ID
+
+STATE_BACKEND: str = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH: str = os.getenv("STATE_DB_PATH", "output/state.db")
+CAMERA_LEASE_TTL_SEC: float = float(os.getenv("CAMERA_LEASE_TTL_SEC", 15))
+WORKER_HOST: str = os.getenv("WORKER_HOST", "127.0.0.1")
+WORKER_PORT: int = int(os.getenv("WORKER_PORT", 0))
+FORWARDED_HEADER: str = "x-cameraman-forwarded-by"
+PROXY_TIMEOUT_SEC: float = 120
+PROXY_CHUNK_SIZE: int = 64 * 1024
+LISTENER_START_TIMEOUT_SEC: float = 10
+
+_CAMERA_ROUTE = re.compile(r"^/camera/(\d+)/")
+_RECORD_ROUTE = re.compile(r"^/record/([^/]+)")
+_JOB_ROUTE = re.compile(r"^/job/([^/]+)\.[0-9a-f]{32}$")  # job ids are prefixed with the id of their worker
+_RECORD_COLUMNS = "record_id, camera_number, filename, start_time, worker_id, address"
+
+
+@dataclass(frozen=True)
+class Worker:
+    """an instance of the service owning some cameras"""
+
+    worker_id: str
+    address: str  # host:port the worker internal listener is reachable at
+
+
+@dataclass(frozen=True)
+class RecordOwnership:
+    record_id: str
+    camera_number: tp.Optional[int]
+    filename: tp.Optional[str]
+    start_time: float
+    owner: Worker
+
+
+class StateBackend(abc.ABC):
+    """
+    storage shared by all workers: camera leases, ongoing record ownership and the addresses of live workers.
+    record ownership and worker addresses are leases too, renewed by the owner while it is alive,
+    so that a dead worker and its recordings are forgotten once they lapse
+    """
+
+    @abc.abstractmethod
+    async def acquire_camera(self, camera_number: int, worker: Worker, ttl: float) -> Worker:
+        """take or renew a camera lease unless another worker holds a valid one. returns the lease owner"""
+
+    @abc.abstractmethod
+    async def release_camera(self, camera_number: int, worker: Worker) -> None:
+        """release a camera lease held by the worker"""
+
+    @abc.abstractmethod
+    async def register_record(self, ownership: RecordOwnership, ttl: float) -> None:
+        """remember which worker runs an ongoing recording"""
+
+    @abc.abstractmethod
+    async def renew_records(self, worker: Worker, ttl: float) -> None:
+        """extend ownership of all the ongoing recordings of the worker"""
+
+    @abc.abstractmethod
+    async def forget_record(self, record_id: str) -> None:
+        """drop ownership of a finished recording"""
+
+    @abc.abstractmethod
+    async def get_record(self, record_id: str) -> tp.Optional[RecordOwnership]:
+        """get ownership of an ongoing recording unless it has lapsed"""
+
+    @abc.abstractmethod
+    async def get_records(self) -> tp.List[RecordOwnership]:
+        """get all ongoing recordings of all workers. lapsed ownership is dropped"""
+
+    @abc.abstractmethod
+    async def register_worker(self, worker: Worker, ttl: float) -> None:
+        """announce or renew the address of a live worker"""
+
+    @abc.abstractmethod
+    async def get_worker(self, worker_id: str) -> tp.Optional[Worker]:
+        """get a live worker by its id"""
+
+
+class InMemoryStateBackend(StateBackend):
+    """state of a single worker process"""
+
+    def __init__(self) -> None:
+        self._leases: tp.Dict[int, tp.Tuple[Worker, float]] = {}
+        self._records: tp.Dict[str, tp.Tuple[RecordOwnership, float]] = {}  # record id: ownership, expiration time
+        self._workers: tp.Dict[str, tp.Tuple[Worker, float]] = {}  # worker id: worker, expiration time
+
+    async def acquire_camera(self, camera_number: int, worker: Worker, ttl: float) -> Worker:
+        owner, expires_at = self._leases.get(camera_number, (worker, 0.0))
+
+        if owner == worker or expires_at < time.time():
+            self._leases[camera_number] = (worker, time.time() + ttl)
+            return worker
+
+        return owner
+
+    async def release_camera(self, camera_number: int, worker: Worker) -> None:
+        if camera_number in self._leases and self._leases[camera_number][0] == worker:
+            del self._leases[camera_number]
+
+    async def register_record(self, ownership: RecordOwnership, ttl: float) -> None:
+        self._records[ownership.record_id] = (ownership, time.time() + ttl)
+
+    async def renew_records(self, worker: Worker, ttl: float) -> None:
+        for record_id, (ownership, _) in list(self._records.items()):
+            if ownership.owner == worker:
+                self._records[record_id] = (ownership, time.time() + ttl)
+
+    async def forget_record(self, record_id: str) -> None:
+        self._records.pop(record_id, None)
+
+    async def get_record(self, record_id: str) -> tp.Optional[RecordOwnership]:
+        ownership, expires_at = self._records.get(record_id, (None, 0.0))
+        return ownership if expires_at >= time.time() else None
+
+    async def get_records(self) -> tp.List[RecordOwnership]:
+        now = time.time()
+        self._records = {record_id: entry for record_id, entry in self._records.items() if entry[1] >= now}
+        return [ownership for ownership, _ in self._records.values()]
+
+    async def register_worker(self, worker: Worker, ttl: float) -> None:
+        self._workers[worker.worker_id] = (worker, time.time() + ttl)
+
+    async def get_worker(self, worker_id: str) -> tp.Optional[Worker]:
+        worker, expires_at = self._workers.get(worker_id, (None, 0.0))
+        return worker if expires_at >= time.time() else None
+
+
+class SqliteStateBackend(StateBackend):
+    """state shared by worker processes on a single host through a SQLite database file"""
+
+    def __init__(self, db_path: str = STATE_DB_PATH) -> None:
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases (camera_number INTEGER PRIMARY KEY, "
+            "worker_id TEXT, address TEXT, expires_at REAL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS records (record_id TEXT PRIMARY KEY, camera_number INTEGER, "
+            "filename TEXT, start_time REAL, worker_id TEXT, address TEXT, expires_at REAL)"
+        )
+
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, address TEXT, expires_at REAL)"
+        )
+
+        if "expires_at" not in {row[1] for row in self._connection.execute("PRAGMA table_info(records)")}:
+            self._connection.execute("ALTER TABLE records ADD COLUMN expires_at REAL DEFAULT 0")
+
+        self._lock = threading.Lock()
+
+    def _acquire_camera(self, camera_number: int, worker: Worker, ttl: float) -> Worker:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                row = self._connection.execute(
+                    "SELECT worker_id, address, expires_at FROM leases WHERE camera_number = ?", (camera_number,)
+                ).fetchone()
+
+                if row is not None and row[0] != worker.worker_id and row[2] >= time.time():
+                    return Worker(worker_id=row[0], address=row[1])
+
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                    (camera_number, worker.worker_id, worker.address, time.time() + ttl),
+                )
+                return worker
+            finally:
+                self._connection.execute("COMMIT")
+
+    def _execute(self, query: str, parameters: tp.Sequence[tp.Any] = ()) -> tp.List[tp.Tuple[tp.Any, ...]]:
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    async def acquire_camera(self, camera_number: int, worker: Worker, ttl: float) -> Worker:
+        return await asyncio.to_thread(self._acquire_camera, camera_number, worker, ttl)
+
+    async def release_camera(self, camera_number: int, worker: Worker) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM leases WHERE camera_number = ? AND worker_id = ?",
+            (camera_number, worker.worker_id),
+        )
+
+    async def register_record(self, ownership: RecordOwnership, ttl: float) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            f"INSERT OR REPLACE INTO records ({_RECORD_COLUMNS}, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                ownership.record_id,
+                ownership.camera_number,
+                ownership.filename,
+                ownership.start_time,
+                ownership.owner.worker_id,
+                ownership.owner.address,
+                time.time() + ttl,
+            ),
+        )
+
+    async def renew_records(self, worker: Worker, ttl: float) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE records SET expires_at = ? WHERE worker_id = ?",
+            (time.time() + ttl, worker.worker_id),
+        )
+
+    async def forget_record(self, record_id: str) -> None:
+        await asyncio.to_thread(self._execute, "DELETE FROM records WHERE record_id = ?", (record_id,))
+
+    @staticmethod
+    def _to_ownership(row: tp.Tuple[tp.Any, ...]) -> RecordOwnership:
+        return RecordOwnership(
+            record_id=row[0],
+            camera_number=row[1],
+            filename=row[2],
+            start_time=row[3],
+            owner=Worker(worker_id=row[4], address=row[5]),
+        )
+
+    async def get_record(self, record_id: str) -> tp.Optional[RecordOwnership]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT {_RECORD_COLUMNS} FROM records WHERE record_id = ? AND expires_at >= ?",
+            (record_id, time.time()),
+        )
+        return self._to_ownership(rows[0]) if rows else None
+
+    async def get_records(self) -> tp.List[RecordOwnership]:
+        now = time.time()
+        await asyncio.to_thread(self._execute, "DELETE FROM records WHERE expires_at < ?", (now,))
+        rows = await asyncio.to_thread(self._execute, f"SELECT {_RECORD_COLUMNS} FROM records")
+        return [self._to_ownership(row) for row in rows]
+
+    async def register_worker(self, worker: Worker, ttl: float) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO workers VALUES (?, ?, ?)",
+            (worker.worker_id, worker.address, time.time() + ttl),
+        )
+
+    async def get_worker(self, worker_id: str) -> tp.Optional[Worker]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT worker_id, address FROM workers WHERE worker_id = ? AND expires_at >= ?",
+            (worker_id, time.time()),
+        )
+        return Worker(worker_id=rows[0][0], address=rows[0][1]) if rows else None
+
+
+class MongoStateBackend(StateBackend):
+    """state shared by workers on several hosts through the MongoDB used for authentication"""
+
+    def __init__(self) -> None:
+        self._leases = MongoDbWrapper().get_collection("cameramanLeases")
+        self._records = MongoDbWrapper().get_collection("cameramanRecords")
+        self._workers = MongoDbWrapper().get_collection("cameramanWorkers")
+
+    async def acquire_camera(self, camera_number: int, worker: Worker, ttl: float) -> Worker:
+        now = time.time()
+
+        try:
+            await self._leases.find_one_and_update(
+                {"_id": camera_number, "$or": [{"worker_id": worker.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"worker_id": worker.worker_id, "address": worker.address, "expires_at": now + ttl}},
+                upsert=True,
+            )
+            return worker
+        except DuplicateKeyError:
+            lease = await self._leases.find_one({"_id": camera_number})
+            return Worker(worker_id=lease["worker_id"], address=lease["address"]) if lease else worker
+
+    async def release_camera(self, camera_number: int, worker: Worker) -> None:
+        await self._leases.delete_one({"_id": camera_number, "worker_id": worker.worker_id})
+
+    async def register_record(self, ownership: RecordOwnership, ttl: float) -> None:
+        document = {
+            "camera_number": ownership.camera_number,
+            "filename": ownership.filename,
+            "start_time": ownership.start_time,
+            "worker_id": ownership.owner.worker_id,
+            "address": ownership.owner.address,
+            "expires_at": time.time() + ttl,
+        }
+        await self._records.replace_one({"_id": ownership.record_id}, document, upsert=True)
+
+    async def renew_records(self, worker: Worker, ttl: float) -> None:
+        await self._records.update_many({"worker_id": worker.worker_id}, {"$set": {"expires_at": time.time() + ttl}})
+
+    async def forget_record(self, record_id: str) -> None:
+        await self._records.delete_one({"_id": record_id})
+
+    @staticmethod
+    def _to_ownership(doc: tp.Dict[str, tp.Any]) -> RecordOwnership:
+        return RecordOwnership(
+            record_id=doc["_id"],
+            camera_number=doc["camera_number"],
+            filename=doc["filename"],
+            start_time=doc["start_time"],
+            owner=Worker(worker_id=doc["worker_id"], address=doc["address"]),
+        )
+
+    async def get_record(self, record_id: str) -> tp.Optional[RecordOwnership]:
+        doc = await self._records.find_one({"_id": record_id, "expires_at": {"$gte": time.time()}})
+        return self._to_ownership(doc) if doc else None
+
+    async def get_records(self) -> tp.List[RecordOwnership]:
+        now = time.time()
+        await self._records.delete_many({"expires_at": {"$lt": now}})
+        return [self._to_ownership(doc) async for doc in self._records.find({})]
+
+    async def register_worker(self, worker: Worker, ttl: float) -> None:
+        document = {"address": worker.address, "expires_at": time.time() + ttl}
+        await self._workers.replace_one({"_id": worker.worker_id}, document, upsert=True)
+
+    async def get_worker(self, worker_id: str) -> tp.Optional[Worker]:
+        doc = await self._workers.find_one({"_id": worker_id, "expires_at": {"$gte": time.time()}})
+        return Worker(worker_id=doc["_id"], address=doc["address"]) if doc else None
+
+
+def _get_backend(name: str) -> StateBackend:
+    backends: tp.Dict[str, tp.Callable[[], StateBackend]] = {
+        "memory": InMemoryStateBackend,
+        "sqlite": SqliteStateBackend,
+        "mongo": MongoStateBackend,
+    }
+
+    if name not in backends:
+        raise ValueError(f"Unknown state backend '{name}', expected one of {list(backends)}")
+
+    return backends[name]()
+
+
+class Cluster:
+    """
+    Coordinates workers sharing a state backend. Every camera is leased by exactly one worker, which runs
+    all of its ffmpeg processes. Camera and record scoped requests landing on other workers are proxied
+    to the owner through its internal listener.
+    """
+
+    def __init__(self, backend_name: str = STATE_BACKEND) -> None:
+        self.backend_name = backend_name
+        self.worker = Worker(worker_id=f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}", address="")
+        self._backend: tp.Optional[StateBackend] = None
+        self._leased: tp.Dict[int, float] = {}  # camera number: time.monotonic() of the last request for it
+        self._server: tp.Optional[uvicorn.Server] = None
+
+    @property
+    def is_distributed(self) -> bool:
+        return self.backend_name != "memory"
+
+    @property
+    def backend(self) -> StateBackend:
+        if self._backend is None:
+            self._backend = _get_backend(self.backend_name)
+
+        return self._backend
+
+    async def start(self, app: tp.Any, get_busy_cameras: tp.Callable[[], tp.Set[int]]) -> None:
+        """start the internal listener and the lease heartbeat if running with a shared state backend"""
+        if not self.is_distributed:
+            return
+
+        config = uvicorn.Config(app, host=WORKER_HOST, port=WORKER_PORT, lifespan="off", log_config=None)
+        self._server = uvicorn.Server(config)
+        self._server.install_signal_handlers = lambda: None
+        serving = asyncio.create_task(self._serve())
+        deadline = time.monotonic() + LISTENER_START_TIMEOUT_SEC
+
+        while not self._server.started:
+            if serving.done():
+                raise RuntimeError(
+                    f"Internal listener failed to start on {WORKER_HOST}:{WORKER_PORT}: {serving.exception()}"
+                )
+
+            if time.monotonic() > deadline:
+                self._server.should_exit = True
+                raise RuntimeError(f"Internal listener did not start in {LISTENER_START_TIMEOUT_SEC}s")
+
+            await asyncio.sleep(0.05)
+
+        port = self._server.servers[0].sockets[0].getsockname()[1]
+        self.worker = Worker(worker_id=self.worker.worker_id, address=f"{WORKER_HOST}:{port}")
+        await self.backend.register_worker(self.worker, CAMERA_LEASE_TTL_SEC)
+        asyncio.create_task(self._heartbeat(get_busy_cameras))
+        logger.info(f"Worker {self.worker.worker_id} joined the cluster using {self.backend_name} state backend")
+
+    async def _serve(self) -> None:
+        """run the internal listener. uvicorn exits the process if it cannot bind, which is turned into an error"""
+        assert self._server is not None
+
+        try:
+            await self._server.serve()
+        except SystemExit as e:
+            raise RuntimeError(f"uvicorn exited with code {e.code}") from None
+
+    async def stop(self) -> None:
+        for camera_number in list(self._leased):
+            await self.backend.release_camera(camera_number, self.worker)
+
+        self._leased.clear()
+
+        if self._server is not None:
+            self._server.should_exit = True
+
+    async def acquire_camera(self, camera_number: int) -> tp.Optional[Worker]:
+        """lease a camera. returns the owning worker if it is leased by another one"""
+        owner = await self.backend.acquire_camera(camera_number, self.worker, CAMERA_LEASE_TTL_SEC)
+
+        if owner == self.worker:
+            self._leased[camera_number] = time.monotonic()
+            return None
+
+        return owner
+
+    def new_job_id(self) -> str:
+        """an id for a job of this worker. with several workers it tells the worker requests for the job go to"""
+        job_id = uuid4().hex
+        return f"{self.worker.worker_id}.{job_id}" if self.is_distributed else job_id
+
+    async def get_job_owner(self, job_id: str) -> tp.Optional[Worker]:
+        """get the worker running a job if it is not this one"""
+        worker_id = job_id.rpartition(".")[0]
+
+        if not worker_id or worker_id == self.worker.worker_id:
+            return None
+
+        return await self.backend.get_worker(worker_id)
+
+    async def get_record_owner(self, record_id: str) -> tp.Optional[Worker]:
+        """get the worker running an ongoing record if it is not this one"""
+        ownership = await self.backend.get_record(record_id)
+
+        if ownership is not None and ownership.owner.worker_id != self.worker.worker_id:
+            return ownership.owner
+
+        return None
+
+    async def register_record(self, record: Recording) -> None:
+        if self.is_distributed and record.start_time is not None:
+            await self.backend.register_record(
+                RecordOwnership(
+                    record_id=record.record_id,
+                    camera_number=record.camera_number,
+                    filename=record.filename,
+                    start_time=record.start_time.timestamp(),
+                    owner=self.worker,
+                ),
+                CAMERA_LEASE_TTL_SEC,
+            )
+
+    async def forget_record(self, record_id: str) -> None:
+        if self.is_distributed:
+            await self.backend.forget_record(record_id)
+
+    async def get_remote_records(self) -> tp.List[Recording]:
+        """ongoing recordings of the other workers"""
+        if not self.is_distributed:
+            return []
+
+        return [
+            Recording(
+                rtsp_steam="",
+                record_id=ownership.record_id,
+                camera_number=ownership.camera_number,
+                filename=ownership.filename,
+                start_time=datetime.fromtimestamp(ownership.start_time),
+            )
+            for ownership in await self.backend.get_records()
+            if ownership.owner.worker_id != self.worker.worker_id
+        ]
+
+    def is_internal(self, scope: Scope) -> bool:
+        """whether a request came through the internal listener, which is how other workers reach this one"""
+        server = scope.get("server")
+        return bool(self.worker.address) and server is not None and self.worker.address.endswith(f":{server[1]}")
+
+    async def route(self, request: Request) -> tp.Optional[Worker]:
+        """find the worker which should serve a request if it is not this one"""
+        if not self.is_distributed or FORWARDED_HEADER in request.headers:
+            return None
+
+        if match := _CAMERA_ROUTE.match(request.url.path):
+            return await self.acquire_camera(int(match.group(1)))
+
+        if match := _RECORD_ROUTE.match(request.url.path):
+            return await self.get_record_owner(match.group(1))
+
+        if _JOB_ROUTE.match(request.url.path):
+            return await self.get_job_owner(request.url.path.removeprefix("/job/"))
+
+        return None
+
+    async def forward(self, request: Request, owner: Worker) -> Response:
+        """proxy a request to the worker owning the camera or the record"""
+        url = f"http://{owner.address}{request.url.path}"
+        headers = {key: value for key, value in request.headers.items() if key not in ("host", "content-length")}
+        headers[FORWARDED_HEADER] = self.worker.worker_id
+        headers[TRACE_HEADER] = TRACE_ID.get() or headers.get(TRACE_HEADER) or ""
+        body = await request.body()
+        logger.debug(f"Forwarding {request.method} {request.url.path} to worker {owner.worker_id}")
+
+        try:
+            response = await asyncio.to_thread(
+                requests.request,
+                request.method,
+                url,
+                params=list(request.query_params.multi_items()),
+                headers=headers,
+                data=body,
+                timeout=PROXY_TIMEOUT_SEC,
+                stream=True,
+            )
+        except requests.RequestException as e:
+            logger.error(f"Failed to forward request to worker {owner.worker_id}: {e}")
+            return Response(f"Owner worker {owner.worker_id} is unreachable: {e}", status_code=502)
+
+        def relay() -> tp.Iterator[bytes]:
+            try:
+                yield from response.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+            finally:
+                response.close()
+
+        excluded = ("transfer-encoding", "connection")
+        return StreamingResponse(
+            relay(),
+            status_code=response.status_code,
+            headers={key: value for key, value in response.headers.items() if key.lower() not in excluded},
+        )
+
+    async def call(
+        self,
+        owner: Worker,
+        path: str,
+        headers: tp.Mapping[str, str],
+        params: tp.Optional[tp.Dict[str, tp.Any]] = None,
+    ) -> tp.Tuple[int, tp.Dict[str, tp.Any]]:
+        """make a POST request to another worker on behalf of a client. returns the status code and the JSON body"""
+        headers = {key: value for key, value in headers.items() if key not in ("host", "content-length")}
+        headers[FORWARDED_HEADER] = self.worker.worker_id
+        headers[TRACE_HEADER] = TRACE_ID.get() or headers.get(TRACE_HEADER) or ""
+
+        try:
+            response = await asyncio.to_thread(
+                requests.post,
+                f"http://{owner.address}{path}",
+                params=params,
+                headers=headers,
+                timeout=PROXY_TIMEOUT_SEC,
+            )
+            return response.status_code, response.json()
+        except (requests.RequestException, ValueError) as e:
+            return 502, {"status": 502, "details": f"Owner worker {owner.worker_id} is unreachable: {e}"}
+
+    async def _heartbeat(self, get_busy_cameras: tp.Callable[[], tp.Set[int]]) -> None:
+        """
+        renew ownership of the ongoing recordings and leases of cameras in use, release the cameras idle
+        for longer than a lease period
+        """
+        while True:
+            await asyncio.sleep(CAMERA_LEASE_TTL_SEC / 3)
+            busy = get_busy_cameras()
+
+            try:
+                await self.backend.register_worker(self.worker, CAMERA_LEASE_TTL_SEC)
+                await self.backend.renew_records(self.worker, CAMERA_LEASE_TTL_SEC)
+            except Exception as e:
+                logger.error(f"Failed to renew the worker address and ownership of its recordings: {e}")
+
+            for camera_number, last_used in list(self._leased.items()):
+                try:
+                    if camera_number in busy or time.monotonic() - last_used < CAMERA_LEASE_TTL_SEC:
+                        owner = await self.backend.acquire_camera(camera_number, self.worker, CAMERA_LEASE_TTL_SEC)
+
+                        if owner != self.worker:
+                            logger.error(f"Lease of camera no.{camera_number} was taken over by {owner.worker_id}")
+                            del self._leased[camera_number]
+                    else:
+                        await self.backend.release_camera(camera_number, self.worker)
+                        del self._leased[camera_number]
+                except Exception as e:
+                    logger.error(f"Failed to renew lease of camera no.{camera_number}: {e}")
+
+
+CLUSTER = Cluster()
+
+
+class ClusterRoutingMiddleware:
+    """proxy camera and record scoped requests to the worker owning them when running several workers"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            if not CLUSTER.is_internal(scope):
+                # clients must not skip routing by posing as another worker
+                forwarded = FORWARDED_HEADER.encode()
+                scope["headers"] = [(key, value) for key, value in scope["headers"] if key != forwarded]
+
+            request = Request(scope, receive)
+            owner = await CLUSTER.route(request)
+
+            if owner is not None:
+                response = await CLUSTER.forward(request, owner)
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import typing as tp
+from dataclasses import dataclass, field, replace
+
+from loguru import logger
+
+from .camera import Recording
+from .output import VIDEO_DIR
+from .scheduler import DEADLINES
+from .store import RECORDS
+
+STORAGE_QUOTA_BYTES: int = int(os.getenv("STORAGE_QUOTA_BYTES", 0))
+CAMERA_STORAGE_QUOTAS: tp.Dict[int, int] = {
+    int(number): int(quota) for number, quota in json.loads(os.getenv("CAMERA_STORAGE_QUOTAS", "{}")).items()
+}
+VIDEO_RETENTION_DAYS: float = float(os.getenv("VIDEO_RETENTION_DAYS", 0))
+MIN_FREE_SPACE_BYTES: int = int(os.getenv("MIN_FREE_SPACE_BYTES", 1024**3))
+DEFAULT_BITRATE_KBPS: float = float(os.getenv("DEFAULT_BITRATE_KBPS", 4000))
+STORAGE_CHECK_INTERVAL_SEC: float = float(os.getenv("STORAGE_CHECK_INTERVAL_SEC", 60))
+DISK_USAGE_CACHE_SEC: float = 5
+BITRATE_SMOOTHING: float = 0.3
+
+
+class InsufficientStorageError(Exception):
+    """there is not enough disk space for a new recording"""
+
+
+@dataclass
+class StoredFile:
+    path: str
+    size: int
+    created_at: float  # unix timestamp
+    record_id: str
+    camera_number: tp.Optional[int] = None
+
+
+@dataclass
+class StorageManager:
+    """
+    Keeps an index of the video files with byte totals per camera, so that limits are enforced without
+    rescanning the directory: the index is built once at startup and updated as recordings are finalized.
+    Enforces retention by age and byte quotas evicting the oldest files first and refuses new recordings
+    when the disk cannot fit them.
+    """
+
+    directory: str = VIDEO_DIR
+    quota_bytes: int = STORAGE_QUOTA_BYTES
+    camera_quotas: tp.Dict[int, int] = field(default_factory=lambda: dict(CAMERA_STORAGE_QUOTAS))
+    retention_sec: float = VIDEO_RETENTION_DAYS * 24 * 60 * 60
+    files: tp.Dict[str, StoredFile] = field(default_factory=dict)  # path: file
+    camera_bytes: tp.Dict[tp.Optional[int], int] = field(default_factory=dict)
+    total_bytes: int = 0
+    _held: tp.Set[str] = field(default_factory=set)
+    _bitrates: tp.Dict[int, float] = field(default_factory=dict)  # kbps
+    _disk_free: tp.Optional[int] = None
+    _disk_checked_at: float = 0.0
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def _track(self, file: StoredFile) -> None:
+        self._untrack(file.path)
+        self.files[file.path] = file
+        self.camera_bytes[file.camera_number] = self.camera_bytes.get(file.camera_number, 0) + file.size
+        self.total_bytes += file.size
+
+    def _untrack(self, path: str) -> tp.Optional[StoredFile]:
+        file = self.files.pop(path, None)
+
+        if file is not None:
+            self.camera_bytes[file.camera_number] -= file.size
+            self.total_bytes -= file.size
+
+        return file
+
+    async def build_index(self) -> None:
+        """scan the video directory once and attribute the files to cameras using the records database"""
+        files = await asyncio.to_thread(self._scan)
+        cameras = await RECORDS.get_camera_numbers()
+
+        for file in files:
+            file.camera_number = cameras.get(file.record_id)
+            self._track(file)
+
+        logger.info(f"Indexed {len(self.files)} video files, {self.total_bytes / 1024**2:.1f} MiB total")
+
+    def _scan(self) -> tp.List[StoredFile]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        files = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    record_id = entry.name.split(".", 1)[0]
+                    files.append(StoredFile(entry.path, stat.st_size, stat.st_mtime, record_id))
+
+        return files
+
+    def add(self, record: Recording, size: int) -> None:
+        """index the file of a finalized recording and update the observed camera bitrate"""
+        created_at = record.start_time.timestamp() if record.start_time else time.time()
+        self._track(StoredFile(str(record.filename), size, created_at, record.record_id, record.camera_number))
+        duration = record.metadata.get("duration")
+
+        if record.camera_number is not None and duration:
+            bitrate = size * 8 / 1000 / float(duration)
+            previous = self._bitrates.get(record.camera_number, bitrate)
+            self._bitrates[record.camera_number] = previous + BITRATE_SMOOTHING * (bitrate - previous)
+
+    def resize(self, path: str, size: int) -> None:
+        """update the size of an indexed file replaced in place, e.g. by a transcoded one"""
+        file = self.files.get(path)
+
+        if file is not None:
+            self._track(replace(file, size=size))
+
+    def hold(self, record_id: str) -> None:
+        """protect a file from eviction, e.g. while it awaits post-processing"""
+        self._held.add(record_id)
+
+    def release(self, record_id: str) -> None:
+        self._held.discard(record_id)
+
+    def get_bitrate(self, camera_number: int) -> float:
+        """bitrate of the camera in kbps: the live one of an ongoing recording, the observed one or the default"""
+        for record in RECORDS.values():
+            progress = record.progress
+
+            if record.camera_number == camera_number and progress is not None and progress.bitrate_kbps:
+                return progress.bitrate_kbps
+
+        return self._bitrates.get(camera_number, DEFAULT_BITRATE_KBPS)
+
+    async def get_disk_free(self) -> int:
+        if self._disk_free is None or time.monotonic() - self._disk_checked_at > DISK_USAGE_CACHE_SEC:
+            await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+            usage = await asyncio.to_thread(shutil.disk_usage, self.directory)
+            self._disk_free, self._disk_checked_at = usage.free, time.monotonic()
+
+        assert self._disk_free is not None
+        return self._disk_free
+
+    def _reserved_bytes(self) -> int:
+        """bytes ongoing recordings are expected to write until their deadlines"""
+        reserved = 0.0
+
+        for record in RECORDS.values():
+            deadline = DEADLINES.get_deadline(record.record_id)
+
+            if record.camera_number is not None and deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                reserved += self.get_bitrate(record.camera_number) * 1000 / 8 * remaining
+
+        return int(reserved)
+
+    async def admit(self, camera_number: int, max_duration: float) -> None:
+        """raise InsufficientStorageError if a recording of max_duration seconds may not fit the disk"""
+        required = int(self.get_bitrate(camera_number) * 1000 / 8 * max_duration)
+        available = await self.get_disk_free() - self._reserved_bytes() - MIN_FREE_SPACE_BYTES
+
+        if required > available:
+            raise InsufficientStorageError(
+                f"Not enough disk space for a {max_duration}s recording: "
+                f"{required / 1024**2:.0f} MiB required, {max(available, 0) / 1024**2:.0f} MiB available"
+            )
+
+    def _select_evictions(self) -> tp.List[StoredFile]:
+        """files to evict: the expired ones and the oldest ones exceeding quotas"""
+        candidates = sorted(
+            (
+                file
+                for file in self.files.values()
+                if file.record_id not in self._held and file.record_id not in RECORDS
+            ),
+            key=lambda file: file.created_at,
+        )
+        evicted: tp.Dict[str, StoredFile] = {}  # path: file
+        total_bytes, camera_bytes = self.total_bytes, dict(self.camera_bytes)
+
+        def evict(file: StoredFile) -> None:
+            nonlocal total_bytes
+            evicted[file.path] = file
+            total_bytes -= file.size
+            camera_bytes[file.camera_number] -= file.size
+
+        if self.retention_sec:
+            expire_before = time.time() - self.retention_sec
+
+            for file in candidates:
+                if file.created_at < expire_before:
+                    evict(file)
+
+        for camera_number, quota in self.camera_quotas.items():
+            for file in candidates:
+                if camera_bytes.get(camera_number, 0) <= quota:
+                    break
+
+                if file.camera_number == camera_number and file.path not in evicted:
+                    evict(file)
+
+        for file in candidates:
+            if not self.quota_bytes or total_bytes <= self.quota_bytes:
+                break
+
+            if file.path not in evicted:
+                evict(file)
+
+        return list(evicted.values())
+
+    async def enforce_limits(self) -> tp.List[str]:
+        """evict files breaking retention or quotas. returns ids of the evicted records"""
+        async with self._lock:
+            evicted = []
+
+            for file in self._select_evictions():
+                try:
+                    await asyncio.to_thread(os.remove, file.path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Failed to evict video file {file.path}: {e}")
+                    continue
+
+                self._untrack(file.path)
+                evicted.append(file.record_id)
+                record = await RECORDS.get(file.record_id)
+
+                if record is not None:
+                    record.metadata["evicted_at"] = time.time()
+                    await RECORDS.update(record)
+
+            if evicted:
+                self._disk_free = None
+                logger.info(f"Evicted {len(evicted)} video files. {self.total_bytes / 1024**2:.1f} MiB stored")
+
+            return evicted
+
+    async def run(self, interval: float = STORAGE_CHECK_INTERVAL_SEC) -> None:
+        """build the index and enforce the limits periodically"""
+        await self.build_index()
+
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                await self.enforce_limits()
+            except Exception as e:
+                logger.error(f"Failed to enforce storage limits: {e}")
+
+
+STORAGE = StorageManager()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import typing as tp
+from datetime import datetime
+
+from loguru import logger
+
+from .camera import Recording
+
+RECORDS_DB_PATH: str = os.getenv("RECORDS_DB_PATH", "output/records.db")
+
+_COLUMNS: tp.Dict[str, str] = {
+    "record_id": "TEXT PRIMARY KEY",
+    "camera_number": "INTEGER",
+    "filename": "TEXT",
+    "start_time": "REAL",
+    "end_time": "REAL",
+    "state": "TEXT",
+    "error": "TEXT",
+    "metadata": "TEXT",
+}
+_INDEXES: tp.Dict[str, str] = {
+    "records_start_time": "start_time DESC, record_id DESC",
+    "records_camera": "camera_number, start_time DESC",
+    "records_state": "state, start_time DESC",
+}
+
+
+def _timestamp(dt: tp.Optional[datetime]) -> tp.Optional[float]:
+    return dt.timestamp() if dt is not None else None
+
+
+def _datetime(ts: tp.Optional[float]) -> tp.Optional[datetime]:
+    return datetime.fromtimestamp(ts) if ts is not None else None
+
+
+def _parse_cursor(cursor: str) -> tp.Tuple[float, str]:
+    """split a page cursor into the start time and the id of the last record on the previous page"""
+    start_time, _, record_id = cursor.partition("_")
+
+    try:
+        if record_id and math.isfinite(float(start_time)):
+            return float(start_time), record_id
+    except ValueError:
+        pass
+
+    raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class RecordStore:
+    """
+    A registry of recordings. Ongoing recordings are kept in memory,
+    finished ones are archived into an indexed SQLite database and loaded on demand.
+    """
+
+    def __init__(self, db_path: str = RECORDS_DB_PATH) -> None:
+        self._db_path = db_path
+        self._hot: tp.Dict[str, Recording] = {}
+        self._connection: tp.Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._hot
+
+    def __getitem__(self, record_id: str) -> Recording:
+        return self._hot[record_id]
+
+    def __setitem__(self, record_id: str, record: Recording) -> None:
+        self._hot[record_id] = record
+
+    def __delitem__(self, record_id: str) -> None:
+        del self._hot[record_id]
+
+    def __len__(self) -> int:
+        return len(self._hot)
+
+    def values(self) -> tp.List[Recording]:
+        """ongoing recordings"""
+        return list(self._hot.values())
+
+    def items(self) -> tp.List[tp.Tuple[str, Recording]]:
+        return list(self._hot.items())
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if os.path.dirname(self._db_path):
+                os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+
+            connection = sqlite3.connect(self._db_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            columns = ", ".join(f"{name} {type_}" for name, type_ in _COLUMNS.items())
+            connection.execute(f"CREATE TABLE IF NOT EXISTS records ({columns})")
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(records)")}
+
+            for name, type_ in _COLUMNS.items():
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE records ADD COLUMN {name} {type_}")
+
+            for name, definition in _INDEXES.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON records ({definition})")
+
+            connection.commit()
+            self._connection = connection
+            logger.info(f"Opened records database at {self._db_path}")
+
+        return self._connection
+
+    def _execute(self, query: str, parameters: tp.Sequence[tp.Any] = ()) -> tp.List[tp.Tuple[tp.Any, ...]]:
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(query, parameters).fetchall()
+            connection.commit()
+            return rows
+
+    async def archive(self, record: Recording) -> None:
+        """move a finished recording from memory into the database"""
+        row = (
+            record.record_id,
+            record.camera_number,
+            record.filename,
+            _timestamp(record.start_time),
+            _timestamp(record.end_time),
+            record.state,
+            record.error,
+            json.dumps(record.metadata, default=str),
+        )
+
+        try:
+            await asyncio.to_thread(
+                self._execute,
+                f"INSERT OR REPLACE INTO records ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                row,
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to archive record {record.record_id}: {e}")
+            return
+
+        self._hot.pop(record.record_id, None)
+        logger.debug(f"Record {record.record_id} archived")
+
+    async def get(self, record_id: str) -> tp.Optional[Recording]:
+        """get an ongoing or an archived recording by its id"""
+        if record_id in self._hot:
+            return self._hot[record_id]
+
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT {', '.join(_COLUMNS)} FROM records WHERE record_id = ?", (record_id,)
+        )
+        return self._to_recording(rows[0]) if rows else None
+
+    async def update(self, record: Recording) -> None:
+        """persist changes of an archived recording state or metadata"""
+        if record.record_id in self._hot:
+            return
+
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE records SET state = ?, error = ?, metadata = ? WHERE record_id = ?",
+            (record.state, record.error, json.dumps(record.metadata, default=str), record.record_id),
+        )
+
+    async def query(
+        self,
+        camera_number: tp.Optional[int] = None,
+        since: tp.Optional[datetime] = None,
+        until: tp.Optional[datetime] = None,
+        state: tp.Optional[str] = None,
+        limit: int = 100,
+        cursor: tp.Optional[str] = None,
+    ) -> tp.Tuple[tp.List[Recording], tp.Optional[str]]:
+        """get a page of archived recordings, newest first. returns the page and a cursor of the next one"""
+        conditions, parameters = [], []
+
+        for condition, value in (
+            ("camera_number = ?", camera_number),
+            ("start_time >= ?", _timestamp(since)),
+            ("start_time < ?", _timestamp(until)),
+            ("state = ?", state),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        if cursor is not None:
+            conditions.append("((start_time, record_id) < (?, ?) OR start_time IS NULL)")
+            parameters.extend(_parse_cursor(cursor))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT {', '.join(_COLUMNS)} FROM records {where} ORDER BY start_time DESC, record_id DESC LIMIT ?",
+            (*parameters, limit + 1),
+        )
+        records = [self._to_recording(row) for row in rows[:limit]]
+        next_cursor = None
+
+        # recordings which never started sort last, on the page after the started ones, and cannot be paged past
+        if len(rows) > limit and rows[limit - 1][3] is not None:
+            last = rows[limit - 1]
+            next_cursor = f"{last[3]!r}_{last[0]}"
+
+        return records, next_cursor
+
+    async def query_by_metadata(self, path: str, values: tp.Sequence[tp.Any]) -> tp.List[Recording]:
+        """get archived recordings with a metadata field (a JSON path, e.g. '$.size') equal to one of the values"""
+        placeholders = ", ".join("?" * len(values))
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT {', '.join(_COLUMNS)} FROM records WHERE json_extract(metadata, ?) IN ({placeholders})",
+            (path, *values),
+        )
+        return [self._to_recording(row) for row in rows]
+
+    async def get_camera_numbers(self) -> tp.Dict[str, tp.Optional[int]]:
+        """camera numbers of all the archived recordings by their ids"""
+        rows = await asyncio.to_thread(self._execute, "SELECT record_id, camera_number FROM records")
+        return {record_id: camera_number for record_id, camera_number in rows}
+
+    @staticmethod
+    def _to_recording(row: tp.Tuple[tp.Any, ...]) -> Recording:
+        record_id, camera_number, filename, start_time, end_time, _, error, metadata = row
+        return Recording(
+            rtsp_steam="",
+            record_id=record_id,
+            camera_number=camera_number,
+            filename=filename,
+            start_time=_datetime(start_time),
+            end_time=_datetime(end_time),
+            error=error,
+            metadata=json.loads(metadata) if metadata else {},
+        )
+
+
+RECORDS = RecordStore()
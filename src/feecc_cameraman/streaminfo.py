@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import typing as tp
+from dataclasses import dataclass
+
+from loguru import logger
+
+from .output import FFMPEG_PROGRAM
+
+FAST_PROBE: bool = os.getenv("FAST_PROBE", "true").lower() in ("1", "true", "yes")
+FAST_PROBESIZE: int = int(os.getenv("FAST_PROBESIZE", 500_000))  # bytes, ffmpeg defaults to 5 MB
+FAST_ANALYZEDURATION_USEC: int = int(os.getenv("FAST_ANALYZEDURATION_USEC", 500_000))  # ffmpeg defaults to 5 s
+PROBE_OPTIONS: tp.Tuple[str, ...] = ("-probesize", "-analyzeduration")
+
+_STREAM_LINE = re.compile(r"^\s*Stream #\d+:\d+\S*: (?P<kind>\w+): (?P<codec>\w+)(?P<details>.*)$")
+_RESOLUTION = re.compile(r"\b(\d{2,5}x\d{2,5})\b")
+_TIME_BASE = re.compile(r"\b([\d.]+k?) tbn\b")
+_SAMPLE_RATE = re.compile(r"\b(\d+) Hz\b")
+_DURATION = re.compile(r"^\s*Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class StreamParams:
+    """parameters of a single elementary stream which ffmpeg has to learn by probing"""
+
+    kind: str  # Video, Audio, Data or Subtitle
+    codec: str
+    resolution: tp.Optional[str] = None  # video only, e.g. 1920x1080
+    time_base: tp.Optional[str] = None  # tbn of a video or sample rate of an audio stream
+
+    def __str__(self) -> str:
+        return " ".join(filter(None, (self.kind.lower(), self.codec, self.resolution, self.time_base)))
+
+
+StreamInfo = tp.Tuple[StreamParams, ...]
+
+
+def parse_stream_info(ffmpeg_output: str) -> StreamInfo:
+    """parse the stream lines ffmpeg prints describing its first input"""
+    streams: tp.List[StreamParams] = []
+
+    for line in ffmpeg_output.splitlines():
+        if line.lstrip().startswith("Output #"):
+            break
+
+        match = _STREAM_LINE.match(line)
+
+        if match is None:
+            continue
+
+        details = match["details"]
+        resolution = _RESOLUTION.search(details) if match["kind"] == "Video" else None
+        time_base = _TIME_BASE.search(details) if match["kind"] == "Video" else _SAMPLE_RATE.search(details)
+        streams.append(
+            StreamParams(
+                kind=match["kind"],
+                codec=match["codec"],
+                resolution=resolution[1] if resolution else None,
+                time_base=time_base[1] if time_base else None,
+            )
+        )
+
+    return tuple(streams)
+
+
+def parse_duration(ffmpeg_output: str) -> tp.Optional[float]:
+    """parse the duration of the first input in seconds. None if ffmpeg does not know it, e.g. for a live stream"""
+    match = _DURATION.search(ffmpeg_output)
+
+    if match is None:
+        return None
+
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def describe_file(filename: str) -> tp.Tuple[StreamInfo, tp.Optional[float]]:
+    """learn the streams and the duration of a local video file. no streams if ffmpeg could not read it"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_PROGRAM, "-hide_banner", "-nostdin", "-i", filename,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )  # fmt: skip
+    _, stderr = await process.communicate()  # exits with an error as no output is given, streams are printed anyway
+    output = stderr.decode(errors="replace")
+    return parse_stream_info(output), parse_duration(output)
+
+
+async def probe_file(filename: str) -> StreamInfo:
+    """learn the streams of a local video file. empty if ffmpeg could not read it"""
+    streams, _ = await describe_file(filename)
+    return streams
+
+
+class StreamInfoCache:
+    """
+    Stream parameters of every camera, learned from the files of its recordings started with a full probe.
+    Once known, recordings of the camera are started with a minimal -probesize and -analyzeduration, and the files
+    they produce are checked against the known parameters. A mismatch or a failed recording drops them,
+    so that the next recording probes the stream fully again.
+    """
+
+    def __init__(self) -> None:
+        self._streams: tp.Dict[str, StreamInfo] = {}  # rtsp stream link: streams
+
+    def get(self, rtsp_stream_link: str) -> tp.Optional[StreamInfo]:
+        return self._streams.get(rtsp_stream_link)
+
+    def input_args(self, rtsp_stream_link: str) -> tp.List[str]:
+        """ffmpeg input options to start a recording of the stream with. empty if it has to be probed fully"""
+        if not FAST_PROBE or rtsp_stream_link not in self._streams:
+            return []
+
+        return ["-probesize", str(FAST_PROBESIZE), "-analyzeduration", str(FAST_ANALYZEDURATION_USEC)]
+
+    def invalidate(self, rtsp_stream_link: str) -> None:
+        if self._streams.pop(rtsp_stream_link, None) is not None:
+            logger.info(f"Forgot stream parameters of {rtsp_stream_link}, it will be probed fully")
+
+    async def update(self, rtsp_stream_link: str, filename: str, fast: bool) -> None:
+        """learn stream parameters from a recorded file or, if it was recorded with a fast probe, verify them"""
+        try:
+            streams = await probe_file(filename)
+        except OSError as e:
+            logger.warning(f"Failed to probe {filename}: {e}")
+            return
+
+        known = self._streams.get(rtsp_stream_link)
+
+        if fast and streams != known:
+            logger.warning(
+                f"Streams of {filename} ({', '.join(map(str, streams))}) do not match the ones known for "
+                f"{rtsp_stream_link} ({', '.join(map(str, known or ()))})"
+            )
+            self.invalidate(rtsp_stream_link)
+        elif not fast and streams and streams != known:
+            self._streams[rtsp_stream_link] = streams
+            logger.debug(f"Learned stream parameters of {rtsp_stream_link}: {', '.join(map(str, streams))}")
+
+
+STREAM_INFO = StreamInfoCache()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import os
+import time
+import typing as tp
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import uuid4
+
+from loguru import logger
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TRACE_HEADER: str = "x-request-id"
+SLOW_REQUEST_SEC: float = float(os.getenv("SLOW_REQUEST_SEC", 1))  # until response headers are sent
+
+TRACE_ID: ContextVar[tp.Optional[str]] = ContextVar("trace_id", default=None)
+_SPANS: ContextVar[tp.Optional[tp.List[tp.Tuple[str, float]]]] = ContextVar("spans", default=None)
+
+
+@contextmanager
+def span(name: str) -> tp.Iterator[None]:
+    """time a phase of the current request. outside of a request it costs a context variable lookup"""
+    spans = _SPANS.get()
+
+    if spans is None:
+        yield
+        return
+
+    started_at = time.monotonic()
+
+    try:
+        yield
+    finally:
+        spans.append((name, time.monotonic() - started_at))
+
+
+class TracingMiddleware:
+    """
+    Assign every HTTP request a trace id, taken from the X-Request-ID header if the client has set one.
+    The id is attached to every log record made while handling the request, including the ones of the tasks
+    it starts, e.g. ffmpeg output readers. Request phases timed with span() are logged once the request is over.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        trace_id = headers.get(TRACE_HEADER.encode(), b"").decode() or uuid4().hex[:16]
+        spans: tp.List[tp.Tuple[str, float]] = []
+        trace_token, spans_token = TRACE_ID.set(trace_id), _SPANS.set(spans)
+        started_at = time.monotonic()
+        response_started_at: tp.Optional[float] = None
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, response_started_at
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_started_at = time.monotonic()
+                message["headers"] = [*message.get("headers", []), (TRACE_HEADER.encode(), trace_id.encode())]
+
+            await send(message)
+
+        try:
+            with logger.contextualize(trace_id=trace_id):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            TRACE_ID.reset(trace_token)
+            _SPANS.reset(spans_token)
+            finished_at = time.monotonic()
+            latency = (response_started_at or finished_at) - started_at
+            self._log(scope, status_code, latency, finished_at - started_at, spans, trace_id)
+
+    @staticmethod
+    def _log(
+        scope: Scope,
+        status_code: int,
+        latency: float,
+        duration: float,
+        spans: tp.List[tp.Tuple[str, float]],
+        trace_id: str,
+    ) -> None:
+        """log the request at the debug level, or as a warning if it was slow to respond"""
+        totals: tp.Dict[str, float] = {}
+
+        for name, seconds in spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+
+        phases = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in totals.items())
+        message = (
+            f"{scope['method']} {scope['path']} {status_code} responded in {latency * 1000:.1f} ms, "
+            f"completed in {duration * 1000:.1f} ms{f' ({phases})' if phases else ''}"
+        )
+        level = "WARNING" if latency >= SLOW_REQUEST_SEC else "DEBUG"
+        logger.bind(trace_id=trace_id, latency=latency, duration=duration, spans=totals).log(level, message)
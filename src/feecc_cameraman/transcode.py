@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import typing as tp
+from dataclasses import asdict, dataclass
+
+from loguru import logger
+
+from .camera import Recording
+from .idle import is_enabled as is_idle_trimming_enabled
+from .idle import trim_idle
+from .metrics import (
+    TRANSCODED_MEDIA_SECONDS,
+    TRANSCODING_RESULTS,
+    TRANSCODING_SAVED_BYTES,
+    TRANSCODING_SECONDS,
+)
+from .output import FFMPEG_PROGRAM, TRANSCODE_SUFFIX, _remove
+from .pipeline import POSTPROCESSOR
+from .resources import RESOURCES
+from .storage import STORAGE
+from .store import RECORDS
+from .streaminfo import describe_file
+
+
+@dataclass(frozen=True)
+class TranscodingProfile:
+    """ffmpeg encoding settings a recording is transcoded with after it is finalized"""
+
+    name: str
+    codec: str = "libx264"
+    crf: int = 28
+    height: tp.Optional[int] = None  # videos are scaled down to it keeping the aspect ratio, never up
+    fps: tp.Optional[float] = None
+    preset: tp.Optional[str] = "veryfast"
+
+    def ffmpeg_args(self, source: str, destination: str, threads: int) -> tp.List[str]:
+        filters = [f"scale=-2:'min({self.height},ih)'"] if self.height else []
+        filters += [f"fps={self.fps}"] if self.fps else []
+        return [
+            "-nostdin", "-loglevel", "error", "-threads", str(threads), "-i", source,
+            "-map", "0:v:0", "-map", "0:a?", "-c:v", self.codec, "-crf", str(self.crf),
+            *(["-preset", self.preset] if self.preset else []),
+            *(["-b:v", "0"] if self.codec.startswith("libvpx") else []),  # constant quality mode of VP8/VP9
+            *(["-vf", ",".join(filters)] if filters else []),
+            "-threads", str(threads), "-c:a", "copy", "-movflags", "+faststart", "-y", destination,
+        ]  # fmt: skip
+
+
+BUILTIN_PROFILES: tp.Dict[str, TranscodingProfile] = {
+    "h264-720p": TranscodingProfile("h264-720p", "libx264", crf=28, height=720),
+    "h265-720p": TranscodingProfile("h265-720p", "libx265", crf=30, height=720, preset="fast"),
+}
+TRANSCODING_PROFILES: tp.Dict[str, TranscodingProfile] = {
+    **BUILTIN_PROFILES,
+    **{
+        name: TranscodingProfile(name, **settings)
+        for name, settings in json.loads(os.getenv("TRANSCODING_PROFILES", "{}")).items()
+    },
+}
+CAMERA_TRANSCODING_PROFILES: tp.Dict[int, str] = {
+    int(number): profile for number, profile in json.loads(os.getenv("CAMERA_TRANSCODING_PROFILES", "{}")).items()
+}
+DEFAULT_TRANSCODING_PROFILE: str = os.getenv("DEFAULT_TRANSCODING_PROFILE", "")
+TRANSCODING_CPU_BUDGET: int = int(os.getenv("TRANSCODING_CPU_BUDGET", max(1, (os.cpu_count() or 2) // 2)))  # cores
+TRANSCODING_THREADS_PER_JOB: int = int(os.getenv("TRANSCODING_THREADS_PER_JOB", 2))
+TRANSCODING_NICENESS: int = int(os.getenv("TRANSCODING_NICENESS", 19))
+DURATION_TOLERANCE_SEC: float = 1.0
+
+_unknown = {*CAMERA_TRANSCODING_PROFILES.values(), DEFAULT_TRANSCODING_PROFILE} - {"", *TRANSCODING_PROFILES}
+
+if _unknown:
+    raise ValueError(f"Unknown transcoding profiles: {', '.join(sorted(_unknown))}")
+
+# names ffmpeg reports for the streams produced by the encoders
+ENCODER_CODECS: tp.Dict[str, str] = {
+    "libx264": "h264",
+    "libx265": "hevc",
+    "libvpx-vp9": "vp9",
+    "libaom-av1": "av1",
+    "libsvtav1": "av1",
+}
+
+
+def get_profile(record: Recording) -> tp.Optional[TranscodingProfile]:
+    """the transcoding profile assigned to the camera of a recording, if any"""
+    name = DEFAULT_TRANSCODING_PROFILE
+
+    if record.camera_number is not None:
+        name = CAMERA_TRANSCODING_PROFILES.get(record.camera_number, name)
+
+    return TRANSCODING_PROFILES.get(name) if name else None
+
+
+def _lower_priority() -> None:
+    os.nice(TRANSCODING_NICENESS)
+
+
+class TranscodingError(Exception):
+    pass
+
+
+class Transcoder:
+    """
+    Transcodes finalized recordings of the cameras with an assigned profile before they are post-processed,
+    after cutting their idle runs out if idle trimming is enabled for the camera.
+    Transcoding ffmpeg processes run at the lowest CPU priority and use at most TRANSCODING_CPU_BUDGET cores
+    altogether, so they never compete with the live recordings. The output is verified against the original,
+    which is then replaced atomically. State and results are kept in the 'transcoding' entry of the record metadata.
+    """
+
+    def __init__(self, cpu_budget: int = TRANSCODING_CPU_BUDGET, threads: int = TRANSCODING_THREADS_PER_JOB) -> None:
+        self.threads = max(1, min(threads, cpu_budget))
+        self.workers_count = max(1, cpu_budget // self.threads)
+        self._queue: tp.Optional[asyncio.Queue[Recording]] = None
+        self._workers: tp.List[asyncio.Task[None]] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers_count)]
+        asyncio.create_task(self._resume())
+        logger.info(f"Started {self.workers_count} transcoding workers using {self.threads} threads each")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _resume(self) -> None:
+        """requeue recordings whose transcoding was interrupted by a restart"""
+        for record in await RECORDS.query_by_metadata("$.transcoding.state", ["queued", "running"]):
+            await self.submit(record)
+
+    @staticmethod
+    def wants(record: Recording) -> bool:
+        """whether a finished recording is to be trimmed or transcoded before post-processing"""
+        return get_profile(record) is not None or is_idle_trimming_enabled(record)
+
+    async def submit(self, record: Recording) -> None:
+        """queue a finished recording for transcoding. it is post-processed afterwards"""
+        if self._queue is None:
+            await POSTPROCESSOR.submit(record)
+            return
+
+        STORAGE.hold(record.record_id)
+        await self._set_state(record, "queued")
+        self._queue.put_nowait(record)  # the queue is unbounded not to hold back stopping recordings
+
+    async def _set_state(self, record: Recording, state: str, **details: tp.Any) -> None:
+        record.metadata["transcoding"] = {**record.metadata.get("transcoding", {}), "state": state, **details}
+        await RECORDS.update(record)
+
+    async def _work(self) -> None:
+        assert self._queue is not None
+
+        while True:
+            record = await self._queue.get()
+
+            try:
+                async with RESOURCES.background_job(f"transcoding:{record.record_id}", self.threads, processes=1):
+                    await trim_idle(record, self.threads, _lower_priority)
+                    await self.transcode(record)
+            except Exception as e:
+                TRANSCODING_RESULTS.inc(result="failed")
+                logger.error(f"Transcoding of record {record.record_id} failed: {e}")
+
+                try:
+                    await self._set_state(record, "failed", error=str(e))
+                except Exception as e:
+                    logger.error(f"Failed to save the transcoding state of record {record.record_id}: {e}")
+
+            try:
+                await POSTPROCESSOR.submit(record)
+            except Exception as e:
+                logger.error(f"Failed to submit record {record.record_id} for post-processing: {e}")
+            finally:
+                STORAGE.release(record.record_id)
+                self._queue.task_done()
+
+    async def transcode(self, record: Recording) -> None:
+        """transcode the video of a recording with its profile and replace the original if it is smaller"""
+        profile = get_profile(record)
+        source = str(record.filename)
+
+        if profile is None or record.error is not None or not os.path.exists(source):
+            await self._set_state(record, "skipped")
+            return
+
+        await self._set_state(record, "running", profile=asdict(profile))
+        destination = os.path.splitext(source)[0] + TRANSCODE_SUFFIX
+        started_at = time.monotonic()
+
+        try:
+            await self._run_ffmpeg(profile, source, destination)
+            duration = await self._verify(profile, source, destination)
+            original_size, size = await asyncio.gather(
+                asyncio.to_thread(os.path.getsize, source), asyncio.to_thread(os.path.getsize, destination)
+            )
+
+            if size >= original_size:
+                TRANSCODING_RESULTS.inc(result="skipped")
+                await self._set_state(record, "skipped", reason=f"{profile.name} output is not smaller")
+                return
+
+            await asyncio.to_thread(os.replace, destination, source)
+        finally:
+            await asyncio.to_thread(_remove, destination)
+
+        seconds = time.monotonic() - started_at
+        STORAGE.resize(source, size)
+        TRANSCODING_SECONDS.observe(seconds, profile=profile.name)
+        TRANSCODED_MEDIA_SECONDS.inc(duration, profile=profile.name)
+        TRANSCODING_SAVED_BYTES.inc(original_size - size, profile=profile.name)
+        TRANSCODING_RESULTS.inc(result="done")
+        record.metadata["size"] = size
+        await self._set_state(
+            record,
+            "done",
+            original_size=original_size,
+            size=size,
+            seconds=round(seconds, 3),
+            speed=round(duration / seconds, 3) if seconds else None,
+        )
+        logger.info(
+            f"Transcoded record {record.record_id} with {profile.name} profile in {seconds:.1f}s: "
+            f"{original_size} -> {size} bytes"
+        )
+
+    async def _run_ffmpeg(self, profile: TranscodingProfile, source: str, destination: str) -> None:
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_PROGRAM,
+            *profile.ffmpeg_args(source, destination, self.threads),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=_lower_priority,
+        )
+
+        try:
+            _, stderr = await process.communicate()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if process.returncode != 0:
+            raise TranscodingError(f"ffmpeg exited with code {process.returncode}: {stderr.decode(errors='replace')}")
+
+    @staticmethod
+    async def _verify(profile: TranscodingProfile, source: str, destination: str) -> float:
+        """check the output has the expected streams and duration. returns the duration"""
+        (source_streams, source_duration), (streams, duration) = await asyncio.gather(
+            describe_file(source), describe_file(destination)
+        )
+        video = [stream for stream in streams if stream.kind == "Video"]
+        expected_codec = ENCODER_CODECS.get(profile.codec)
+
+        if not video or (expected_codec is not None and video[0].codec != expected_codec):
+            raise TranscodingError(f"Output has no {expected_codec or profile.codec} video stream")
+
+        if len(streams) != 1 + sum(stream.kind == "Audio" for stream in source_streams):
+            raise TranscodingError("Output streams do not match the original ones")
+
+        if duration is None or source_duration is None or abs(duration - source_duration) > DURATION_TOLERANCE_SEC:
+            raise TranscodingError(f"Output duration {duration}s differs from the original {source_duration}s")
+
+        return duration
+
+
+TRANSCODER = Transcoder()
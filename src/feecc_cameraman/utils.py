@@ -1,22 +1,25 @@
-import asyncio
-
 from loguru import logger
 
-from .camera import RECORDS
+from .camera import Recording
+from .jobs import start_finalization
+from .metrics import STUCK_RECORDS_REAPED
+from .scheduler import DEADLINES, MAX_RECORD_DURATION_SEC, STUCK_RECORDS_STOP_CONCURRENCY
 
 
-async def end_stuck_records(max_duration: int = 60 * 60, interval: int = 60) -> None:
-    """If record length exceeds the maximum duration it is considered
-    stuck or forgotten and will be stopped. Checked every interval seconds."""
-    logger.info(
-        f"A daemon was started to monitor stuck records. Update interval is {interval}s., "
-        f"max allowed recording duration is {max_duration}s."
-    )
+async def _stop_stuck_record(record: Recording) -> None:
+    if not record.is_ongoing:
+        return
 
-    while True:
-        await asyncio.sleep(interval)
+    await start_finalization(record).wait()
+    STUCK_RECORDS_REAPED.inc(camera=record.camera_number)
+    logger.warning(f"Recording {record.record_id} exceeded its maximum duration and was stopped.")
 
-        for rec_id, rec in RECORDS.items():
-            if rec.is_ongoing and len(rec) >= max_duration:
-                await RECORDS[rec_id].stop()
-                logger.warning(f"Recording {rec_id} exceeded {max_duration} s. and was stopped.")
+
+async def end_stuck_records() -> None:
+    """If record length exceeds its maximum duration it is considered
+    stuck or forgotten and will be stopped right when its deadline passes."""
+    logger.info(
+        f"A daemon was started to monitor stuck records. Default max allowed recording duration is "
+        f"{MAX_RECORD_DURATION_SEC}s., up to {STUCK_RECORDS_STOP_CONCURRENCY} records are stopped concurrently."
+    )
+    await DEADLINES.run(on_deadline=_stop_stuck_record)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import mimetypes
+import os
+import typing as tp
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Message, Receive, Scope, Send
+
+from .output import OUTPUT_MODE
+
+VIDEO_CHUNK_SIZE: int = 256 * 1024
+LIVE_TAIL_POLL_INTERVAL_SEC: float = float(os.getenv("LIVE_TAIL_POLL_INTERVAL_SEC", 0.5))
+ZEROCOPY_EXTENSION: str = "http.response.zerocopysend"
+MEDIA_TYPES: tp.Dict[str, str] = {".mp4": "video/mp4", ".ts": "video/mp2t"}
+LIVE_TAIL_MODES: tp.Tuple[str, ...] = ("fmp4", "mpegts")  # output modes playable while being written
+
+
+def make_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> tp.Optional[tp.Tuple[int, int]]:
+    """
+    parse a single byte range header into inclusive start and end offsets. None means the header is not
+    supported and the whole file should be served. raises ValueError if the range cannot be satisfied
+    """
+    unit, _, ranges = header.partition("=")
+
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} is not satisfiable for {size} bytes")
+
+    return start, end
+
+
+class _FileResponse(Response, abc.ABC):
+    """a response streaming a part of a file. transfer stops as soon as the client disconnects"""
+
+    def __init__(self, path: str, offset: int, status_code: int, headers: tp.Dict[str, str]) -> None:
+        extension = os.path.splitext(path)[1]
+        media_type = MEDIA_TYPES.get(extension) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        file: tp.BinaryIO = await anyio.to_thread.run_sync(open, self.path, "rb")
+
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+            if scope["method"] == "HEAD":
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            async with anyio.create_task_group() as task_group:
+
+                async def stream_and_cancel() -> None:
+                    await self.stream(scope, file, send)
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(stream_and_cancel)
+                await self._wait_for_disconnect(receive)
+                task_group.cancel_scope.cancel()
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while True:
+            message: Message = await receive()
+
+            if message["type"] == "http.disconnect":
+                return
+
+    @abc.abstractmethod
+    async def stream(self, scope: Scope, file: tp.BinaryIO, send: Send) -> None:
+        pass
+
+    @staticmethod
+    async def _read(file: tp.BinaryIO, size: int, offset: int) -> bytes:
+        return await anyio.to_thread.run_sync(os.pread, file.fileno(), size, offset)
+
+
+class FileRangeResponse(_FileResponse):
+    """
+    Serves a byte range of a file. If the server supports the ASGI zero-copy send extension,
+    the file is handed over to it to be sent with sendfile, otherwise it is read in chunks.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: tp.Dict[str, str]) -> None:
+        super().__init__(path, start, status_code, {**headers, "content-length": str(end - start + 1)})
+        self.count = end - start + 1
+
+    async def stream(self, scope: Scope, file: tp.BinaryIO, send: Send) -> None:
+        if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            await send({"type": ZEROCOPY_EXTENSION, "file": file, "offset": self.offset, "count": self.count})
+            return
+
+        offset, remaining = self.offset, self.count
+
+        while remaining > 0:
+            chunk = await self._read(file, min(VIDEO_CHUNK_SIZE, remaining), offset)
+
+            if not chunk:
+                break
+
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        await send({"type": "http.response.body", "body": b""})
+
+
+class LiveTailResponse(_FileResponse):
+    """follows a file being written, sending bytes as they are appended until the writer is done"""
+
+    def __init__(self, path: str, offset: int, is_growing: tp.Callable[[], bool], headers: tp.Dict[str, str]) -> None:
+        super().__init__(path, offset, 200, headers)
+        self.is_growing = is_growing
+
+    async def stream(self, scope: Scope, file: tp.BinaryIO, send: Send) -> None:
+        offset = self.offset
+
+        while True:
+            growing = self.is_growing()
+            chunk = await self._read(file, VIDEO_CHUNK_SIZE, offset)
+
+            if chunk:
+                offset += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            elif growing:
+                await asyncio.sleep(LIVE_TAIL_POLL_INTERVAL_SEC)
+            else:
+                break
+
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def serve_video(path: str, request: Request, is_growing: tp.Callable[[], bool], live: bool = False) -> Response:
+    """
+    Respond with a video file honoring Range, If-Range, If-None-Match and If-Modified-Since headers.
+    Files still being written are served as of the request time and not cached, unless live is set:
+    then the response follows the file until the recording is over. Live is refused with 409 in the plain
+    mp4 output mode, as such files only become playable once ffmpeg finalizes them.
+    """
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return Response(status_code=404, content="Video file of the recording is not available")
+
+    growing = is_growing()
+
+    if live and growing and OUTPUT_MODE not in LIVE_TAIL_MODES:
+        return Response(
+            status_code=409,
+            content=f"Live tail is not available in the {OUTPUT_MODE} output mode, use {' or '.join(LIVE_TAIL_MODES)}",
+        )
+
+    if live and growing:
+        headers = {"cache-control": "no-store", "x-accel-buffering": "no"}
+        return LiveTailResponse(path, offset=0, is_growing=is_growing, headers=headers)
+
+    size, etag = stat.st_size, make_etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {"accept-ranges": "bytes"}
+
+    if growing:
+        headers["cache-control"] = "no-store"
+    else:
+        headers.update({"etag": etag, "last-modified": last_modified})
+
+        if _is_not_modified(request, etag, stat.st_mtime):
+            return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+
+    if range_header and (if_range is None or if_range in (etag, last_modified)) and size:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return FileRangeResponse(path, start, end, status_code=206, headers=headers)
+
+    return FileRangeResponse(path, 0, size - 1, status_code=200, headers=headers)
+
+
+def _is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_modified_since is not None:
+        try:
+            return bool(int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+
+    return False
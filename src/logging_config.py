@@ -1,25 +1,82 @@
+import os
 import sys
+import time
+import typing as tp
+
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "DEBUG")
+LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")  # text or json
+LOG_ENQUEUE: bool = os.getenv("LOG_ENQUEUE", "false").lower() in ("1", "true", "yes")
+LOG_DIAGNOSE: bool = os.getenv("LOG_DIAGNOSE", "true").lower() not in ("false", "0", "no")
+LOG_SAMPLE_INTERVAL_SEC: float = float(os.getenv("LOG_SAMPLE_INTERVAL_SEC", 0))
+LOG_SAMPLE_MAX_SITES: int = 10000  # sampled messages remembered before the stale ones are forgotten
+
+TEXT_FORMAT: str = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[trace_id]} | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>\n{exception}"
+)
+
+
+class RepeatSampler:
+    """
+    A log filter letting through a single message per call site, message text and interval, so that messages
+    repeated in a loop, e.g. about an unreachable camera, do not flood the logs. Warnings and errors are never dropped.
+    The number of suppressed messages is added to the next one passed as the 'suppressed' extra field.
+    """
+
+    def __init__(self, interval: float = LOG_SAMPLE_INTERVAL_SEC) -> None:
+        self.interval = interval
+        self._sites: tp.Dict[tp.Tuple[str, int, str], tp.List[float]] = {}  # call site: [last passed at, suppressed]
+
+    def __call__(self, record: tp.Dict[str, tp.Any]) -> bool:
+        # the record is shared by all the sinks, so its extra is replaced rather than updated to keep counts apart
+        if "suppressed" in record["extra"]:
+            record["extra"] = {key: value for key, value in record["extra"].items() if key != "suppressed"}
+
+        if not self.interval or record["level"].no >= 30:  # WARNING
+            return True
+
+        site = (record["name"], record["line"], record["message"])
+        now = time.monotonic()
+        state = self._sites.get(site)
+
+        if state is not None and now - state[0] < self.interval:
+            state[1] += 1
+            return False
+
+        if state is not None and state[1]:
+            record["extra"] = {**record["extra"], "suppressed": int(state[1])}
+
+        if len(self._sites) >= LOG_SAMPLE_MAX_SITES:
+            self._sites = {key: value for key, value in self._sites.items() if now - value[0] < self.interval}
+
+        self._sites[site] = [now, 0]
+        return True
+
 
 # set up logging configurations
-BASE_LOGGING_CONFIG = {
-    "colorize": True,
-    "backtrace": True,
-    "diagnose": True,
+BASE_LOGGING_CONFIG: tp.Dict[str, tp.Any] = {
+    "backtrace": LOG_DIAGNOSE,
+    "diagnose": LOG_DIAGNOSE,
     "catch": True,
+    "level": LOG_LEVEL,
+    "enqueue": LOG_ENQUEUE,
+    "format": TEXT_FORMAT,
+    "serialize": LOG_FORMAT == "json",  # a JSON object per line, with the trace id and other context in "extra"
 }
 
 # logging settings for the console logs
 CONSOLE_LOGGING_CONFIG = {
-    **BASE_LOGGING_CONFIG,  # type: ignore
-    "level": "DEBUG",
+    **BASE_LOGGING_CONFIG,
+    "colorize": LOG_FORMAT != "json",
     "sink": sys.stdout,
+    "filter": RepeatSampler(),
 }
 
 # logging settings for the log file
 FILE_LOGGING_CONFIG = {
-    **BASE_LOGGING_CONFIG,  # type: ignore
-    "level": "DEBUG",
+    **BASE_LOGGING_CONFIG,
     "sink": "feecc-cameraman.log",
     "rotation": "10 MB",
     "compression": "zip",
+    "filter": RepeatSampler(),
 }
@@ -0,0 +1,141 @@
+import asyncio
+import typing as tp
+
+import pytest
+
+from auth.cache import EmployeeCache
+from auth.database import MongoDbWrapper
+
+EMPLOYEE = {"rfid_card_id": "42", "name": "John Doe", "position": "Assembler"}
+
+
+class InMemoryCollection:
+    """a stand-in for the Motor collection used by MongoDbWrapper"""
+
+    def __init__(self, documents: tp.List[tp.Dict[str, str]], delay: float = 0) -> None:
+        self.documents = documents
+        self.delay = delay
+        self.queries = 0
+
+    async def find_one(self, query: tp.Dict[str, str], projection: tp.Dict[str, int]) -> tp.Optional[tp.Dict[str, str]]:
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        key, value = next(iter(query.items()))
+        return next((dict(doc) for doc in self.documents if doc.get(key) == value), None)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def get_cache(collection: InMemoryCollection, **kwargs: tp.Any) -> EmployeeCache:
+    wrapper = MongoDbWrapper()
+    wrapper._employee_collection = collection
+    return EmployeeCache(loader=wrapper.get_concrete_employee, **kwargs)
+
+
+def test_hits_and_ttl() -> None:
+    collection, clock = InMemoryCollection([EMPLOYEE]), FakeClock()
+    cache = get_cache(collection, ttl=10, clock=clock)
+
+    async def scenario() -> None:
+        assert (await cache.get("42")).name == "John Doe"
+        await cache.get("42")
+        assert collection.queries == 1
+        clock.now = 11
+        await cache.get("42")
+        assert collection.queries == 2
+
+    asyncio.run(scenario())
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_negative_cache() -> None:
+    collection, clock = InMemoryCollection([]), FakeClock()
+    cache = get_cache(collection, negative_ttl=5, clock=clock)
+
+    async def scenario() -> None:
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await cache.get("13")
+
+        assert collection.queries == 1
+        clock.now = 6
+        collection.documents.append({**EMPLOYEE, "rfid_card_id": "13"})
+        assert (await cache.get("13")).rfid_card_id == "13"
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_lookups_share_a_query() -> None:
+    collection = InMemoryCollection([EMPLOYEE], delay=0.05)
+    cache = get_cache(collection)
+
+    async def scenario() -> None:
+        employees = await asyncio.gather(*(cache.get("42") for _ in range(10)))
+        assert all(employee.name == "John Doe" for employee in employees)
+
+    asyncio.run(scenario())
+    assert collection.queries == 1
+
+
+def test_lru_eviction_and_invalidation() -> None:
+    collection = InMemoryCollection([{**EMPLOYEE, "rfid_card_id": str(i)} for i in range(3)])
+    cache = get_cache(collection, max_size=2)
+
+    async def scenario() -> None:
+        for card_id in ("0", "1", "0", "2"):
+            await cache.get(card_id)
+
+        assert len(cache) == 2 and cache.evictions == 1
+        await cache.get("0")
+        assert collection.queries == 3
+        cache.invalidate("0")
+        await cache.get("0")
+        assert collection.queries == 4
+
+    asyncio.run(scenario())
+
+
+def test_lookup_in_flight_is_not_cached_after_invalidation() -> None:
+    collection = InMemoryCollection([EMPLOYEE], delay=0.05)
+    cache = get_cache(collection)
+
+    async def scenario() -> None:
+        lookup = asyncio.create_task(cache.get("42"))
+        await asyncio.sleep(0.01)
+        cache.invalidate("42")  # the card is revoked while the lookup runs
+        await lookup
+        await cache.get("42")
+
+    asyncio.run(scenario())
+    assert collection.queries == 2
+
+
+def test_invalidation_endpoint(monkeypatch) -> None:
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+    from auth.dependencies import authenticate
+
+    collection = InMemoryCollection([{**EMPLOYEE, "rfid_card_id": str(i)} for i in range(3)])
+    cache = get_cache(collection)
+    monkeypatch.setattr(app_module, "EMPLOYEE_CACHE", cache)
+    monkeypatch.setitem(app_module.app.dependency_overrides, authenticate, lambda: None)
+    client = TestClient(app_module.app)
+
+    async def fill() -> None:
+        for card_id in ("0", "1", "2"):
+            await cache.get(card_id)
+
+    asyncio.run(fill())
+    response = client.post("/auth/cache/invalidate", params={"card_id": "1"})
+    assert response.status_code == 200 and response.json()["status"] == 200
+    assert len(cache) == 2
+
+    response = client.post("/auth/cache/invalidate")
+    assert response.status_code == 200 and len(cache) == 0
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime
+
+from feecc_cameraman.batch import discard_recording, get_group_records, start_batch, stop_batch
+from feecc_cameraman.camera import Camera, Recording
+from feecc_cameraman.store import RECORDS
+
+
+def fake_recordings(monkeypatch) -> None:
+    cameras = {number: Camera(number, f"127.0.0.1:{number}", f"rtsp://{number}") for number in (1, 2, 3)}
+    monkeypatch.setattr("feecc_cameraman.batch.CAMERAS", cameras)
+
+    async def is_camera_up(camera: Camera) -> bool:
+        return camera.number != 3
+
+    async def admit(camera_number: int, max_duration: float) -> None:
+        pass
+
+    async def start(self: Recording) -> None:
+        self.start_time = datetime.now()
+
+    monkeypatch.setattr("feecc_cameraman.batch.is_camera_up", is_camera_up)
+    monkeypatch.setattr("feecc_cameraman.batch.STORAGE.admit", admit)
+    monkeypatch.setattr(Recording, "start", start)
+
+
+def test_atomic_batch_rolls_back_started_recordings(monkeypatch) -> None:
+    fake_recordings(monkeypatch)
+
+    async def scenario() -> None:
+        results = await start_batch([1, 2, 3], "group", {}, atomic=True)
+
+        assert [result.status for result in results] == [424, 424, 500]
+        assert not RECORDS.values() and not get_group_records("group")
+
+    asyncio.run(scenario())
+
+
+def test_batch_recordings_are_grouped(monkeypatch) -> None:
+    fake_recordings(monkeypatch)
+
+    async def scenario() -> None:
+        results = await start_batch([1, 2, 3, 404, 1], "group", {})
+
+        assert [(result.camera_number, result.status) for result in results] == [
+            (1, 200),
+            (2, 200),
+            (3, 500),
+            (404, 404),
+        ]
+        assert get_group_records("group") == [results[0].record_id, results[1].record_id]
+        assert all(record.metadata["group_id"] == "group" for record in RECORDS.values())
+        assert [result.status for result in await stop_batch(["unknown"], {})] == [404]
+
+        for record in RECORDS.values():
+            await discard_recording(record)
+
+    asyncio.run(scenario())
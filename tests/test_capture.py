@@ -0,0 +1,93 @@
+import asyncio
+
+from loguru import logger
+
+from feecc_cameraman.camera import CapturePart, Recording, get_gaps
+
+# a fake ffmpeg reporting a second of video into every part, the first two of which break
+FAKE_FFMPEG = (
+    'touch "$0"; echo frame=25; echo out_time_us=1000000; case "$0" in *part2*) read q; exit 0;; *) exit 1;; esac'
+)
+
+
+def test_gaps_are_positioned_in_joined_video() -> None:
+    parts = [
+        CapturePart("a.mp4", 100.0, 101.0, 110.0, 9.0, "ffmpeg stalled for 15s"),
+        CapturePart("a.part1.mp4", 126.0, None, None, 0.0, "ffmpeg exited with code 1"),  # a failed attempt
+        CapturePart("a.part2.mp4", 130.0, 131.0, 140.0, 9.5, "ffmpeg exited with code 1"),
+    ]
+
+    assert get_gaps(parts, end_time=150.0) == [
+        {"position": 9.0, "started_at": 110.0, "ended_at": 131.0, "duration": 21.0, "reason": "ffmpeg stalled for 15s"},
+        {
+            "position": 18.5,
+            "started_at": 140.0,
+            "ended_at": 150.0,
+            "duration": 10.0,
+            "reason": "ffmpeg exited with code 1",
+        },
+    ]
+    assert get_gaps(parts[:1]) == [
+        {"position": 9.0, "started_at": 110.0, "ended_at": None, "duration": None, "reason": "ffmpeg stalled for 15s"}
+    ]
+
+
+def test_broken_capture_is_restarted_and_joined(tmp_path, monkeypatch) -> None:
+    joined = []
+
+    async def join_parts(parts, destination: str) -> None:
+        joined.extend(parts)
+
+    monkeypatch.setattr(
+        "feecc_cameraman.camera.build_ffmpeg_argv", lambda link, filename, args: ["sh", "-c", FAKE_FFMPEG, filename]
+    )
+    monkeypatch.setattr("feecc_cameraman.camera.join_parts", join_parts)
+    monkeypatch.setattr("feecc_cameraman.camera.CAPTURE_RESTART_BACKOFF_SEC", 0.01)
+    monkeypatch.setattr("feecc_cameraman.camera.CAPTURE_CHECK_INTERVAL_SEC", 0.01)
+    monkeypatch.setattr("feecc_cameraman.camera.MINIMAL_RECORD_DURATION_SEC", 0)
+    record = Recording(rtsp_steam="rtsp://camera", filename=str(tmp_path / "record.mp4"))
+
+    async def scenario() -> None:
+        await record.start()
+
+        while len(record._parts) < 3 or record._parts[-1].first_frame_at is None:
+            await asyncio.sleep(0.01)
+
+        assert record.current_capture_filename == str(tmp_path / "record.part2.mp4")
+        await record.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    assert joined == [str(tmp_path / name) for name in ("record.mp4", "record.part1.mp4", "record.part2.mp4")]
+    assert [gap["position"] for gap in record.metadata["gaps"]] == [1.0, 2.0]
+    assert record.metadata["gaps"][0]["reason"] == "ffmpeg exited with code 1"
+    assert record.captured_seconds == 3.0
+    assert [path.name for path in tmp_path.iterdir()] == ["record.mp4"]
+
+
+def test_supervisor_crash_is_logged(tmp_path, monkeypatch) -> None:
+    messages = []
+    sink = logger.add(lambda message: messages.append(message), level="ERROR")
+
+    async def watch(self, process, part):
+        raise RuntimeError("watch failed")
+
+    monkeypatch.setattr(
+        "feecc_cameraman.camera.build_ffmpeg_argv", lambda link, filename, args: ["sh", "-c", FAKE_FFMPEG, filename]
+    )
+    monkeypatch.setattr("feecc_cameraman.camera.join_parts", lambda parts, destination: asyncio.sleep(0))
+    monkeypatch.setattr(Recording, "_watch", watch)
+    record = Recording(rtsp_steam="rtsp://camera", filename=str(tmp_path / "record.part2.mp4"))
+
+    async def scenario() -> None:
+        await record.start()
+        assert record._supervisor is not None
+        await asyncio.wait({record._supervisor})
+        await record.stop()
+
+    try:
+        asyncio.run(asyncio.wait_for(scenario(), 10))
+    finally:
+        logger.remove(sink)
+
+    assert any("Capture supervisor crashed" in message and "watch failed" in message for message in messages)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from feecc_cameraman.video import serve_video
+
+CONTENT = bytes(range(256)) * 4000
+
+
+def get_client(path: str, is_growing=lambda: False) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/video")
+    async def video(request: Request, live: bool = False):  # type: ignore
+        return await serve_video(path, request, is_growing=is_growing, live=live)
+
+    return TestClient(app)
+
+
+def test_ranges(tmp_path) -> None:
+    video = tmp_path / "video.mp4"
+    video.write_bytes(CONTENT)
+    client = get_client(str(video))
+
+    full = client.get("/video")
+    assert full.status_code == 200 and full.content == CONTENT
+    assert full.headers["accept-ranges"] == "bytes" and full.headers["content-type"] == "video/mp4"
+
+    part = client.get("/video", headers={"range": "bytes=100-299999"})
+    assert part.status_code == 206 and part.content == CONTENT[100:300000]
+    assert part.headers["content-range"] == f"bytes 100-299999/{len(CONTENT)}"
+
+    suffix = client.get("/video", headers={"range": "bytes=-10"})
+    assert suffix.status_code == 206 and suffix.content == CONTENT[-10:]
+
+    open_ended = client.get("/video", headers={"range": f"bytes={len(CONTENT) - 5}-"})
+    assert open_ended.content == CONTENT[-5:]
+
+    unsatisfiable = client.get("/video", headers={"range": f"bytes={len(CONTENT)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_conditional_requests(tmp_path) -> None:
+    video = tmp_path / "video.mp4"
+    video.write_bytes(CONTENT)
+    client = get_client(str(video))
+    etag = client.get("/video").headers["etag"]
+
+    assert client.get("/video", headers={"if-none-match": etag}).status_code == 304
+    assert client.get("/video", headers={"range": "bytes=0-9", "if-range": etag}).status_code == 206
+    assert client.get("/video", headers={"range": "bytes=0-9", "if-range": '"stale"'}).status_code == 200
+
+    video.write_bytes(CONTENT[:10])
+    assert client.get("/video", headers={"if-none-match": etag}).status_code == 200
+
+
+def test_live_tail_follows_the_file_until_recording_is_over(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.video.OUTPUT_MODE", "mpegts")
+    video = tmp_path / "video.ts"
+    video.write_bytes(b"")
+    recording = threading.Event()
+    recording.set()
+    client = get_client(str(video), is_growing=recording.is_set)
+
+    def write() -> None:
+        with open(video, "ab") as f:
+            for offset in range(0, len(CONTENT), 100000):
+                f.write(CONTENT[offset : offset + 100000])
+                f.flush()
+                time.sleep(0.1)
+
+        recording.clear()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    response = client.get("/video", params={"live": True})
+    writer.join()
+
+    assert response.status_code == 200 and response.content == CONTENT
+    assert response.headers["content-type"] == "video/mp2t"
+
+
+def test_live_tail_is_refused_for_plain_mp4(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.video.OUTPUT_MODE", "mp4")
+    video = tmp_path / "video.mp4"
+    video.write_bytes(CONTENT)
+    client = get_client(str(video), is_growing=lambda: True)
+
+    assert client.get("/video", params={"live": True}).status_code == 409
+    assert client.get("/video").content == CONTENT
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import typing as tp
+
+from feecc_cameraman.events import EventBus
+
+
+def parse(message: str) -> tp.Tuple[str, tp.Dict[str, tp.Any]]:
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return fields["event"], json.loads(fields["data"])
+
+
+def test_stream_resumes_after_the_last_seen_event() -> None:
+    async def scenario() -> None:
+        bus = EventBus("worker", history=3)
+
+        for number in range(5):
+            bus.publish("camera_up", camera_number=number)
+
+        stream = bus.stream(f"worker:{bus.seq - 2}")
+        assert [parse(await stream.__anext__())[1]["camera_number"] for _ in range(2)] == [3, 4]
+
+        bus.publish("record_progress", volatile=True, record_id="a")
+        event, data = parse(await stream.__anext__())
+        assert event == "record_progress" and data["seq"] is None
+        await stream.aclose()
+        assert not bus.has_subscribers
+
+        event, _ = parse(await bus.stream(f"worker:{bus.seq - 4}").__anext__())  # older than the history
+        assert event == "resync"
+
+    asyncio.run(scenario())
+
+
+def test_lagging_subscriber_catches_up_from_history(monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.events.EVENT_SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def scenario() -> None:
+        bus = EventBus("worker", history=10)
+        stream = bus.stream()
+        first = asyncio.create_task(stream.__anext__())
+        await asyncio.sleep(0)
+
+        for number in range(6):
+            bus.publish("camera_down", camera_number=number)  # never blocks on the slow subscriber
+
+        received = [parse(await first)[1]["camera_number"]]
+        received += [parse(await stream.__anext__())[1]["camera_number"] for _ in range(5)]
+        assert received == list(range(6))
+        await stream.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_event_ids_of_another_worker_are_not_resumed_from() -> None:
+    async def scenario() -> None:
+        bus = EventBus("first", history=10)
+        bus.publish("camera_up", camera_number=1)
+        message = await bus.stream(f"first:{bus.seq - 1}").__anext__()
+        assert message.startswith(f"id: first:{bus.seq}\n")
+
+        for foreign in (f"second:{bus.seq - 1}", str(bus.seq - 1), "first:garbage"):
+            event, data = parse(await bus.stream(foreign).__anext__())
+            assert event == "resync" and "first" in data["reason"]
+
+    asyncio.run(scenario())
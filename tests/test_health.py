@@ -0,0 +1,76 @@
+import asyncio
+
+from feecc_cameraman.camera import Camera
+from feecc_cameraman.health import (
+    MAX_PROBE_BACKOFF_SEC,
+    PROBE_INTERVAL_SEC,
+    CameraHealth,
+    get_health,
+    is_camera_up,
+    probe_cameras,
+)
+
+
+def test_probe_backoff_grows_while_camera_is_down() -> None:
+    health = CameraHealth()
+    backoffs = []
+
+    for _ in range(10):
+        health.register_probe(None)
+        backoffs.append(health.backoff)
+
+    assert backoffs[:3] == [PROBE_INTERVAL_SEC, PROBE_INTERVAL_SEC * 2, PROBE_INTERVAL_SEC * 4]
+    assert backoffs[-1] == MAX_PROBE_BACKOFF_SEC and not health.is_up
+
+    health.register_probe(0.01)
+    assert health.is_up and health.consecutive_failures == 0 and health.backoff == PROBE_INTERVAL_SEC
+
+
+def test_camera_known_to_be_up_is_not_probed_live(monkeypatch) -> None:
+    camera = Camera(1001, "127.0.0.1:1", "rtsp://camera")
+    probes = []
+
+    async def probe(self, timeout: float = 0.25):
+        probes.append(self.number)
+        return 0.01
+
+    monkeypatch.setattr(Camera, "probe", probe)
+    monkeypatch.setattr("feecc_cameraman.health.HEALTH", {})
+
+    assert asyncio.run(is_camera_up(camera))
+    assert probes == [1001]
+    assert asyncio.run(is_camera_up(camera))
+    assert probes == [1001]
+
+
+def test_camera_down_is_probed_live(monkeypatch) -> None:
+    camera = Camera(1002, "127.0.0.1:1", "rtsp://camera")
+    monkeypatch.setattr("feecc_cameraman.health.HEALTH", {1002: CameraHealth(is_up=False)})
+
+    async def probe(self, timeout: float = 0.25):
+        return None
+
+    monkeypatch.setattr(Camera, "probe", probe)
+    assert not asyncio.run(is_camera_up(camera))
+    assert get_health(camera).consecutive_failures == 1
+
+
+def test_failing_probe_does_not_affect_other_cameras(monkeypatch) -> None:
+    good, bad = Camera(1003, "127.0.0.1:1", "rtsp://good"), Camera(1004, "127.0.0.1", "rtsp://bad")
+    monkeypatch.setattr("feecc_cameraman.health.HEALTH", {})
+
+    async def probe(self, timeout: float = 0.25):
+        if self is bad:
+            raise RuntimeError("probe crashed")
+
+        return 0.01
+
+    monkeypatch.setattr(Camera, "probe", probe)
+    asyncio.run(probe_cameras([bad, good]))
+
+    assert get_health(good).is_up
+    assert not get_health(bad).is_up and get_health(bad).consecutive_failures == 1
+
+
+def test_invalid_socket_address_is_reported_as_unreachable() -> None:
+    assert asyncio.run(Camera(1005, "127.0.0.1", "rtsp://camera").probe()) is None
@@ -0,0 +1,77 @@
+import asyncio
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.idle import concat_list, kept_intervals, parse_idle_runs, parse_keyframes, trim_idle
+from feecc_cameraman.store import RecordStore
+from feecc_cameraman.streaminfo import StreamParams
+
+FREEZEDETECT_OUTPUT = """frame:80   pts:80      pts_time:40
+lavfi.freezedetect.freeze_start=10
+frame:100  pts:100     pts_time:50
+lavfi.freezedetect.freeze_duration=40
+lavfi.freezedetect.freeze_end=50
+frame:500  pts:500     pts_time:250
+lavfi.freezedetect.freeze_start=220.5
+"""
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0, 14.0, 46.0, 48.0, 50.0, 218.0, 222.0]
+
+
+def test_idle_runs_are_parsed_with_an_open_run_lasting_until_the_end() -> None:
+    assert parse_idle_runs(FREEZEDETECT_OUTPUT, 300.0) == [(10.0, 50.0), (220.5, 300.0)]
+    assert parse_keyframes("[Parsed_showinfo_0] n:0 pts:0 pts_time:0 \nn:1 pts:256 pts_time:2.5 ") == [0.0, 2.5]
+
+
+def test_kept_intervals_are_padded_and_start_at_keyframes() -> None:
+    kept = kept_intervals([(10.0, 50.0), (220.5, 300.0), (100.0, 110.0)], 300.0, KEYFRAMES, padding=2, min_duration=30)
+
+    assert kept == [(0.0, 12.0), (48.0, 222.5)]
+
+
+def test_overlapping_kept_intervals_are_merged() -> None:
+    kept = kept_intervals([(10.0, 50.0), (52.0, 100.0)], 120.0, [0.0, 40.0, 50.0], padding=2, min_duration=30)
+
+    assert kept == [(0.0, 12.0), (40.0, 120.0)]
+    assert "outpoint 12.000\nfile '/videos/a.mp4'\ninpoint 40.000" in concat_list("/videos/a.mp4", kept)
+
+
+def test_recording_is_replaced_with_trimmed_one(tmp_path, monkeypatch) -> None:
+    store = RecordStore(str(tmp_path / "records.db"))
+    video = tmp_path / "record.mp4"
+    video.write_bytes(b"original" * 1000)
+    record = Recording(rtsp_steam="rtsp://camera", record_id="record", filename=str(video), camera_number=1)
+    record.metadata["gaps"] = [{"position": 5.0, "reason": "exited"}, {"position": 100.0}, {"position": 160.5}]
+
+    async def find_idle_runs(filename, duration, threads, preexec_fn=None):
+        return [(10.0, 150.0)]
+
+    async def find_keyframes(filename, threads, preexec_fn=None):
+        return [0.0, 10.0, 146.0, 148.0]
+
+    async def run_ffmpeg(*args, preexec_fn=None):
+        with open(args[-1], "wb") as f:
+            f.write(b"trimmed")
+
+        return "", ""
+
+    async def describe_file(filename: str):
+        return (StreamParams("Video", "h264", "1280x720"),), 200.0 if filename == str(video) else 64.1
+
+    monkeypatch.setattr("feecc_cameraman.idle.RECORDS", store)
+    monkeypatch.setattr("feecc_cameraman.idle.IDLE_TRIMMING_CAMERAS", [1])
+    monkeypatch.setattr("feecc_cameraman.idle.find_idle_runs", find_idle_runs)
+    monkeypatch.setattr("feecc_cameraman.idle.find_keyframes", find_keyframes)
+    monkeypatch.setattr("feecc_cameraman.idle._run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr("feecc_cameraman.idle.describe_file", describe_file)
+
+    async def scenario() -> None:
+        await store.archive(record)
+        await trim_idle(record, threads=1)
+
+    asyncio.run(scenario())
+
+    assert video.read_bytes() == b"trimmed"
+    assert record.metadata["idle_trimming"]["state"] == "done"
+    assert record.metadata["idle_trimming"]["kept"] == [[0.0, 12.0], [148.0, 200.0]]
+    assert record.metadata["duration"] == 64.1
+    assert record.metadata["gaps"] == [{"position": 5.0, "reason": "exited"}, {"position": 12.0}, {"position": 24.5}]
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".mp4"] == ["record.mp4"]
@@ -0,0 +1,94 @@
+import asyncio
+
+from feecc_cameraman.ingest import INGESTS, attach_to_ingest, detach_from_ingest
+
+UPSTREAM = "while :; do head -c 16384 /dev/zero; sleep 0.01; done"
+
+
+def _fake_ffmpeg(monkeypatch, output_script: str, upstream_script: str = UPSTREAM) -> None:
+    """run shell scripts in place of the upstream and the output ffmpeg. the output file is $0 of the script"""
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def spawn(program, *args, **kwargs):
+        if "pipe:0" in args:
+            return await create_subprocess_exec("sh", "-c", output_script, args[-1], **kwargs)
+
+        return await create_subprocess_exec("sh", "-c", upstream_script, **kwargs)
+
+    monkeypatch.setattr("feecc_cameraman.ingest.asyncio.create_subprocess_exec", spawn)
+
+
+async def _wait_for(condition, timeout: float = 5) -> None:
+    async def poll() -> None:
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_stream_is_fanned_out_to_every_output(tmp_path, monkeypatch) -> None:
+    _fake_ffmpeg(monkeypatch, 'cat > "$0"')
+    first, second = tmp_path / "first.mp4", tmp_path / "second.mp4"
+
+    async def scenario() -> None:
+        ingest = await attach_to_ingest(1, "rtsp://camera", "first", str(first))
+        assert await attach_to_ingest(1, "rtsp://camera", "second", str(second)) is ingest
+        await _wait_for(lambda: first.exists() and second.exists() and second.stat().st_size > 0)
+
+        assert await detach_from_ingest(ingest, "first") == 0
+        assert ingest.process_count == 2 and INGESTS[1] is ingest
+
+        size = second.stat().st_size
+        await _wait_for(lambda: second.stat().st_size > size)
+        assert await detach_from_ingest(ingest, "second") == 0
+        assert ingest.process_count == 0 and 1 not in INGESTS
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    assert first.stat().st_size > 0
+
+
+def test_chunks_are_dropped_for_lagging_output(tmp_path, monkeypatch) -> None:
+    _fake_ffmpeg(monkeypatch, "sleep 1; cat > /dev/null")
+    monkeypatch.setattr("feecc_cameraman.ingest.INGEST_OUTPUT_QUEUE_SIZE", 2)
+
+    async def scenario() -> None:
+        ingest = await attach_to_ingest(2, "rtsp://camera", "lagging", str(tmp_path / "lagging.mp4"))
+        output = ingest._outputs["lagging"]
+        await _wait_for(lambda: output.dropped_chunks > 0)
+
+        assert await detach_from_ingest(ingest, "lagging") == 0
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_output_exiting_mid_recording_does_not_block_stop(tmp_path, monkeypatch) -> None:
+    _fake_ffmpeg(monkeypatch, "head -c 100 > /dev/null; exit 3")
+    monkeypatch.setattr("feecc_cameraman.ingest.INGEST_OUTPUT_QUEUE_SIZE", 2)
+
+    async def scenario() -> None:
+        ingest = await attach_to_ingest(3, "rtsp://camera", "broken", str(tmp_path / "broken.mp4"))
+        output = ingest._outputs["broken"]
+        await _wait_for(lambda: output.process.returncode is not None)
+        await asyncio.sleep(0.1)  # let the upstream fill the queue nobody drains anymore
+
+        assert await detach_from_ingest(ingest, "broken") == 3
+        assert output.writer is not None and output.writer.done()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_changed_stream_gets_a_new_ingest(tmp_path, monkeypatch) -> None:
+    _fake_ffmpeg(monkeypatch, 'cat > "$0"')
+
+    async def scenario() -> None:
+        old = await attach_to_ingest(4, "rtsp://old", "old", str(tmp_path / "old.mp4"))
+        new = await attach_to_ingest(4, "rtsp://new", "new", str(tmp_path / "new.mp4"))
+        assert new is not old and new.rtsp_stream_link == "rtsp://new" and INGESTS[4] is new
+
+        assert await detach_from_ingest(old, "old") == 0
+        assert INGESTS[4] is new  # the recording of the old stream does not drop the new ingest
+
+        assert await detach_from_ingest(new, "new") == 0
+        assert 4 not in INGESTS
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
@@ -0,0 +1,87 @@
+import asyncio
+
+import requests
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.jobs import JobState, start_finalization
+from feecc_cameraman.storage import StorageManager
+from feecc_cameraman.store import RecordStore
+
+
+def fake_finalization(tmp_path, monkeypatch, stop_error=None) -> list:
+    """stub out recording stop and processing. returns the list the callbacks and submissions are logged into"""
+    calls: list = []
+
+    async def stop(self, on_finalizing=lambda: None) -> None:
+        on_finalizing()
+
+        if stop_error is not None:
+            raise stop_error
+
+        with open(str(self.filename), "wb") as f:
+            f.write(b"video" * 100)
+
+    async def submit(record: Recording) -> None:
+        calls.append(("submitted", record.record_id))
+
+    def post(url: str, json: dict, timeout: float) -> requests.Response:
+        calls.append(("callback", url, json["state"]))
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(Recording, "stop", stop)
+    monkeypatch.setattr("feecc_cameraman.jobs.RECORDS", RecordStore(str(tmp_path / "records.db")))
+    monkeypatch.setattr("feecc_cameraman.jobs.STORAGE", StorageManager(directory=str(tmp_path)))
+    monkeypatch.setattr("feecc_cameraman.jobs.POSTPROCESSOR.submit", submit)
+    monkeypatch.setattr("feecc_cameraman.jobs.requests.post", post)
+    return calls
+
+
+def test_finished_recording_is_archived_and_handed_over(tmp_path, monkeypatch) -> None:
+    calls = fake_finalization(tmp_path, monkeypatch)
+    record = Recording("rtsp://camera", record_id="done", filename=str(tmp_path / "done.mp4"))
+
+    async def scenario() -> None:
+        job = start_finalization(record, callback_url="http://callback")
+        await job.wait()
+        await asyncio.sleep(0)  # the hand-over to processing is detached from the job
+
+        assert job.state == JobState.DONE and job.size == 500 and job.finished_at is not None
+        assert record.metadata["size"] == 500
+
+    asyncio.run(scenario())
+    assert set(calls) == {("callback", "http://callback", JobState.DONE), ("submitted", "done")}
+
+
+def test_failed_stop_is_reported(tmp_path, monkeypatch) -> None:
+    calls = fake_finalization(tmp_path, monkeypatch, stop_error=RuntimeError("ffmpeg exited with code 1"))
+    record = Recording("rtsp://camera", record_id="failed", filename=str(tmp_path / "failed.mp4"))
+
+    async def scenario() -> None:
+        job = start_finalization(record, callback_url="http://callback")
+        await job.wait()
+
+        assert job.state == JobState.FAILED and job.error == "ffmpeg exited with code 1"
+        assert record.error == job.error and record.end_time is not None
+
+    asyncio.run(scenario())
+    assert calls == [("callback", "http://callback", JobState.FAILED)]
+
+
+def test_callback_is_sent_when_archiving_fails(tmp_path, monkeypatch) -> None:
+    calls = fake_finalization(tmp_path, monkeypatch)
+    record = Recording("rtsp://camera", record_id="unarchived", filename=str(tmp_path / "unarchived.mp4"))
+
+    async def archive(record: Recording) -> None:
+        raise OSError("database is locked")
+
+    monkeypatch.setattr("feecc_cameraman.jobs.RECORDS.archive", archive)
+
+    async def scenario() -> None:
+        job = start_finalization(record, callback_url="http://callback")
+        await job.wait()
+        assert job.is_finished
+
+    asyncio.run(scenario())
+    assert calls == [("callback", "http://callback", JobState.DONE)]
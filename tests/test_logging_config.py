@@ -0,0 +1,32 @@
+import time
+
+from loguru import logger
+
+from logging_config import RepeatSampler
+
+
+def _log(message: str) -> None:
+    logger.debug(message)
+
+
+def test_repeated_messages_are_sampled_per_sink() -> None:
+    sampled, unsampled = [], []
+    sinks = [
+        logger.add(lambda m: sampled.append((m.record["message"], m.record["extra"].get("suppressed"))),
+                   filter=RepeatSampler(interval=0.2)),
+        logger.add(lambda m: unsampled.append(m.record["extra"].get("suppressed")), filter=RepeatSampler(interval=0)),
+    ]  # fmt: skip
+
+    try:
+        for _ in range(3):
+            _log("camera 1 is down")
+
+        _log("camera 2 is down")  # another message from the same place is not a repeat
+        time.sleep(0.3)
+        _log("camera 1 is down")
+    finally:
+        for sink in sinks:
+            logger.remove(sink)
+
+    assert sampled == [("camera 1 is down", None), ("camera 2 is down", None), ("camera 1 is down", 2)]
+    assert unsampled == [None] * 5  # the count of the sampled sink does not leak into the other one
@@ -0,0 +1,43 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from feecc_cameraman import metrics
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    histogram = metrics.Histogram("test_seconds", "A test histogram", ["camera"], buckets=(0.1, 1))
+    metrics.REGISTRY.remove(histogram)
+
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, camera=1)
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_seconds A test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{camera="1",le="0.1"} 2',
+        'test_seconds_bucket{camera="1",le="1"} 3',
+        'test_seconds_bucket{camera="1",le="+Inf"} 4',
+        'test_seconds_sum{camera="1"} 5.65',
+        'test_seconds_count{camera="1"} 4',
+    ]
+
+
+def test_requests_are_labelled_with_route_templates() -> None:
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/record/{record_id}")
+    def get_record(record_id: str) -> str:
+        return record_id
+
+    def count(route: str, status: str) -> int:
+        return sum(metrics.HTTP_REQUEST_SECONDS._counts.get(("GET", route, status), []))
+
+    before = count("/record/{record_id}", "200"), count("unmatched", "404")
+    client = TestClient(app)
+    client.get("/record/one")
+    client.get("/record/two")
+    client.get("/no/such/route")
+
+    assert (count("/record/{record_id}", "200"), count("unmatched", "404")) == (before[0] + 2, before[1] + 1)
+    assert 'cameraman_http_request_duration_seconds_count{method="GET",route="/record/{record_id}"' in metrics.render()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import struct
+import time
+
+from feecc_cameraman.output import recover_orphaned_files, scan_mp4
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def write_old(path: str, content: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+
+    an_hour_ago = time.time() - 3600
+    os.utime(path, (an_hour_ago, an_hour_ago))
+
+
+def test_mp4_scan(tmp_path) -> None:
+    healthy = tmp_path / "healthy.mp4"
+    healthy.write_bytes(box(b"ftyp", b"isom") + box(b"moov", b"\0" * 16) + box(b"mdat", b"\0" * 64))
+    no_moov = tmp_path / "no_moov.mp4"
+    no_moov.write_bytes(box(b"ftyp", b"isom") + box(b"mdat", b"\0" * 64))
+    truncated = tmp_path / "truncated.mp4"
+    truncated.write_bytes((box(b"ftyp", b"isom") + box(b"moov") + box(b"moof", b"\0" * 64))[:-10])
+
+    assert scan_mp4(str(healthy)) == (True, False)
+    assert scan_mp4(str(no_moov)) == (False, False)
+    assert scan_mp4(str(truncated)) == (True, True)
+
+
+def test_recovery_pass_skips_healthy_fresh_and_used_files(tmp_path) -> None:
+    unfinished = box(b"ftyp", b"isom") + box(b"mdat", b"\0" * 64)
+    write_old(str(tmp_path / "healthy.mp4"), box(b"ftyp", b"isom") + box(b"moov") + box(b"mdat"))
+    write_old(str(tmp_path / "crashed.mp4"), unfinished)
+    write_old(str(tmp_path / "ongoing.mp4"), unfinished)
+    write_old(str(tmp_path / "leftover.remux.mp4"), b"")
+    (tmp_path / "fresh.mp4").write_bytes(unfinished)
+
+    outcomes = asyncio.run(recover_orphaned_files(lambda record_id: record_id == "ongoing", str(tmp_path)))
+
+    assert outcomes == {
+        str(tmp_path / "crashed.mp4"): "unrecoverable",
+        str(tmp_path / "leftover.remux.mp4"): "remove",
+    }
+    assert sorted(os.listdir(tmp_path)) == [
+        ".recovery.lock",
+        "crashed.mp4.broken",
+        "fresh.mp4",
+        "healthy.mp4",
+        "ongoing.mp4",
+    ]
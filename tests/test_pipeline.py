@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.pipeline import PostProcessor
+from feecc_cameraman.store import RecordStore
+
+CONTENT = bytes(range(256)) * 10000
+
+
+def process(tmp_path, monkeypatch, upload_sink: str) -> Recording:
+    store = RecordStore(str(tmp_path / "records.db"))
+    monkeypatch.setattr("feecc_cameraman.pipeline.RECORDS", store)
+    monkeypatch.setattr("feecc_cameraman.pipeline.UPLOAD_SINK", upload_sink)
+    monkeypatch.setattr("feecc_cameraman.pipeline.READ_CHUNK_SIZE", 64 * 1024)
+    video = tmp_path / "record.mp4"
+    video.write_bytes(CONTENT)
+    record = Recording(rtsp_steam="rtsp://camera", record_id="record", filename=str(video))
+
+    async def scenario() -> Recording:
+        await store.archive(record)
+        processor = PostProcessor(stages=["checksum", "upload"], workers=1, queue_size=1)
+        processor.start()
+        await processor.submit(record)
+        await processor._queue.join()  # type: ignore
+        await processor.stop()
+        archived = await store.get(record.record_id)
+        assert archived is not None
+        return archived
+
+    return asyncio.run(scenario())
+
+
+def test_checksum_and_local_upload_share_one_read_pass(tmp_path, monkeypatch) -> None:
+    record = process(tmp_path, monkeypatch, f"file://{tmp_path / 'sink'}")
+    postprocessing = record.metadata["postprocessing"]
+
+    assert postprocessing["state"] == "done"
+    assert postprocessing["stages"]["checksum"]["digest"] == hashlib.sha256(CONTENT).hexdigest()
+    assert postprocessing["stages"]["upload"]["size"] == len(CONTENT)
+    assert (tmp_path / "sink" / "record.mp4").read_bytes() == CONTENT
+
+
+def test_http_upload_is_streamed(tmp_path, monkeypatch) -> None:
+    uploads = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_PUT(self) -> None:
+            uploads[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        record = process(tmp_path, monkeypatch, f"http://127.0.0.1:{server.server_port}/bucket")
+    finally:
+        server.shutdown()
+
+    assert record.metadata["postprocessing"]["state"] == "done"
+    assert uploads == {"/bucket/record.mp4": CONTENT}
+
+
+def test_invalid_stage_config_is_refused(monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.pipeline.UPLOAD_SINK", "")
+
+    with pytest.raises(ValueError, match="Unknown post-processing stages: virus-scan"):
+        PostProcessor(stages=["checksum", "virus-scan"])
+
+    with pytest.raises(ValueError, match="UPLOAD_SINK"):
+        PostProcessor(stages=["upload"])
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import time
+
+from feecc_cameraman.preroll import Segment, SegmentRing
+
+# stitches the files of the concat list into the output file like `ffmpeg -f concat -c copy` would do
+FAKE_FFMPEG = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-i") + 1]) as list_file, open(args[-1], "wb") as output:
+    for line in list_file:
+        output.write(open(line.strip()[len("file '"):-1], "rb").read())
+"""
+
+
+def _ring(tmp_path, starts, size: int = 10) -> SegmentRing:
+    """a ring over segment files made at the given start times, each closed when the next one started"""
+    ring = SegmentRing(1, "rtsp://camera", dir_=str(tmp_path / "segments"))
+    os.makedirs(ring.dir)
+    ring._starts[0] = starts[0]  # the ffmpeg process was spawned
+
+    for number, (start, closed_at) in enumerate(zip(starts, [*starts[1:], time.time()])):
+        path = f"{ring.dir}/{number:09d}.ts"
+
+        with open(path, "wb") as f:
+            f.write(str(start).encode().ljust(size, b"."))
+
+        os.utime(path, (closed_at, closed_at))
+
+    ring.segments = ring._scan()
+    return ring
+
+
+def test_segment_starts_follow_their_predecessors(tmp_path) -> None:
+    ring = _ring(tmp_path, [100, 102.5, 104, 106.25])
+
+    assert ring.segments[1] == Segment(1, f"{ring.dir}/000000001.ts", 102.5, 10)
+    assert [segment.start for segment in ring.segments] == [100, 102.5, 104, 106.25]
+
+    os.remove(ring.segments[0].path)
+    assert [segment.number for segment in ring._scan()] == [1, 2, 3] and 0 not in ring._starts
+
+
+def test_oldest_segments_are_evicted_beyond_bounds(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.preroll.SEGMENT_RING_MAX_COUNT", 3)
+    ring = _ring(tmp_path, [100, 102, 104, 106, 108])
+
+    assert ring._evict() == [f"{ring.dir}/000000000.ts", f"{ring.dir}/000000001.ts"]
+    assert [segment.start for segment in ring.segments] == [104, 106, 108]
+
+
+def test_pinned_segments_are_kept_beyond_bounds(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.preroll.SEGMENT_RING_MAX_COUNT", 1)
+    monkeypatch.setattr("feecc_cameraman.preroll.PREROLL_SEC", 3)
+    ring = _ring(tmp_path, [100, 102, 104, 106, 108])
+    ring.pin("record", 106)
+
+    # the segment started at 102 holds the pre-roll of the recording
+    assert ring._evict() == [f"{ring.dir}/000000000.ts"] and ring.is_pinned
+
+    ring.unpin("record")
+    assert len(ring._evict()) == 3 and not ring.is_pinned
+    assert [segment.number for segment in ring.segments] == [4]
+
+
+def test_export_stitches_segments_covering_recording(tmp_path, monkeypatch) -> None:
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    monkeypatch.setattr("feecc_cameraman.preroll.FFMPEG_PROGRAM", str(ffmpeg))
+    monkeypatch.setattr("feecc_cameraman.preroll.PREROLL_SEC", 1)
+    ring = _ring(tmp_path, [100, 102, 104, 106, 108], size=4)
+    output = tmp_path / "record.mp4"
+
+    asyncio.run(ring.export(103.5, 105, str(output)))
+
+    assert output.read_bytes() == b"102.104."
+    assert not os.path.exists(f"{output}.txt")
+
+
+def test_housekeeping_survives_failures(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.preroll.FFMPEG_PROGRAM", str(tmp_path / "missing-ffmpeg"))
+    monkeypatch.setattr("feecc_cameraman.preroll.SEGMENT_DURATION_SEC", 0.02)
+    ring = SegmentRing(1, "rtsp://camera", dir_=str(tmp_path / "segments"))
+
+    def remove_files(paths) -> None:
+        raise PermissionError("read-only file system")
+
+    async def scenario() -> None:
+        await ring.start()
+        await asyncio.sleep(0.1)
+        assert ring._task is not None and not ring._task.done() and not ring.is_running
+
+        monkeypatch.setattr("feecc_cameraman.preroll.FFMPEG_PROGRAM", "cat")
+        monkeypatch.setattr(ring, "_ffmpeg_args", lambda: [])  # cat quits on the end of its input
+        monkeypatch.setattr("feecc_cameraman.preroll._remove_files", remove_files)
+        await asyncio.sleep(1.2)  # the spawn is retried after a backoff
+
+        assert ring.is_running
+        await ring.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_unresponsive_ffmpeg_is_terminated_on_stop(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.preroll.FFMPEG_PROGRAM", "sleep")
+    monkeypatch.setattr("feecc_cameraman.preroll.RING_QUIT_TIMEOUT_SEC", 0.2)
+    ring = SegmentRing(1, "rtsp://camera", dir_=str(tmp_path / "segments"))
+    monkeypatch.setattr(ring, "_ffmpeg_args", lambda: ["30"])  # sleep does not read its input
+
+    async def scenario() -> None:
+        await ring.start()
+
+        while not ring.is_running:
+            await asyncio.sleep(0.01)
+
+        process, task = ring._process, ring._task
+        await ring.stop()
+        assert process is not None and process.returncode is not None
+        assert task is not None and task.done()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
@@ -0,0 +1,42 @@
+import asyncio
+import sys
+import time
+
+from feecc_cameraman.progress import FfmpegMonitor, Progress
+
+
+def test_progress_lines_are_parsed() -> None:
+    progress = Progress()
+    assert progress.seconds_since_last_frame is None
+
+    for line in ["bitrate=N/A", "out_time_us=1500000", "speed=1.02x", "total_size=2048", "drop_frames=3"]:
+        progress.update(*line.split("="))
+
+    assert progress.out_time_sec == 1.5 and progress.speed == 1.02 and progress.bitrate_kbps is None
+    assert progress.total_size == 2048 and progress.drop_frames == 3
+    assert progress.last_frame_at is not None and progress.seconds_since_last_frame < 1
+
+    last_frame_at = progress.last_frame_at
+    time.sleep(0.01)
+    progress.update("out_time_us", "1500000")  # no new output since the last report
+    assert progress.last_frame_at == last_frame_at
+
+
+def test_overlong_log_line_does_not_stop_draining() -> None:
+    script = (
+        "import sys; sys.stderr.write('x' * 100000 + '\\nafter\\n'); sys.stderr.flush(); "
+        "print('frame=25\\nout_time_us=1000000\\nprogress=continue', flush=True)"
+    )
+
+    async def scenario() -> None:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", script, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        monitor = FfmpegMonitor(process, "camera")
+        await asyncio.wait_for(monitor.wait_closed(), 5)
+        await process.wait()
+
+        assert monitor.log[-1] == "after"
+        assert monitor.progress.frame == 25 and monitor.progress.out_time_sec == 1.0
+
+    asyncio.run(scenario())
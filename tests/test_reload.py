@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from feecc_cameraman.camera import Camera
+from feecc_cameraman.health import CameraHealth
+from feecc_cameraman.reload import apply_cameras_config
+
+
+def test_camera_construction_does_no_io() -> None:
+    started_at = time.monotonic()
+    Camera(number=1, socket_address="10.255.255.1:554", rtsp_stream_link="rtsp://10.255.255.1:554")
+    assert time.monotonic() - started_at < 0.05
+
+
+def test_reload_applies_only_the_difference(monkeypatch) -> None:
+    cameras = {
+        1: Camera(1, "127.0.0.1:1", "rtsp://one"),
+        2: Camera(2, "127.0.0.1:2", "rtsp://two"),
+        3: Camera(3, "127.0.0.1:3", "rtsp://three"),
+    }
+    unchanged = cameras[1]
+    health = {number: CameraHealth(is_up=True) for number in cameras}
+    monkeypatch.setattr("feecc_cameraman.reload.CAMERAS", cameras)
+    monkeypatch.setattr("feecc_cameraman.reload.HEALTH", health)
+
+    async def scenario() -> None:
+        diff = await apply_cameras_config(
+            ["1-127.0.0.1:1-rtsp://one", "2-127.0.0.1:2-rtsp://new", "4-127.0.0.1:4-rtsp://four"]
+        )
+
+        assert (diff.added, diff.removed, diff.changed) == ([4], [3], [2])
+        assert sorted(cameras) == [1, 2, 4]
+        assert cameras[1] is unchanged and cameras[2].rtsp_stream_link == "rtsp://new"
+        assert list(health) == [1]
+
+    asyncio.run(scenario())
+
+
+def test_reload_with_an_invalid_socket_address_is_rejected_as_a_whole(monkeypatch) -> None:
+    cameras = {1: Camera(1, "127.0.0.1:1", "rtsp://one")}
+    monkeypatch.setattr("feecc_cameraman.reload.CAMERAS", cameras)
+
+    for invalid in ("5-10.0.0.5-rtsp://x", "5-10.0.0.5:rtsp-rtsp://x", "5-:554-rtsp://x", "5-10.0.0.5:70000-rtsp://x"):
+        with pytest.raises(ValueError, match="expected 'number-ip:port-rtsp_link'"):
+            asyncio.run(apply_cameras_config(["2-127.0.0.1:2-rtsp://two", invalid]))
+
+    assert list(cameras) == [1]
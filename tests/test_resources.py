@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from feecc_cameraman.resources import CapacityError, ResourceScheduler
+
+
+def test_recordings_beyond_budget_are_refused_until_one_ends() -> None:
+    resources = ResourceScheduler(cpu=8, processes=2)
+    resources.reserve_capture("a", 1)
+    resources.reserve_capture("b", 1)
+
+    with pytest.raises(CapacityError, match="processes") as refused:
+        resources.reserve_capture("c", 1)
+
+    assert refused.value.status_code == 503 and refused.value.retry_after > 0
+
+    resources.release_capture("a")
+    resources.reserve_capture("c", 1)
+    assert set(resources.captures) == {"b", "c"}
+
+
+def test_start_bursts_are_queued_then_refused() -> None:
+    resources = ResourceScheduler(concurrent_starts=1, start_queue_size=1)
+
+    async def scenario() -> None:
+        release = asyncio.Event()
+        order = []
+
+        async def start(name: str) -> None:
+            async with resources.start_slot():
+                order.append(name)
+                await release.wait()
+
+        first, queued = asyncio.create_task(start("first")), asyncio.create_task(start("queued"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(CapacityError) as refused:
+            await start("refused")
+
+        assert refused.value.status_code == 429 and refused.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(first, queued)
+        assert order == ["first", "queued"]
+
+    asyncio.run(scenario())
+
+
+def test_recordings_take_priority_over_background_jobs() -> None:
+    resources = ResourceScheduler(cpu=1, processes=3)
+
+    async def scenario() -> None:
+        async with resources.background_job("checksum", 0.5, processes=1):
+            # recordings are admitted regardless of the background jobs
+            resources.reserve_capture("a", 1)
+            resources.reserve_capture("b", 1)
+
+        job_started = asyncio.Event()
+
+        async def transcode() -> None:
+            async with resources.background_job("transcoding", 1, processes=1):
+                job_started.set()
+
+        job = asyncio.create_task(transcode())
+        await asyncio.sleep(0.01)
+        assert not job_started.is_set()
+
+        resources.release_capture("a")
+        await asyncio.sleep(0.01)
+        assert not job_started.is_set()
+
+        resources.release_capture("b")
+        await asyncio.wait_for(job, 1)
+        assert not resources.background
+
+    asyncio.run(scenario())
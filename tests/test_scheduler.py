@@ -0,0 +1,73 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.scheduler import DeadlineScheduler
+
+
+def make_record(record_id: str, started_ago: float = 0, camera_number: int = 1) -> Recording:
+    return Recording(
+        rtsp_steam="rtsp://camera",
+        record_id=record_id,
+        camera_number=camera_number,
+        start_time=datetime.now() - timedelta(seconds=started_ago),
+    )
+
+
+def test_deadlines_fire_in_time_and_can_be_cancelled() -> None:
+    scheduler = DeadlineScheduler(concurrency=4)
+    fired = {}
+
+    async def on_deadline(record: Recording) -> None:
+        fired[record.record_id] = time.monotonic()
+
+    async def scenario() -> None:
+        started_at = time.monotonic()
+        runner = asyncio.create_task(scheduler.run(on_deadline))
+        scheduler.schedule(make_record("late"), max_duration=1)
+        scheduler.schedule(make_record("early", started_ago=9.8), max_duration=10)
+        scheduler.schedule(make_record("cancelled"), max_duration=1)
+        scheduler.cancel("cancelled")
+        await asyncio.sleep(1.2)
+        runner.cancel()
+
+        assert set(fired) == {"early", "late"}
+        assert fired["early"] - started_at < 0.4
+        assert 0.9 < fired["late"] - started_at < 1.2
+        assert not len(scheduler)
+
+    asyncio.run(scenario())
+
+
+def test_stops_run_concurrently_with_limited_parallelism() -> None:
+    scheduler = DeadlineScheduler(concurrency=2)
+    running, peak = 0, 0
+
+    async def on_deadline(record: Recording) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.1)
+        running -= 1
+
+    async def scenario() -> None:
+        runner = asyncio.create_task(scheduler.run(on_deadline))
+
+        for number in range(5):
+            scheduler.schedule(make_record(str(number), started_ago=10), max_duration=1)
+
+        await asyncio.sleep(0.45)
+        runner.cancel()
+
+    asyncio.run(scenario())
+    assert peak == 2 and running == 0
+
+
+def test_max_duration_resolution(monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.scheduler.CAMERA_MAX_RECORD_DURATIONS", {2: 60})
+    scheduler = DeadlineScheduler()
+
+    assert scheduler.get_max_duration(make_record("a", camera_number=2)) == 60
+    assert scheduler.get_max_duration(make_record("b", camera_number=2), max_duration=5) == 5
+    assert scheduler.get_max_duration(make_record("c", camera_number=3)) == 60 * 60
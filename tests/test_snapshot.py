@@ -0,0 +1,64 @@
+import asyncio
+import os
+import stat
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from feecc_cameraman.snapshot import Snapshot, SnapshotFeed, snapshot_response
+
+FAKE_DECODER = f"""#!{sys.executable}
+import sys, time
+time.sleep(1)  # a decoder slower to start than the idle timeout
+for frame in range(1000):
+    sys.stdout.buffer.write(b"\\xff\\xd8frame %d\\xff\\xd9" % frame)
+    sys.stdout.buffer.flush()
+    time.sleep(0.05)
+"""
+
+
+def install_fake_ffmpeg(tmp_path, monkeypatch) -> None:
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_DECODER)
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_feed_keeps_latest_frame_and_stops_when_idle(tmp_path, monkeypatch) -> None:
+    install_fake_ffmpeg(tmp_path, monkeypatch)
+    monkeypatch.setattr("feecc_cameraman.snapshot.SNAPSHOT_IDLE_TIMEOUT_SEC", 0.5)
+    monkeypatch.setattr("feecc_cameraman.snapshot.SNAPSHOT_RESTART_DELAY_SEC", 0.1)
+
+    async def scenario() -> None:
+        feed = SnapshotFeed(1, "rtsp://camera")
+        first = await feed.get(timeout=5)
+        assert first is not None and first.jpeg.startswith(b"\xff\xd8frame ")
+        await asyncio.sleep(0.3)
+
+        latest = await feed.get()
+        assert latest is not None and latest.jpeg != first.jpeg and latest.etag != first.etag
+        assert feed.is_running
+
+        await asyncio.sleep(2)
+        assert not feed.is_running and feed.snapshot is None
+
+    asyncio.run(scenario())
+
+
+def test_snapshot_response_is_conditional() -> None:
+    app = FastAPI()
+    image = Snapshot(b"\xff\xd8image\xff\xd9", '"etag"', time.time())
+
+    @app.get("/snapshot")
+    async def snapshot(request: Request):  # type: ignore
+        return snapshot_response(image, request)
+
+    client = TestClient(app)
+    response = client.get("/snapshot")
+    assert response.status_code == 200 and response.content == image.jpeg
+    assert response.headers["content-type"] == "image/jpeg" and response.headers["cache-control"] == "max-age=1"
+
+    assert client.get("/snapshot", headers={"if-none-match": '"other", "etag"'}).status_code == 304
+    assert client.get("/snapshot", headers={"if-none-match": '"other"'}).status_code == 200
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from feecc_cameraman.state import (
+    FORWARDED_HEADER,
+    Cluster,
+    ClusterRoutingMiddleware,
+    InMemoryStateBackend,
+    RecordOwnership,
+    SqliteStateBackend,
+    Worker,
+)
+
+FIRST, SECOND = Worker("first", "127.0.0.1:1"), Worker("second", "127.0.0.1:2")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryStateBackend()
+
+    return SqliteStateBackend(str(tmp_path / "state.db"))
+
+
+def test_camera_lease_is_held_until_released_or_expired(backend) -> None:
+    async def scenario() -> None:
+        assert await backend.acquire_camera(1, FIRST, ttl=0.2) == FIRST
+        assert await backend.acquire_camera(1, SECOND, ttl=0.2) == FIRST
+        assert await backend.acquire_camera(1, FIRST, ttl=0.2) == FIRST  # renewal
+
+        await backend.release_camera(1, SECOND)  # only the owner releases a lease
+        assert await backend.acquire_camera(1, SECOND, ttl=0.2) == FIRST
+
+        await backend.release_camera(1, FIRST)
+        assert await backend.acquire_camera(1, SECOND, ttl=0.2) == SECOND
+
+        await asyncio.sleep(0.3)
+        assert await backend.acquire_camera(1, FIRST, ttl=0.2) == FIRST
+
+    asyncio.run(scenario())
+
+
+def test_record_ownership_lapses_unless_renewed(backend) -> None:
+    first = RecordOwnership("a", 1, "a.mp4", time.time(), FIRST)
+    second = RecordOwnership("b", 2, "b.mp4", time.time(), SECOND)
+
+    async def scenario() -> None:
+        await backend.register_record(first, ttl=0.3)
+        await backend.register_record(second, ttl=0.3)
+        assert await backend.get_record("a") == first
+        assert sorted(ownership.record_id for ownership in await backend.get_records()) == ["a", "b"]
+
+        await asyncio.sleep(0.2)
+        await backend.renew_records(FIRST, ttl=0.3)
+        await asyncio.sleep(0.2)
+
+        assert await backend.get_record("a") == first
+        assert await backend.get_record("b") is None  # the second worker died
+        assert await backend.get_records() == [first]
+
+        await backend.forget_record("a")
+        assert await backend.get_record("a") is None and await backend.get_records() == []
+
+    asyncio.run(scenario())
+
+
+def test_worker_address_lapses_unless_renewed(backend) -> None:
+    async def scenario() -> None:
+        await backend.register_worker(FIRST, ttl=0.2)
+        await backend.register_worker(SECOND, ttl=0.2)
+        await asyncio.sleep(0.1)
+        await backend.register_worker(FIRST, ttl=0.2)
+        await asyncio.sleep(0.15)
+
+        assert await backend.get_worker("first") == FIRST
+        assert await backend.get_worker("second") is None
+
+    asyncio.run(scenario())
+
+
+class _Owner(BaseHTTPRequestHandler):
+    """stands for the internal listener of the owner worker, echoes the request back"""
+
+    def do_POST(self) -> None:
+        body = json.dumps({"path": self.path, "forwarded_by": self.headers.get(FORWARDED_HEADER)}).encode()
+        self.send_response(201)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def test_requests_are_forwarded_to_owner_worker(tmp_path, monkeypatch) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Owner)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    owner = Worker("owner", f"127.0.0.1:{server.server_address[1]}")
+
+    cluster = Cluster("sqlite")
+    cluster._backend = SqliteStateBackend(str(tmp_path / "state.db"))
+    cluster.worker = Worker("local", "127.0.0.1:1")
+    monkeypatch.setattr("feecc_cameraman.state.CLUSTER", cluster)
+
+    async def setup() -> None:
+        await cluster.backend.acquire_camera(7, owner, ttl=60)
+        await cluster.backend.register_record(RecordOwnership("remote", 7, "r.mp4", time.time(), owner), ttl=60)
+        await cluster.backend.register_worker(owner, ttl=60)
+
+    asyncio.run(setup())
+
+    app = FastAPI()
+
+    @app.post("/camera/{camera_number}/start")
+    @app.post("/camera/{camera_number}/stop")
+    @app.post("/record/{record_id}/stop")
+    @app.get("/job/{job_id}")
+    async def local() -> dict:
+        return {"path": "local"}
+
+    client = TestClient(ClusterRoutingMiddleware(app))
+
+    try:
+        camera = client.post("/camera/7/start", params={"duration": 5})
+        assert camera.status_code == 201
+        assert camera.json() == {"path": "/camera/7/start?duration=5", "forwarded_by": "local"}
+
+        assert client.post("/record/remote/stop").json()["path"] == "/record/remote/stop"
+        assert client.post("/record/unknown/stop").json() == {"path": "local"}
+        assert client.post("/camera/8/stop").json() == {"path": "local"}  # the camera is leased by this worker
+
+        job_id = f"owner.{uuid4().hex}"
+        assert client.get(f"/job/{job_id}").json()["path"] == f"/job/{job_id}"
+        assert client.get(f"/job/gone.{uuid4().hex}").json() == {"path": "local"}  # the worker is dead
+        assert client.get(f"/job/{cluster.new_job_id()}").json() == {"path": "local"}
+
+        # a client posing as another worker is still routed
+        forwarded = client.post("/camera/7/start", headers={FORWARDED_HEADER: "other"})
+        assert forwarded.json()["forwarded_by"] == "local"
+
+        cluster.worker = Worker("local", "127.0.0.1:80")  # the test client reaches the internal listener now
+        assert client.post("/camera/7/start", headers={FORWARDED_HEADER: "other"}).json() == {"path": "local"}
+    finally:
+        server.shutdown()
+
+
+def test_startup_fails_if_internal_listener_cannot_bind(tmp_path, monkeypatch) -> None:
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    monkeypatch.setattr("feecc_cameraman.state.WORKER_PORT", taken.getsockname()[1])
+
+    cluster = Cluster("sqlite")
+    cluster._backend = SqliteStateBackend(str(tmp_path / "state.db"))
+
+    try:
+        with pytest.raises(RuntimeError, match="Internal listener failed to start"):
+            asyncio.run(asyncio.wait_for(cluster.start(FastAPI(), set), 5))
+    finally:
+        taken.close()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.storage import InsufficientStorageError, StorageManager
+from feecc_cameraman.store import RecordStore
+
+
+def test_quotas_evict_oldest_files_except_held_ones(tmp_path, monkeypatch) -> None:
+    store = RecordStore(str(tmp_path / "records.db"))
+    monkeypatch.setattr("feecc_cameraman.storage.RECORDS", store)
+    directory = tmp_path / "video"
+    directory.mkdir()
+    now = time.time()
+
+    async def scenario() -> None:
+        for age, record_id, camera_number in [(40, "a", 1), (30, "b", 1), (20, "c", 2), (10, "d", 1)]:
+            video = directory / f"{record_id}.mp4"
+            video.write_bytes(b"0" * 1000)
+            os.utime(video, (now - age, now - age))
+            await store.archive(Recording("", record_id=record_id, camera_number=camera_number, filename=str(video)))
+
+        storage = StorageManager(directory=str(directory), quota_bytes=2500, camera_quotas={2: 0})
+        await storage.build_index()
+        assert storage.total_bytes == 4000 and storage.camera_bytes == {1: 3000, 2: 1000}
+
+        storage.hold("a")
+        assert sorted(await storage.enforce_limits()) == ["b", "c"]
+        assert storage.total_bytes == 2000 and storage.camera_bytes == {1: 2000, 2: 0}
+        assert sorted(os.listdir(directory)) == ["a.mp4", "d.mp4"]
+
+        evicted = await store.get("b")
+        assert evicted is not None and "evicted_at" in evicted.metadata
+
+    asyncio.run(scenario())
+
+
+def test_admission_accounts_for_ongoing_recordings(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr("feecc_cameraman.storage.MIN_FREE_SPACE_BYTES", 0)
+    storage = StorageManager(directory=str(tmp_path))
+    storage._bitrates[1] = 8000  # 1 MB/s
+    storage._disk_free, storage._disk_checked_at = 100 * 10**6, time.monotonic()
+
+    async def scenario() -> None:
+        await storage.admit(1, max_duration=90)
+
+        monkeypatch.setattr(storage, "_reserved_bytes", lambda: 20 * 10**6)
+        with pytest.raises(InsufficientStorageError):
+            await storage.admit(1, max_duration=90)
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.store import RecordStore
+
+
+def make_record(number: int, camera_number: int, error: str = None) -> Recording:
+    start_time = datetime(2022, 3, 1) + timedelta(minutes=number)
+    return Recording(
+        rtsp_steam="rtsp://camera",
+        record_id=f"record-{number:03}",
+        filename=f"output/video/record-{number:03}.mp4",
+        camera_number=camera_number,
+        start_time=start_time,
+        end_time=start_time + timedelta(seconds=30),
+        error=error,
+    )
+
+
+def test_archive_moves_records_out_of_memory(tmp_path) -> None:
+    store = RecordStore(str(tmp_path / "records.db"))
+    record = make_record(1, camera_number=1)
+    record.metadata["size"] = 1024
+    store[record.record_id] = record
+
+    async def scenario() -> None:
+        await store.archive(record)
+        assert record.record_id not in store
+        archived = await store.get(record.record_id)
+        assert archived is not None
+        assert archived.end_time == record.end_time and archived.metadata == {"size": 1024}
+        assert not archived.is_ongoing
+        assert await store.get("missing") is None
+
+    asyncio.run(scenario())
+
+
+def test_query_pagination_and_filters(tmp_path) -> None:
+    store = RecordStore(str(tmp_path / "records.db"))
+
+    async def scenario() -> None:
+        for number in range(25):
+            await store.archive(make_record(number, camera_number=number % 2, error="boom" if number == 7 else None))
+
+        seen, cursor = [], None
+
+        while True:
+            page, cursor = await store.query(limit=10, cursor=cursor)
+            seen.extend(record.record_id for record in page)
+
+            if cursor is None:
+                break
+
+        assert seen == [f"record-{number:03}" for number in reversed(range(25))]
+
+        page, _ = await store.query(camera_number=1, limit=100)
+        assert len(page) == 12 and all(record.camera_number == 1 for record in page)
+
+        page, _ = await store.query(state="failed")
+        assert [record.record_id for record in page] == ["record-007"]
+
+        page, _ = await store.query(since=datetime(2022, 3, 1, 0, 20), until=datetime(2022, 3, 1, 0, 22))
+        assert [record.record_id for record in page] == ["record-021", "record-020"]
+
+    asyncio.run(scenario())
+
+
+def test_invalid_cursors_are_rejected_and_unstarted_records_get_none(tmp_path) -> None:
+    store = RecordStore(str(tmp_path / "records.db"))
+
+    async def scenario() -> None:
+        for number in range(3):
+            await store.archive(make_record(number, camera_number=1))
+
+        await store.archive(Recording(rtsp_steam="", record_id="never-started", filename="never-started.mp4"))
+
+        for cursor in ("garbage", "None_record-001", "nan_record-001", "1646082000.0_", "1646082000.0"):
+            with pytest.raises(ValueError, match="Invalid cursor"):
+                await store.query(cursor=cursor)
+
+        page, cursor = await store.query(limit=3)
+        assert len(page) == 3 and cursor is not None
+        page, cursor = await store.query(limit=1, cursor=cursor)
+        assert [record.record_id for record in page] == ["never-started"] and cursor is None
+
+    asyncio.run(scenario())
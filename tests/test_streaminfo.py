@@ -0,0 +1,46 @@
+import asyncio
+
+from feecc_cameraman.camera import build_ffmpeg_argv
+from feecc_cameraman.streaminfo import StreamInfoCache, StreamParams, parse_stream_info
+
+FFMPEG_OUTPUT = """Input #0, rtsp, from 'rtsp://camera/101':
+  Duration: N/A, start: 0.080000, bitrate: N/A
+  Stream #0:0: Video: h264 (High), yuvj420p(pc, bt709, progressive), 1920x1080, 25 fps, 25 tbr, 90k tbn
+  Stream #0:1: Audio: pcm_alaw, 8000 Hz, mono, s16, 64 kb/s
+Output #0, mp4, to 'video.mp4':
+  Stream #0:0: Video: h264 (High) (avc1 / 0x31637661), yuvj420p, 1920x1080, q=2-31, 25 fps, 90k tbn
+"""
+STREAMS = (StreamParams("Video", "h264", "1920x1080", "90k"), StreamParams("Audio", "pcm_alaw", None, "8000"))
+
+
+def test_parse_stream_info() -> None:
+    assert parse_stream_info(FFMPEG_OUTPUT) == STREAMS
+
+
+def test_stream_link_is_a_single_argument() -> None:
+    link = "rtsp://user:pa ss@camera/101; rm -rf /"
+    argv = build_ffmpeg_argv(link, "video.mp4", ["-probesize", "32768"])
+
+    assert link in argv and "video.mp4" == argv[-1]
+    assert argv[argv.index(link) - 3 : argv.index(link)] == ["-probesize", "32768", "-i"]
+
+
+def test_fast_probe_is_dropped_on_mismatch(monkeypatch) -> None:
+    cache = StreamInfoCache()
+    probed = [STREAMS]
+
+    async def probe_file(filename: str):
+        return probed.pop(0)
+
+    monkeypatch.setattr("feecc_cameraman.streaminfo.probe_file", probe_file)
+
+    async def scenario() -> None:
+        assert not cache.input_args("rtsp://camera")
+        await cache.update("rtsp://camera", "full.mp4", fast=False)
+        assert cache.get("rtsp://camera") == STREAMS and cache.input_args("rtsp://camera")
+
+        probed.append(STREAMS[:1])  # the audio stream was not found with a small probe
+        await cache.update("rtsp://camera", "fast.mp4", fast=True)
+        assert cache.get("rtsp://camera") is None and not cache.input_args("rtsp://camera")
+
+    asyncio.run(scenario())
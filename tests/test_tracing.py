@@ -0,0 +1,53 @@
+import asyncio
+import typing as tp
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from feecc_cameraman.tracing import TracingMiddleware, span
+from logging_config import RepeatSampler
+
+
+def test_request_logs_carry_trace_id_and_spans() -> None:
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+    records: tp.List[tp.Dict[str, tp.Any]] = []
+
+    @app.get("/start")
+    async def start() -> None:
+        with span("probe"):
+            await asyncio.sleep(0.01)
+
+        with span("spawn"):
+            asyncio.create_task(asyncio.sleep(0))
+            logger.info("spawned")
+
+    handler = logger.add(lambda message: records.append(message.record), level="DEBUG")
+
+    try:
+        response = TestClient(app).get("/start", headers={"x-request-id": "trace-1"})
+    finally:
+        logger.remove(handler)
+
+    assert response.headers["x-request-id"] == "trace-1"
+    assert all(record["extra"]["trace_id"] == "trace-1" for record in records)
+    summary = records[-1]["extra"]
+    assert list(summary["spans"]) == ["probe", "spawn"] and summary["spans"]["probe"] >= 0.01
+
+
+def test_sampler_suppresses_repeated_messages() -> None:
+    sampler = RepeatSampler(interval=60)
+    passed: tp.List[tp.Dict[str, tp.Any]] = []
+    handler = logger.add(lambda message: passed.append(message.record), level="DEBUG", filter=sampler)
+
+    try:
+        for _ in range(5):
+            logger.info("camera is unreachable")
+
+        logger.warning("camera is unreachable")
+    finally:
+        logger.remove(handler)
+
+    assert [record["level"].name for record in passed] == ["INFO", "WARNING"]
+    assert sampler._sites[next(iter(sampler._sites))][1] == 4
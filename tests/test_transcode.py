@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from feecc_cameraman.camera import Recording
+from feecc_cameraman.store import RecordStore
+from feecc_cameraman.streaminfo import StreamParams
+from feecc_cameraman.transcode import Transcoder, TranscodingError, TranscodingProfile
+
+ORIGINAL = b"original" * 1000
+H264 = (StreamParams("Video", "h264", "1280x720"), StreamParams("Audio", "aac", None, "48000"))
+
+
+def transcode(tmp_path, monkeypatch, output: bytes, output_duration: float) -> Recording:
+    store = RecordStore(str(tmp_path / "records.db"))
+    monkeypatch.setattr("feecc_cameraman.transcode.RECORDS", store)
+    monkeypatch.setattr("feecc_cameraman.transcode.get_profile", lambda record: TranscodingProfile("small", height=720))
+    video = tmp_path / "record.mp4"
+    video.write_bytes(ORIGINAL)
+    record = Recording(rtsp_steam="rtsp://camera", record_id="record", filename=str(video), camera_number=1)
+
+    async def run_ffmpeg(self, profile, source: str, destination: str) -> None:
+        with open(destination, "wb") as f:
+            f.write(output)
+
+    async def describe_file(filename: str):
+        return H264, 60.0 if filename == str(video) else output_duration
+
+    monkeypatch.setattr(Transcoder, "_run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr("feecc_cameraman.transcode.describe_file", describe_file)
+
+    async def scenario() -> None:
+        await store.archive(record)
+        await Transcoder(cpu_budget=1).transcode(record)
+
+    asyncio.run(scenario())
+    return record
+
+
+def test_original_is_replaced_with_verified_output(tmp_path, monkeypatch) -> None:
+    record = transcode(tmp_path, monkeypatch, b"small", 60.2)
+
+    assert (tmp_path / "record.mp4").read_bytes() == b"small"
+    assert record.metadata["transcoding"]["state"] == "done"
+    assert record.metadata["transcoding"]["original_size"] - record.metadata["transcoding"]["size"] == len(ORIGINAL) - 5
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".mp4"] == ["record.mp4"]
+
+
+def test_original_is_kept_if_output_is_truncated(tmp_path, monkeypatch) -> None:
+    with pytest.raises(TranscodingError, match="duration"):
+        transcode(tmp_path, monkeypatch, b"small", 12.0)
+
+    assert (tmp_path / "record.mp4").read_bytes() == ORIGINAL
+    assert not (tmp_path / "record.transcode.mp4").exists()
+
+
+def test_cpu_budget_bounds_threads_and_workers() -> None:
+    transcoder = Transcoder(cpu_budget=5, threads=2)
+    assert (transcoder.workers_count, transcoder.threads) == (2, 2)
+    assert "-threads" in TranscodingProfile("small").ffmpeg_args("in.mp4", "out.mp4", transcoder.threads)
+
+
+def test_worker_survives_failing_bookkeeping(tmp_path, monkeypatch) -> None:
+    submitted = []
+
+    async def transcode(self, record: Recording) -> None:
+        raise TranscodingError("ffmpeg exited with code 1")
+
+    async def set_state(self, record: Recording, state: str, **details) -> None:
+        raise OSError("database is locked")
+
+    async def submit(record: Recording) -> None:
+        submitted.append(record.record_id)
+
+        if len(submitted) == 1:
+            raise RuntimeError("post-processing queue is gone")
+
+    monkeypatch.setattr("feecc_cameraman.transcode.trim_idle", lambda *args: asyncio.sleep(0))
+    monkeypatch.setattr("feecc_cameraman.transcode.POSTPROCESSOR.submit", submit)
+    monkeypatch.setattr(Transcoder, "transcode", transcode)
+    monkeypatch.setattr(Transcoder, "_set_state", set_state)
+
+    async def scenario() -> None:
+        transcoder = Transcoder(cpu_budget=1)
+        transcoder._queue = asyncio.Queue()
+        transcoder._workers = [worker := asyncio.create_task(transcoder._work())]
+
+        for record_id in ("first", "second"):
+            transcoder._queue.put_nowait(Recording("rtsp://camera", record_id=record_id))
+
+        await asyncio.wait_for(transcoder._queue.join(), 5)
+        assert not worker.done()
+        await transcoder.stop()
+
+    asyncio.run(scenario())
+    assert submitted == ["first", "second"]